@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Capture of the OBS events
+
+The events received from OBS are appended to a file (<capture_file>), to
+be replayed later (see replay.py). One compact JSON value per line:
+    {"capture":1,"time":1600000000.123}    start of a session (unix time)
+    [12.345678,{"update-type":"SwitchScenes","scene-name":"HDMI 1",...}]
+The time of an event is in seconds since the start of its session
+(monotonic clock). The events are stored like obs-websocket v4 sends them
+(v5 events translated, see _obsv5), the actual status requested on every
+(re-)connect as ScenesChanged, PreviewSceneChanged and SwitchScenes.
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import json
+import logging
+
+from threading import Lock
+from time import monotonic, time
+# own
+from _debugtools import debug, error, sampled
+
+
+''' constants '''
+FORMAT = 1
+# events not captured (only to monitor the connection)
+SKIPPED = ('Heartbeat',)
+
+
+def _line(value):
+    return json.dumps(value, separators=(',', ':')) + '\n'
+
+
+class capture(object):
+    '''
+    appends the events to the file (line buffered, a crash loses nothing)
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self._start = None
+        self._lock = Lock()
+
+    def open(self):
+        """
+        start a new session at the end of the file, False if the file can
+        not be written
+        """
+        try:
+            self.file = open(self.path, 'a', buffering=1, encoding='utf-8')
+        except OSError as e:
+            error("could not capture the events to '%s': %s", self.path, e)
+            return False
+        self._start = monotonic()
+        self._write({'capture': FORMAT, 'time': round(time(), 3)})
+        debug("capturing the events to '%s'", self.path)
+        return True
+
+    def close(self):
+        """
+        stop capturing
+        """
+        with self._lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def write(self, message):
+        """
+        capture an event (event object of obswebsocket)
+        """
+        if message.name in SKIPPED:
+            return
+        data = dict(message.datain)
+        data['update-type'] = message.name
+        self.write_data(data)
+
+    def write_data(self, data):
+        """
+        capture an event (dictionary incl. 'update-type')
+        """
+        self._write([round(monotonic() - self._start, 6), data])
+
+    def _write(self, value):
+        with self._lock:
+            if not self.file:
+                return
+            try:
+                self.file.write(_line(value))
+            except (OSError, TypeError, ValueError) as e:
+                sampled("event not captured to %s: %s", self.path, e,
+                        level=logging.WARNING, interval=60)
+
+
+def read(path):
+    """
+    generator of the captured events (time, dictionary): the time in
+    seconds since the start of the first session, the sessions follow
+    each other (by their unix time)
+    """
+    first = None
+    offset = last = 0.0
+    with open(path, encoding='utf-8') as f:
+        for nr, line in enumerate(f, 1):
+            try:
+                value = json.loads(line)
+            except ValueError:
+                debug("%s:%s: invalid line, ignored", path, nr)
+                continue
+            if isinstance(value, dict) and 'capture' in value:
+                if first is None:
+                    first = value.get('time', 0)
+                offset = max(last, value.get('time', 0) - first)
+            elif isinstance(value, list) and len(value) == 2:
+                last = offset + value[0]
+                yield last, value[1]
+
+
+def event(data):
+    """
+    the event object (of obswebsocket) of a captured event, None if unknown
+    """
+    from obswebsocket import events
+    cls = getattr(events, str(data.get('update-type')), None)
+    if cls is None:
+        return None
+    obj = cls()
+    obj.input(data)
+    return obj
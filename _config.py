@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Configuration model
+
+The XML-file is compiled once into a validated model (sections, items,
+GPIOs) and cached by the modification time and content hash of the file:
+a reload (SIGHUP) of an unchanged file and further tallies of the same
+process (see multitally) do not parse it again.
+
+    <data>
+        <backend>...</backend>          output backends (see _outputs)
+        <obswebsocket>...</obswebsocket> one section per OBS, with options,
+                                        gpio_* and its scenes/sources
+        <multicast>...</multicast>      section of the tally receiver
+        <scene>, <source>, <channel>    items (outside of a section: of
+                                        the first OBS)
+    </data>
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import hashlib
+import os
+
+from threading import Lock
+from xml.etree import ElementTree
+# own
+from _multicast import MAX_CHANNEL
+from _outputs import BACKENDS, DEFAULT_BACKEND, space
+
+
+''' constants '''
+# sections and the items they can contain (None: the top level)
+SECTIONS = {
+    None: ('scene', 'source', 'channel'),
+    'obswebsocket': ('scene', 'source'),
+    'multicast': (),
+    }
+# options of the sections (all other tags are invalid)
+OPTIONS = {
+    'obswebsocket': ('port', 'pass', 'protocol', 'liveness', 'probe_timeout',
+                     'ping_interval', 'ping_misses', 'log_level',
+                     'fanout_port', 'multicast_group', 'multicast_port',
+                     'multicast_ttl', 'metrics_port', 'coalesce_window',
+                     'capture_file', 'state_cache'),
+    'multicast': ('group', 'port', 'metrics_port'),
+    }
+# LED types (gpio_*) of the sections and of the items
+LEDS = {
+    'section': ('connected',),
+    'item': ('program', 'preview'),
+    }
+# tags of the top level, besides the items (see compile)
+TOP = ('backend', 'obswebsocket', 'multicast')
+# options with numeric values
+NUMBERS = {
+    'port': int,
+    'protocol': int,
+    'probe_timeout': float,
+    'ping_interval': float,
+    'ping_misses': int,
+    'fanout_port': int,
+    'multicast_port': int,
+    'multicast_ttl': int,
+    'metrics_port': int,
+    'coalesce_window': float,
+    }
+
+
+class configerror(ValueError):
+    '''
+    invalid configuration (the message tells why)
+    '''
+
+
+class item(object):
+    '''
+    a <scene>, <source> or <channel>
+    gpio: LED type => GPIO number (negative: inverted)
+    backend: LED type => name of the output backend
+    channel: the tally channel (multicast) or None
+    led: LED type => output (runtime, each copy has its own)
+    '''
+    __slots__ = ('tag', 'name', 'gpio', 'backend', 'channel', 'led')
+
+    def __init__(self, tag, name=None):
+        self.tag = tag
+        self.name = name
+        self.gpio = {}
+        self.backend = {}
+        self.channel = None
+        self.led = {}
+
+    def copy(self):
+        """
+        the same item, without LEDs
+        """
+        i = item(self.tag, self.name)
+        i.gpio = self.gpio
+        i.backend = self.backend
+        i.channel = self.channel
+        return i
+
+    def same_output(self, other, typ):
+        """
+        True if the LED type is connected to the same output in both items
+        """
+        return typ in self.gpio and self.gpio.get(typ) == other.gpio.get(typ) \
+            and self.backend.get(typ) == other.backend.get(typ)
+
+    def __repr__(self):
+        return "<{} '{}' {}>".format(self.tag, self.name, self.gpio)
+
+
+class section(object):
+    '''
+    an <obswebsocket> or <multicast> block (or the top level)
+    options: tag => value of all other tags (numbers converted)
+    hosts: list of (network or None, host)
+    gpio, backend: like item (e.g. 'connected')
+    items: tag => name => item
+    '''
+    __slots__ = ('tag', 'options', 'hosts', 'gpio', 'backend', 'items')
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.options = {}
+        self.hosts = []
+        self.gpio = {}
+        self.backend = {}
+        self.items = dict((t, {}) for t in SECTIONS[tag])
+
+
+class config(object):
+    '''
+    the compiled XML-file
+    '''
+    __slots__ = ('path', 'digest', 'backends', 'top', 'obs', 'multicast',
+                 '_used')
+
+    def __init__(self, path=None, digest=None):
+        self.path = path
+        self.digest = digest
+        # backend name => {'type': ..., options...}
+        self.backends = {}
+        # the top level, the <obswebsocket> sections, the <multicast> section
+        self.top = None
+        self.obs = []
+        self.multicast = None
+        # outputs in use: (number space, number)
+        self._used = set()
+
+    def items(self, tag, s=None, top=True):
+        """
+        copies (with own LEDs) of the items of a section, incl. the ones
+        on top level: name => item
+        """
+        result = {}
+        for sec in (s, self.top if top else None):
+            if sec is not None:
+                for name, i in sec.items.get(tag, {}).items():
+                    result[name] = i.copy()
+        return result
+
+    '''
+    COMPILATION
+    '''
+    def compile(self, root):
+        """
+        read and validate the XML tree, raises configerror
+        """
+        for b in root.findall('backend'):
+            self._backend(b)
+        self.top = self._section(root, None)
+        self.obs = [self._section(s, 'obswebsocket')
+                    for s in root.findall('obswebsocket')]
+        m = root.find('multicast')
+        self.multicast = self._section(m, 'multicast') if m is not None else None
+        # an item of an OBS would be replaced by the one on top level
+        for s in self.obs:
+            for tag, items in s.items.items():
+                for name in items:
+                    if name in self.top.items.get(tag, {}):
+                        self._fail("<{}> '{}' defined twice (on top level and "
+                                   "in <obswebsocket>)", tag, name)
+        return self
+
+    def _fail(self, msg, *args):
+        raise configerror(msg.format(*args) + " in XMLfile '{}'".format(self.path))
+
+    def _backend(self, b):
+        options = dict((child.tag, child.text) for child in b.findall('*'))
+        name = options.pop('name', None)
+        if not name or options.get('type') not in BACKENDS:
+            self._fail("invalid <backend> '{}' (type '{}'), types: {}",
+                       name, options.get('type'), ", ".join(BACKENDS))
+        self.backends[name] = options
+
+    def _gpio(self, child, target):
+        """
+        a gpio_* tag: number, inversion and backend into target
+        (item or section)
+        """
+        try:
+            nr = int(child.text)
+        except (TypeError, ValueError):
+            self._fail("invalid GPIO '{}' in <{}>", child.text, child.tag)
+        if 'inverted' in child.attrib:
+            nr = -abs(nr)
+        name = child.attrib.get('backend') or DEFAULT_BACKEND
+        if name not in BACKENDS and name not in self.backends:
+            self._fail("unknown backend '{}' in <{}>", name, child.tag)
+        key = (space(name, self.backends), abs(nr))
+        if key in self._used:
+            self._fail("GPIO {} can only be used once!", abs(nr))
+        self._used.add(key)
+        typ = child.tag[5:]
+        if typ not in LEDS['item' if isinstance(target, item) else 'section']:
+            self._fail("unknown tag <{}>", child.tag)
+        target.gpio[typ] = nr
+        target.backend[typ] = name
+
+    def _section(self, element, tag):
+        s = section(tag)
+        for child in element:
+            if not isinstance(child.tag, str):
+                continue
+            if child.tag in s.items:
+                self._item(child, s)
+            elif child.tag.startswith("gpio"):
+                self._gpio(child, s)
+            elif tag is None:
+                # top level: sections and backends, see compile
+                if child.tag not in TOP:
+                    self._fail("unknown tag <{}>", child.tag)
+            elif child.tag == 'host' and tag == 'obswebsocket':
+                s.hosts.append((child.attrib.get('network'), child.text))
+            elif child.tag not in OPTIONS[tag]:
+                self._fail("unknown tag <{}> in <{}>", child.tag, tag)
+            elif child.tag in NUMBERS and child.text:
+                try:
+                    s.options[child.tag] = NUMBERS[child.tag](child.text)
+                except ValueError:
+                    self._fail("invalid <{}> '{}'", child.tag, child.text)
+            else:
+                s.options[child.tag] = child.text
+        return s
+
+    def _item(self, element, s):
+        i = item(element.tag)
+        channel = None
+        for child in element:
+            if not isinstance(child.tag, str):
+                continue
+            if child.tag.startswith("gpio"):
+                self._gpio(child, i)
+            elif child.tag == 'name':
+                i.name = child.text
+            elif child.tag == 'channel':
+                channel = child.text
+            else:
+                self._fail("unknown tag <{}> in <{}>", child.tag, element.tag)
+        if not i.name:
+            self._fail("missing a <name> for {}", element.tag)
+        if element.tag == 'channel':
+            # the name is the channel number
+            channel = i.name
+        if channel:
+            try:
+                i.channel = int(channel)
+            except ValueError:
+                i.channel = 0
+            if not 1 <= i.channel <= MAX_CHANNEL:
+                self._fail("invalid channel '{}' for '{}', 1..{} expected",
+                           channel, i.name, MAX_CHANNEL)
+        if i.name in s.items[element.tag]:
+            self._fail("<{}> '{}' defined twice", element.tag, i.name)
+        s.items[element.tag][i.name] = i
+
+
+# the compiled files: path => ((mtime, size), digest, config)
+_cache = {}
+_cache_lock = Lock()
+
+
+def load(path):
+    """
+    the compiled configuration of the XML-file (from the cache, if the
+    file did not change), raises configerror
+    """
+    try:
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        with _cache_lock:
+            cached = _cache.get(path)
+        if cached and cached[0] == key:
+            return cached[2]
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise configerror("could not read XMLfile '{}': {}".format(path, e))
+    digest = hashlib.sha1(data).hexdigest()
+    if cached and cached[1] == digest:
+        cfg = cached[2]
+    else:
+        try:
+            root = ElementTree.fromstring(data)
+        except ElementTree.ParseError as e:
+            raise configerror("mal formed 'config' in XMLfile '{}': {}".format(
+                path, e))
+        cfg = config(path, digest).compile(root)
+    with _cache_lock:
+        _cache[path] = (key, digest, cfg)
+    return cfg
@@ -4,7 +4,7 @@
 from os.path import abspath, dirname
 
 
-DEBUG = True  # additional debugging output
+DEBUG = False  # additional debugging output (default log level DEBUG instead of INFO)
 
 XML_FILE = "{}/obstally.xml".format(dirname(abspath(__file__)))
 
@@ -1,11 +1,172 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+Logging
+
+The messages are formatted lazily ('%s' arguments) and written by a
+background thread: the callers (websocket receive thread, scheduler, ...)
+only check the level and put the record into a queue, they never format
+strings or block on stdout/journald. The arguments are formatted by the
+background thread, later, unless one of them is mutable (e.g. a
+dictionary of the configuration): such messages are formatted at once,
+the argument may change meanwhile. Repeated messages (e.g. heartbeats)
+can be sampled by sampled().
+
+The level is set by the environment variable OBSTALLY_LOG_LEVEL, else by
+<log_level> in the XML-file, else by DEBUG (see _contants).
+"""
 __author__      = "Claudio Thomas"
 __copyright__   = "Copyright 2020"
 __license__     = "GPL"
 
+# standard
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+from threading import Lock
+from time import monotonic
+# own
 from _contants import DEBUG
 
-def debug(*txt):
-    if DEBUG:
-        print(">> {}".format(txt[0] if len(txt) == 1 else txt))
+
+''' constants '''
+LOG_NAME = "obstally"
+LOG_ENV = "OBSTALLY_LOG_LEVEL"
+LOG_FORMAT = "%(levelname)s: %(message)s"
+# repeated messages are logged at most once per interval (seconds)
+SAMPLE_INTERVAL = 10
+# arguments formatted by the background thread (others at once)
+IMMUTABLE = (str, bytes, int, float, type(None), BaseException)
+
+
+# not used by LOG_FORMAT, saves time creating each record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
+log = logging.getLogger(LOG_NAME)
+log.propagate = False
+_listener = None
+# sampled messages: message => [last time logged, suppressed since]
+_sampled = {}
+_sampled_lock = Lock()
+
+
+class _queuehandler(logging.handlers.QueueHandler):
+    '''
+    puts the records into the queue without formatting them
+    '''
+    def prepare(self, record):
+        return record
+
+
+def setup(level=None):
+    """
+    start the background logging thread (only once) and set the level
+    """
+    global _listener
+    if _listener is None:
+        q = queue.SimpleQueue()
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        _listener = logging.handlers.QueueListener(q, handler)
+        log.addHandler(_queuehandler(q))
+        _listener.start()
+        atexit.register(_listener.stop)
+    set_level(level)
+
+
+def set_level(level=None):
+    """
+    set the log level (name or number), the environment variable
+    OBSTALLY_LOG_LEVEL has priority
+    """
+    level = os.environ.get(LOG_ENV) or level or ("DEBUG" if DEBUG else "INFO")
+    try:
+        log.setLevel(level.upper() if isinstance(level, str) else level)
+    except (TypeError, ValueError):
+        log.error("invalid log level '%s'", level)
+
+
+def flush():
+    """
+    wait until all queued messages are written
+    """
+    _listener.stop()
+    _listener.start()
+
+
+def set_stream(stream):
+    """
+    write the messages to another stream, returns the previous one
+    """
+    flush()
+    return _listener.handlers[0].setStream(stream)
+
+
+def _immutable(args):
+    """
+    internal helper: True if the arguments can be formatted later
+    """
+    return all(isinstance(a, IMMUTABLE) or
+               (type(a) is tuple and _immutable(a)) for a in args)
+
+
+def _log(level, msg, args):
+    """
+    internal helper: queue a record (without looking up the caller, as
+    logging.Logger.log does)
+    """
+    if log.isEnabledFor(level):
+        record = log.makeRecord(LOG_NAME, level, "", 0, msg, args, None)
+        if not _immutable(args):
+            try:
+                record.msg, record.args = record.getMessage(), None
+            except (TypeError, ValueError, KeyError):
+                # (reported by the background thread)
+                pass
+        log.handle(record)
+
+
+def debug(msg, *args):
+    _log(logging.DEBUG, msg, args)
+
+
+def info(msg, *args):
+    _log(logging.INFO, msg, args)
+
+
+def warning(msg, *args):
+    _log(logging.WARNING, msg, args)
+
+
+def error(msg, *args):
+    _log(logging.ERROR, msg, args)
+
+
+def sampled(msg, *args, level=logging.DEBUG, interval=SAMPLE_INTERVAL):
+    """
+    log a repeated message at most once per interval seconds,
+    with the number of suppressed messages
+    """
+    if not log.isEnabledFor(level):
+        return
+    now = monotonic()
+    with _sampled_lock:
+        last = _sampled.get(msg)
+        if last and now - last[0] < interval:
+            last[1] += 1
+            return
+        suppressed = last[1] if last else 0
+        _sampled[msg] = [now, 0]
+    if suppressed:
+        _log(level, msg + " (%d suppressed)", args + (suppressed,))
+    else:
+        _log(level, msg, args)
+
+
+setup()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fake OBS websocket server (obs-websocket v4 and v5 protocol subset)
+
+Simulates the scenes, program/preview status and events of OBS, to test
+the tally without a running OBS. Clients asking for the subprotocol
+obswebsocket.json get v5 (only the events subscribed), the others v4.
+Can be used from python (asyncio) or
+started as script, reading commands from stdin:
+    switch <scene>
+    preview <scene>
+    visible <scene> <item> 0|1
+    drop
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import asyncio
+import base64
+import hashlib
+import json
+import sys
+# third party
+import websockets
+# own
+import _obsv5 as v5
+
+
+class fakeobs(object):
+    '''
+    the fake OBS server
+
+    scenes: dictionary scene-name => list of scene items, each item is a
+            dictionary like OBS sends it ('name', 'render', 'type', ...)
+    '''
+    def __init__(self, scenes=None, host='localhost', port=4444,
+                 password='', studio_mode=True, heartbeat_interval=2):
+        self.scenes = scenes if scenes is not None else {}
+        self.host = host
+        self.port = port
+        self.password = password
+        self.studio_mode = studio_mode
+        self.heartbeat_interval = heartbeat_interval
+        names = list(self.scenes) or [None]
+        self.program = names[0]
+        self.preview = names[-1]
+        # connected clients (websocket => heartbeat task)
+        self.clients = {}
+        # v5 clients: websocket => event subscription mask
+        self.subscriptions = {}
+        self.server = None
+        self._salt = "c2FsdA=="
+        self._challenge = "Y2hhbGxlbmdl"
+
+    async def start(self):
+        """
+        start listening
+        """
+        self.server = await websockets.serve(
+            self._handler, self.host, self.port, max_size=None,
+            select_subprotocol=self._select_subprotocol)
+        return self
+
+    async def stop(self):
+        """
+        disconnect all clients and stop listening
+        """
+        await self.drop()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def drop(self):
+        """
+        close all client connections (simulate a network failure)
+        """
+        for ws in list(self.clients):
+            await ws.close()
+
+    '''
+    SIMULATED OBS ACTIONS
+    '''
+    async def switch(self, name):
+        """
+        switch the program scene
+        """
+        self.program = name
+        await self.broadcast({
+            'update-type': 'SwitchScenes',
+            'scene-name': name,
+            'sources': self.scenes.get(name, [])},
+            ('CurrentProgramSceneChanged', v5.SUB_SCENES, {'sceneName': name}))
+
+    async def set_preview(self, name):
+        """
+        change the preview scene
+        """
+        self.preview = name
+        await self.broadcast({
+            'update-type': 'PreviewSceneChanged',
+            'scene-name': name,
+            'sources': self.scenes.get(name, [])},
+            ('CurrentPreviewSceneChanged', v5.SUB_SCENES, {'sceneName': name}))
+
+    async def set_visible(self, scene, item, visible):
+        """
+        toggle the visibility of a scene item
+        """
+        for i, s in enumerate(self.scenes.get(scene, [])):
+            if s['name'] == item:
+                s['render'] = bool(visible)
+                await self.broadcast({
+                    'update-type': 'SceneItemVisibilityChanged',
+                    'scene-name': scene,
+                    'item-name': item,
+                    'item-id': s.get('id', i),
+                    'item-visible': bool(visible)},
+                    ('SceneItemEnableStateChanged', v5.SUB_SCENE_ITEMS,
+                     {'sceneName': scene, 'sceneItemId': s.get('id', i),
+                      'sceneItemEnabled': bool(visible)}))
+
+    async def broadcast(self, data, event5=None):
+        """
+        send an event to all connected clients, event5 for the v5 clients:
+        (event type, subscription, event data)
+        """
+        message = json.dumps(data)
+        for ws in list(self.clients):
+            if ws in self.subscriptions:
+                if not event5 or not self.subscriptions[ws] & event5[1]:
+                    continue
+                msg = json.dumps({'op': v5.OP_EVENT, 'd': {
+                    'eventType': event5[0], 'eventIntent': event5[1],
+                    'eventData': event5[2]}})
+            else:
+                msg = message
+            try:
+                await ws.send(msg)
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+    '''
+    PROTOCOL
+    '''
+    def _select_subprotocol(self, ws, subprotocols):
+        return v5.SUBPROTOCOL if v5.SUBPROTOCOL in subprotocols else None
+
+    async def _handler(self, ws, path=None):
+        if ws.subprotocol == v5.SUBPROTOCOL:
+            return await self._handler5(ws)
+        self.clients[ws] = None
+        try:
+            async for message in ws:
+                request = json.loads(message)
+                answer = self.answer(ws, request)
+                answer['message-id'] = request.get('message-id')
+                await ws.send(json.dumps(answer))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            task = self.clients.pop(ws, None)
+            if task:
+                task.cancel()
+
+    def answer(self, ws, request):
+        """
+        build the answer for a request
+        """
+        typ = request.get('request-type')
+        if typ == 'GetAuthRequired':
+            if not self.password:
+                return {'status': 'ok', 'authRequired': False}
+            return {'status': 'ok', 'authRequired': True,
+                    'salt': self._salt, 'challenge': self._challenge}
+        if typ == 'Authenticate':
+            secret = base64.b64encode(hashlib.sha256(
+                (self.password + self._salt).encode('utf-8')).digest())
+            auth = base64.b64encode(hashlib.sha256(
+                secret + self._challenge.encode('utf-8')).digest())
+            if request.get('auth') == auth.decode('utf-8'):
+                return {'status': 'ok'}
+            return {'status': 'error', 'error': 'Authentication Failed.'}
+        if typ == 'SetHeartbeat':
+            task = self.clients.get(ws)
+            if task:
+                task.cancel()
+            self.clients[ws] = None
+            if request.get('enable'):
+                self.clients[ws] = asyncio.get_running_loop().create_task(
+                    self._heartbeat(ws))
+            return {'status': 'ok'}
+        if typ == 'GetCurrentScene':
+            return {'status': 'ok', 'name': self.program,
+                    'sources': self.scenes.get(self.program, [])}
+        if typ == 'GetPreviewScene':
+            if not self.studio_mode:
+                return {'status': 'error', 'error': 'studio mode not enabled'}
+            return {'status': 'ok', 'name': self.preview,
+                    'sources': self.scenes.get(self.preview, [])}
+        if typ == 'GetStudioModeStatus':
+            return {'status': 'ok', 'studio-mode': self.studio_mode}
+        if typ == 'ExecuteBatch':
+            results = []
+            for r in request.get('requests') or ():
+                result = self.answer(ws, r)
+                result['message-id'] = r.get('message-id')
+                results.append(result)
+            return {'status': 'ok', 'results': results}
+        if typ == 'GetSceneList':
+            return {'status': 'ok', 'current-scene': self.program,
+                    'scenes': [{'name': n, 'sources': s}
+                               for n, s in self.scenes.items()]}
+        return {'status': 'error', 'error': 'invalid request type'}
+
+    async def _handler5(self, ws):
+        self.clients[ws] = None
+        hello = {'obsWebSocketVersion': '5.0.0', 'rpcVersion': v5.RPC_VERSION}
+        if self.password:
+            hello['authentication'] = {'salt': self._salt,
+                                       'challenge': self._challenge}
+        try:
+            await ws.send(json.dumps({'op': v5.OP_HELLO, 'd': hello}))
+            async for message in ws:
+                msg = json.loads(message)
+                op, d = msg['op'], msg['d']
+                if op == v5.OP_IDENTIFY:
+                    if self.password and d.get('authentication') != \
+                       v5.authentication(self.password, self._salt,
+                                         self._challenge):
+                        await ws.close(4009, "Authentication failed.")
+                        return
+                    self.subscriptions[ws] = d.get('eventSubscriptions', 0x7ff)
+                    answer = (v5.OP_IDENTIFIED,
+                              {'negotiatedRpcVersion': v5.RPC_VERSION})
+                elif op == v5.OP_REIDENTIFY:
+                    self.subscriptions[ws] = d.get('eventSubscriptions', 0x7ff)
+                    answer = (v5.OP_IDENTIFIED,
+                              {'negotiatedRpcVersion': v5.RPC_VERSION})
+                elif op == v5.OP_REQUEST:
+                    answer = (v5.OP_REQUEST_RESPONSE, self.answer5(d))
+                elif op == v5.OP_REQUEST_BATCH:
+                    answer = (v5.OP_REQUEST_BATCH_RESPONSE, {
+                        'requestId': d.get('requestId'),
+                        'results': [self.answer5(r)
+                                    for r in d.get('requests') or ()]})
+                else:
+                    continue
+                await ws.send(json.dumps({'op': answer[0], 'd': answer[1]}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.clients.pop(ws, None)
+            self.subscriptions.pop(ws, None)
+
+    def answer5(self, request):
+        """
+        build the answer (d of a RequestResponse) for a v5 request
+        """
+        typ = request.get('requestType')
+        args = request.get('requestData') or {}
+        data = None
+        code = 100
+        if typ == 'GetSceneList':
+            data = {'currentProgramSceneName': self.program,
+                    'currentPreviewSceneName':
+                        self.preview if self.studio_mode else None,
+                    'scenes': [{'sceneName': n, 'sceneIndex': i}
+                               for i, n in reversed(list(enumerate(self.scenes)))]}
+        elif typ == 'GetCurrentProgramScene':
+            data = {'currentProgramSceneName': self.program}
+        elif typ == 'GetCurrentPreviewScene':
+            if self.studio_mode:
+                data = {'currentPreviewSceneName': self.preview}
+            else:
+                code = 506
+        elif typ == 'GetStudioModeEnabled':
+            data = {'studioModeEnabled': self.studio_mode}
+        elif typ in ('GetSceneItemList', 'GetGroupSceneItemList'):
+            items = self._items5(args.get('sceneName'),
+                                 typ == 'GetGroupSceneItemList')
+            if items is None:
+                code = 600
+            else:
+                data = {'sceneItems': items}
+        else:
+            code = 204
+        answer = {'requestType': typ, 'requestId': request.get('requestId'),
+                  'requestStatus': {'result': code == 100, 'code': code}}
+        if data is not None:
+            answer['responseData'] = data
+        return answer
+
+    def _items5(self, name, group):
+        """
+        the v5 scene items of a scene (or of a group), None if not found
+        """
+        items = None
+        if not group:
+            items = self.scenes.get(name)
+        else:
+            for scene in self.scenes.values():
+                for i in scene:
+                    if i.get('type') == 'group' and i['name'] == name:
+                        items = i.get('groupChildren') or []
+        if items is None:
+            return None
+        result = []
+        for index, i in enumerate(items):
+            nested = i.get('type') in ('scene', 'group')
+            result.append({
+                'sourceName': i['name'],
+                'sceneItemId': i.get('id', index),
+                'sceneItemIndex': index,
+                'sceneItemEnabled': bool(i.get('render', True)),
+                'sourceType': 'OBS_SOURCE_TYPE_SCENE' if nested
+                              else 'OBS_SOURCE_TYPE_INPUT',
+                'isGroup': i.get('type') == 'group',
+                'inputKind': None if nested else i.get('type')})
+        return result
+
+    async def _heartbeat(self, ws):
+        pulse = False
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            pulse = not pulse
+            try:
+                await ws.send(json.dumps({
+                    'update-type': 'Heartbeat',
+                    'pulse': pulse,
+                    'current-scene': self.program}))
+            except websockets.exceptions.ConnectionClosed:
+                return
+
+
+async def _main(port):
+    obs = await fakeobs(port=port).start()
+    print("fake OBS listening on port {}".format(port))
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        cmd = line.split()
+        if not cmd:
+            continue
+        if cmd[0] == 'switch':
+            await obs.switch(" ".join(cmd[1:]))
+        elif cmd[0] == 'preview':
+            await obs.set_preview(" ".join(cmd[1:]))
+        elif cmd[0] == 'visible' and len(cmd) >= 4:
+            await obs.set_visible(cmd[1], cmd[2], cmd[3] == '1')
+        elif cmd[0] == 'drop':
+            await obs.drop()
+    await obs.stop()
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    asyncio.run(_main(int(sys.argv[1]) if len(sys.argv) > 1 else 4444))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fan-out of the tally state
+
+One obstally holds the connection to OBS and publishes the tally state
+to any number of remote tallies (see remotetally.py), so OBS only has to
+serve one websocket client.
+
+Protocol: TCP, one compact JSON object per line, from the server to the
+clients only. The tally state is a dictionary name => bits (the scenes
+and sources configured on the server, on program/preview, see PROGRAM...):
+    {"snapshot":{"HDMI 1":5,"PTZ1":2},"obs":true}   on join
+    {"delta":{"HDMI 1":0,"PTZ1":1},"obs":true}      on change (0: off air)
+    {"hb":1,"obs":true}                             every HEARTBEAT seconds
+"obs" is false while the server is not connected to OBS.
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard (asyncio is imported in the server thread, the tally imports
+# this module on start, see _startup)
+import json
+
+from threading import Event, Thread
+# own
+from _debugtools import debug, error, info
+
+
+''' constants '''
+# bits of the tally state: visible source / scene on program/preview
+PROGRAM = 1
+PREVIEW = 2
+PROGRAM_SCENE = 4
+PREVIEW_SCENE = 8
+BITS = {'program': (PROGRAM_SCENE, PROGRAM), 'preview': (PREVIEW_SCENE, PREVIEW)}
+# seconds between two heartbeats (same as the OBS heartbeat)
+HEARTBEAT = 2
+# bytes not yet sent to a client, before it is dropped (too slow)
+MAX_BUFFER = 256 * 1024
+# maximal length in bytes of one line (snapshot)
+MAX_LINE = 1024 * 1024
+
+
+def tally_bits(current, visible, ids=None):
+    """
+    the tally state (name => bits) of the scenes in program/preview
+
+    current: LED type => scene name (or None)
+    visible: function(scene name) => visible source names (frozenset)
+    ids:     the names published (frozenset, None: all)
+    """
+    names = {}
+    for typ, name in current.items():
+        if name is None:
+            continue
+        scene_bit, source_bit = BITS[typ]
+        if ids is None or name in ids:
+            names[name] = names.get(name, 0) | scene_bit
+        shown = visible(name)
+        for s in (shown if ids is None else ids & shown):
+            names[s] = names.get(s, 0) | source_bit
+    return names
+
+
+def match_bits(names, typ, scene_index, source_index):
+    """
+    LED keys matching the tally state for the given LED type, like
+    tally._match: the configured scene or the visible configured sources
+    """
+    scene_bit, source_bit = BITS[typ]
+    keys = set()
+    for name, bits in names.items():
+        if bits & scene_bit and name in scene_index[typ]:
+            keys |= scene_index[typ][name]
+    if keys:
+        return keys
+    for name, bits in names.items():
+        if bits & source_bit and name in source_index[typ]:
+            keys |= source_index[typ][name]
+    return keys
+
+
+def _line(msg):
+    return json.dumps(msg, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class fanoutserver(Thread):
+    '''
+    publishes the tally state to the connected clients, within an own
+    thread (event loop): publish() never blocks the caller, clients too
+    slow to receive are dropped (they get a snapshot on reconnect)
+    '''
+    def __init__(self, port, host=''):
+        Thread.__init__(self, name="fanout")
+        self.daemon = True
+        self.host = host
+        self.port = port
+        # the published tally state: name => bits
+        self.names = {}
+        # the server is connected to OBS
+        self.obs = False
+        self.loop = None
+        self._clients = set()
+        self._stopped = None
+        self._ready = Event()
+
+    def start(self):
+        """
+        start the thread, returns when the server is listening
+        """
+        Thread.start(self)
+        self._ready.wait()
+        return self.loop is not None
+
+    def stop(self):
+        """
+        disconnect all clients and end the thread
+        """
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+            self.join()
+
+    def publish(self, names, obs=True):
+        """
+        publish the tally state (name => bits), only the changes are
+        sent (can be called from any thread)
+        """
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._update, names, obs)
+
+    def run(self):
+        import asyncio
+        asyncio.run(self._main())
+
+    async def _main(self):
+        import asyncio
+        self._stopped = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._client, self.host or None,
+                                                self.port)
+        except OSError as e:
+            error("fan-out server not started on port %s: %s", self.port, e)
+            self._ready.set()
+            return
+        self.loop = asyncio.get_running_loop()
+        info("fan-out server listening on port %s", self.port)
+        self._ready.set()
+        heartbeat = self.loop.create_task(self._heartbeat())
+        await self._stopped.wait()
+        heartbeat.cancel()
+        server.close()
+        for writer in list(self._clients):
+            writer.close()
+        await server.wait_closed()
+
+    def _update(self, names, obs):
+        delta = {n: b for n, b in names.items() if self.names.get(n) != b}
+        delta.update((n, 0) for n in self.names if n not in names)
+        if not delta and obs == self.obs:
+            return
+        self.names = names
+        self.obs = obs
+        self._send(_line({'delta': delta, 'obs': obs}))
+
+    def _send(self, line):
+        for writer in list(self._clients):
+            if writer.transport.get_write_buffer_size() > MAX_BUFFER:
+                debug("fan-out client too slow, dropped: %s",
+                      writer.get_extra_info('peername'))
+                self._clients.discard(writer)
+                writer.transport.abort()
+                continue
+            writer.write(line)
+
+    async def _heartbeat(self):
+        import asyncio
+        while True:
+            await asyncio.sleep(HEARTBEAT)
+            self._send(_line({'hb': 1, 'obs': self.obs}))
+
+    async def _client(self, reader, writer):
+        debug("fan-out client connected: %s", writer.get_extra_info('peername'))
+        writer.write(_line({'snapshot': self.names, 'obs': self.obs}))
+        self._clients.add(writer)
+        try:
+            # the clients do not send anything, wait for the end
+            while await reader.read(1024):
+                pass
+        except OSError:
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+            debug("fan-out client disconnected: %s",
+                  writer.get_extra_info('peername'))
+
+
+class aiofanout(object):
+    '''
+    client of the fan-out server, with the same connect interface as
+    aiowsclient.aiows. Every received message is passed to callback.
+    '''
+    def __init__(self, host, port, callback):
+        self.host = host
+        self.port = port
+        self.callback = callback
+        # actual connection status
+        self.connected = False
+        # callback to be executed when the connection is lost
+        self.on_close = None
+        self._writer = None
+        self._recv_task = None
+
+    async def connect(self):
+        import asyncio
+        reader, self._writer = await asyncio.open_connection(
+            self.host, self.port, limit=MAX_LINE)
+        self.connected = True
+        self._recv_task = asyncio.get_running_loop().create_task(
+            self._recv_loop(reader))
+
+    async def reconnect(self):
+        await self.disconnect()
+        await self.connect()
+
+    async def disconnect(self):
+        self.connected = False
+        if self._recv_task:
+            self._recv_task.cancel()
+            self._recv_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+    async def _recv_loop(self, reader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    debug("invalid message: %s", line)
+                    continue
+                try:
+                    self.callback(msg)
+                except Exception as e:
+                    debug(">>>> EXCEPTION in %s: %s", self.callback, e)
+        except (OSError, ValueError):
+            pass
+        finally:
+            was_connected = self.connected
+            self.connected = False
+            if was_connected and self.on_close:
+                self.on_close()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Latency instrumentation
+
+Collects durations (e.g. from receiving an OBS event until the GPIOs are
+written) to report percentiles.
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+from bisect import bisect_left
+from collections import deque
+
+
+''' constants '''
+# upper bounds in seconds of the histogram buckets (see latencystats)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 1)
+
+
+def percentile(values, p):
+    """
+    the p-th percentile (0..100) of the values (nearest rank)
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values) + .5)) - 1))
+    return values[k]
+
+
+class latencystats(object):
+    '''
+    durations in seconds: count, total, the last 'size' samples and a
+    histogram (buckets[i]: durations up to bounds[i], the last one above)
+    '''
+    def __init__(self, size=1000, bounds=LATENCY_BUCKETS):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+
+    def add(self, seconds):
+        """
+        add a measured duration
+        """
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.buckets[bisect_left(self.bounds, seconds)] += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """
+        the p-th percentile of the last samples
+        """
+        return percentile(self.samples, p)
+
+    def as_dict(self):
+        """
+        the statistics as dictionary
+        """
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+            }
+
+    def __repr__(self):
+        return "<latencystats {}>".format(self.as_dict())
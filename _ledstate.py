@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+LED state model
+
+The LEDs to be on are computed as pure function of the OBS state (the
+LEDs matching program and preview) incl. the feature rules. Only the
+difference to the actual state has to be written to the GPIOs.
+
+LEDs are identified by LED keys: tuples (objtyp, name, typ), e.g.
+('sources', 'PTZ1', 'preview'). (objtyp, name) identifies the CAM.
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# own
+from _contants import ONLY_ONE_LED_PER_CAM_ON, MAX_ONE_LED_ON
+
+
+def target_state(program, preview,
+                 only_one_led_per_cam=ONLY_ONE_LED_PER_CAM_ON,
+                 max_one_led_on=MAX_ONE_LED_ON):
+    """
+    compute the LED keys to be on
+
+    program: LED keys matching the scene in program
+    preview: LED keys matching the scene in preview
+    """
+    if max_one_led_on and program:
+        # FEATURE: maximal one LED can be ON at time
+        # in case program+preview are ON, disable preview
+        return set(program)
+    if only_one_led_per_cam:
+        # FEATURE: Avoid showing both LEDs for one CAM
+        # Each CAM can be only in program or in preview. Showing both is
+        # confusing for the person in front of the cam
+        cams = set(key[:2] for key in program)
+        preview = [key for key in preview if key[:2] not in cams]
+    return set(program).union(preview)
+
+
+def diff_state(old, new):
+    """
+    changes needed to get from LED keys 'old' to LED keys 'new' as
+    dictionary LED key => on (bool)
+    """
+    changes = dict.fromkeys(old - new, False)
+    changes.update(dict.fromkeys(new - old, True))
+    return changes
+
+
+class ledstate(object):
+    '''
+    the actual LED state:
+    - matched: LED keys matching the scene in program/preview
+    - on: LED keys actually switched on
+    '''
+    def __init__(self):
+        self.matched = { 'program': set(), 'preview': set() }
+        self.on = set()
+
+    def set(self, typ, keys):
+        """
+        set the LED keys matching program/preview,
+        returns the changes (LED key => on)
+        """
+        self.matched[typ] = set(keys)
+        return self.update()
+
+    def update(self):
+        """
+        recompute the target state, returns the changes (LED key => on)
+        """
+        return self.force(target_state(
+            self.matched['program'], self.matched['preview']))
+
+    def force(self, keys):
+        """
+        force the given LED keys on (all other off), without any rule,
+        returns the changes (LED key => on)
+        """
+        keys = set(keys)
+        changes = diff_state(self.on, keys)
+        self.on = keys
+        return changes
+
+    def reset(self):
+        """
+        forget everything (all LEDs off)
+        """
+        self.matched = { 'program': set(), 'preview': set() }
+        self.on = set()
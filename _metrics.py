@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Metrics endpoint (Prometheus text format)
+
+An HTTP server within an own thread, enabled by <metrics_port>. The
+values are read from the tallies only when scraped: the event path just
+increments counters (see _latency.latencystats, _netprobe.reconnectstats).
+
+A collector is a function returning metric families
+    (name, type, help, [(suffix, labels, value), ...])
+e.g. ('obstally_connected', 'gauge', 'connected to OBS', [('', {'obs': '0'}, 1)]).
+Several tallies of one process (see multitally) can share one port, their
+families are merged by name.
+
+    curl http://<tally>:<metrics_port>/metrics
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+# own
+from _debugtools import debug, error, info
+
+
+''' constants '''
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PATHS = ('/', '/metrics')
+
+
+def histogram(name, help, labels, bounds, buckets, total):
+    """
+    the metric family of a histogram: bounds and buckets as counted by
+    latencystats/reconnectstats (not cumulative), total: sum of the values
+    """
+    samples = []
+    count = 0
+    for bound, n in zip(tuple(bounds) + ('+Inf',), buckets):
+        count += n
+        le = dict(labels)
+        le['le'] = str(bound)
+        samples.append(('_bucket', le, count))
+    samples.append(('_sum', labels, total))
+    samples.append(('_count', labels, count))
+    return (name, 'histogram', help, samples)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+def _value(value):
+    if value is True or value is False:
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(families):
+    """
+    the metric families as text (families of the same name are merged)
+    """
+    merged = {}
+    for name, typ, help, samples in families:
+        if name in merged:
+            merged[name][2].extend(samples)
+        else:
+            merged[name] = (typ, help, list(samples))
+    lines = []
+    for name, (typ, help, samples) in merged.items():
+        lines.append("# HELP {} {}".format(name, help))
+        lines.append("# TYPE {} {}".format(name, typ))
+        for suffix, labels, value in samples:
+            if value is None:
+                continue
+            if labels:
+                lines.append("{}{}{{{}}} {}".format(
+                    name, suffix,
+                    ",".join('{}="{}"'.format(k, _escape(v))
+                             for k, v in labels.items()),
+                    _value(value)))
+            else:
+                lines.append("{}{} {}".format(name, suffix, _value(value)))
+    return "\n".join(lines) + "\n"
+
+
+class _handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in PATHS:
+            self.send_error(404)
+            return
+        try:
+            body = self.server.collect().encode('utf-8')
+        except Exception as e:
+            error("metrics not collected: %s", e)
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        debug("metrics %s: " + format, self.client_address[0], *args)
+
+
+class metricsserver(Thread):
+    '''
+    serves the metrics of the collectors, within an own thread
+    '''
+    def __init__(self, port, host=''):
+        Thread.__init__(self, name="metrics")
+        self.daemon = True
+        self.host = host
+        self.port = port
+        self.collectors = []
+        self.httpd = None
+
+    def start(self):
+        """
+        start listening, False if the port is not available
+        """
+        try:
+            self.httpd = ThreadingHTTPServer((self.host, self.port), _handler)
+        except OSError as e:
+            error("metrics server not started on port %s: %s", self.port, e)
+            return False
+        self.httpd.daemon_threads = True
+        self.httpd.collect = self.collect
+        info("metrics server listening on port %s", self.port)
+        Thread.start(self)
+        return True
+
+    def stop(self):
+        """
+        stop listening and end the thread
+        """
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def collect(self):
+        """
+        the metrics of all collectors as text
+        """
+        families = []
+        for c in list(self.collectors):
+            families.extend(c())
+        return render(families)
+
+
+# the running servers: port => metricsserver
+_servers = {}
+_servers_lock = Lock()
+
+
+def start(port, collector):
+    """
+    serve the metrics of collector on port (the server is shared by all
+    collectors of the port), False if the port is not available
+    """
+    with _servers_lock:
+        server = _servers.get(port)
+        if server is None:
+            server = metricsserver(port)
+            if not server.start():
+                return False
+            _servers[port] = server
+        if collector not in server.collectors:
+            server.collectors.append(collector)
+    return True
+
+
+def stop(port, collector):
+    """
+    do not serve the metrics of collector anymore (the server is stopped
+    with its last collector)
+    """
+    with _servers_lock:
+        server = _servers.get(port)
+        if server is None:
+            return
+        if collector in server.collectors:
+            server.collectors.remove(collector)
+        if not server.collectors:
+            del _servers[port]
+            server.stop()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tally state by UDP multicast
+
+The LED state is sent as small fixed-size datagram to a multicast group
+on every change (repeated RESEND times, in case of loss) and as keep-alive
+every KEEPALIVE seconds. Any number of receivers (see tallyreceiver.py,
+or any microcontroller) get each update with one packet.
+
+Each scene/source can be assigned a tally channel (1..64) by <channel>.
+Packet (26 bytes, network byte order):
+    2s  magic 'OT'
+    B   version (1)
+    B   flags (bit 0: connected to OBS)
+    H   session (random, new on every start of the sender)
+    I   sequence number (incremented on every change)
+    Q   program: bit n-1 set if channel n is on program
+    Q   preview: bit n-1 set if channel n is on preview
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import ipaddress
+import random
+import socket
+import struct
+
+from threading import Thread
+from time import monotonic
+# own
+from _debugtools import debug, error
+
+
+''' constants '''
+MAGIC = b'OT'
+VERSION = 1
+PACKET = struct.Struct('!2sBBHIQQ')
+FLAG_OBS = 1
+MAX_CHANNEL = 64
+MULTICAST_GROUP = '239.255.84.76'
+MULTICAST_PORT = 4470
+# seconds between two keep-alives (repetition of the actual state)
+KEEPALIVE = 1
+# delays in seconds to repeat a changed state (in case of loss)
+RESEND = (0.01, 0.05, 0.2)
+# seconds without packet, until the receiver assumes the sender is lost
+TIMEOUT = 3.5
+
+
+def pack(session, seq, program, preview, obs):
+    """
+    the packet of a tally state
+    """
+    return PACKET.pack(MAGIC, VERSION, FLAG_OBS if obs else 0, session,
+                       seq & 0xffffffff, program, preview)
+
+
+def unpack(data):
+    """
+    tuple (session, seq, program, preview, obs) of a packet,
+    None if invalid
+    """
+    if len(data) != PACKET.size:
+        return None
+    magic, version, flags, session, seq, program, preview = PACKET.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    return session, seq, program, preview, bool(flags & FLAG_OBS)
+
+
+def newer(seq, last):
+    """
+    True if the sequence number seq is newer than last (with wrap-around)
+    """
+    return 0 < (seq - last) & 0xffffffff < 0x80000000
+
+
+def _is_multicast(group):
+    try:
+        return ipaddress.ip_address(group).is_multicast
+    except ValueError:
+        return False
+
+
+class multicastsender(object):
+    '''
+    sends the tally state to a multicast group (or a broadcast/unicast
+    address), never blocks
+    '''
+    def __init__(self, group=MULTICAST_GROUP, port=MULTICAST_PORT, ttl=1):
+        self.group = group
+        self.port = port
+        self.session = random.getrandbits(16)
+        self.seq = 0
+        self.state = None
+        self.packet = None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                  socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.sock.setblocking(False)
+
+    def update(self, program, preview, obs):
+        """
+        send the tally state (bit masks of the channels), if changed,
+        returns True if sent
+        """
+        state = (program, preview, bool(obs))
+        if state == self.state:
+            return False
+        self.state = state
+        self.seq += 1
+        self.packet = pack(self.session, self.seq, program, preview, obs)
+        self.resend()
+        return True
+
+    def resend(self):
+        """
+        send the actual state again
+        """
+        if self.packet is None:
+            return
+        try:
+            self.sock.sendto(self.packet, (self.group, self.port))
+        except OSError as e:
+            debug("multicast not sent: %s", e)
+
+    def close(self):
+        self.sock.close()
+
+
+class multicastreceiver(Thread):
+    '''
+    receives the tally state in an own thread:
+    - on_packet(program, preview, obs) is called for each new state
+    - on_timeout() is called once, if no packet is received for
+      'timeout' seconds
+    '''
+    def __init__(self, group, port, on_packet, on_timeout, timeout=TIMEOUT):
+        Thread.__init__(self, name="multicast")
+        self.daemon = True
+        self.group = group
+        self.port = port
+        self.on_packet = on_packet
+        self.on_timeout = on_timeout
+        self.timeout = timeout
+        # actual status: packets received
+        self.connected = False
+        self._closed = False
+        self._last = None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                  socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', port))
+        if _is_multicast(group):
+            mreq = struct.pack('4s4s', socket.inet_aton(group),
+                               socket.inet_aton('0.0.0.0'))
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                 mreq)
+        self.sock.settimeout(min(KEEPALIVE, timeout))
+
+    def disconnect(self):
+        """
+        stop receiving (ends the thread)
+        """
+        self._closed = True
+
+    def run(self):
+        received = monotonic()
+        try:
+            while not self._closed:
+                try:
+                    data = self.sock.recv(PACKET.size + 1)
+                except socket.timeout:
+                    data = None
+                except OSError as e:
+                    error("multicast receive failed: %s", e)
+                    break
+                packet = unpack(data) if data else None
+                if packet is None:
+                    if self.connected and monotonic() - received > self.timeout:
+                        self.connected = False
+                        self.on_timeout()
+                    continue
+                received = monotonic()
+                lost, self.connected = not self.connected, True
+                session, seq = packet[:2]
+                if not lost and self._last and self._last[0] == session and \
+                   not newer(seq, self._last[1]):
+                    # keep-alive, repetition or out of order
+                    continue
+                self._last = (session, seq)
+                self.on_packet(*packet[2:])
+        finally:
+            self.sock.close()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local network interfaces
+
+- the local IP addresses, read from the kernel (netlink), without any
+  outbound connection (works without default route)
+- the host to connect to, by <host network="..."> (CIDR or IP prefix)
+- a monitor calling back when addresses are added/removed (e.g. switch
+  from Wi-Fi to Ethernet)
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import ipaddress
+import socket
+import struct
+
+from threading import Thread
+from time import monotonic
+# own
+from _debugtools import debug
+
+
+''' constants '''
+# seconds to wait for further changes, before the monitor calls back
+# (an interface change consists of several messages)
+SETTLE_DELAY = 0.5
+# netlink (see linux/netlink.h, linux/rtnetlink.h)
+NLMSG_HDR = struct.Struct('=LHHLL')
+IFADDRMSG = struct.Struct('=BBBBI')
+RTATTR = struct.Struct('=HH')
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+
+def _align(n):
+    return (n + 3) & ~3
+
+
+def _parse(data):
+    """
+    generator of (type, payload) of the netlink messages in data
+    """
+    offset = 0
+    while offset + NLMSG_HDR.size <= len(data):
+        length, typ = NLMSG_HDR.unpack_from(data, offset)[:2]
+        if length < NLMSG_HDR.size:
+            return
+        yield typ, data[offset + NLMSG_HDR.size:offset + length]
+        offset += _align(length)
+
+
+def _address(payload):
+    """
+    the address of an ifaddrmsg (IFA_LOCAL, else IFA_ADDRESS), or None
+    """
+    family = IFADDRMSG.unpack_from(payload)[0]
+    offset = IFADDRMSG.size
+    found = {}
+    while offset + RTATTR.size <= len(payload):
+        length, typ = RTATTR.unpack_from(payload, offset)
+        if length < RTATTR.size:
+            break
+        found[typ] = payload[offset + RTATTR.size:offset + length]
+        offset += _align(length)
+    raw = found.get(IFA_LOCAL) or found.get(IFA_ADDRESS)
+    if not raw:
+        return None
+    try:
+        return socket.inet_ntop(family, raw)
+    except (OSError, ValueError):
+        return None
+
+
+def _netlink_addresses():
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                       socket.NETLINK_ROUTE) as s:
+        s.settimeout(1)
+        s.bind((0, 0))
+        body = IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        s.send(NLMSG_HDR.pack(NLMSG_HDR.size + len(body), RTM_GETADDR,
+                              NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + body)
+        addresses = []
+        while True:
+            for typ, payload in _parse(s.recv(65536)):
+                if typ == NLMSG_DONE:
+                    return addresses
+                if typ == NLMSG_ERROR:
+                    raise OSError("netlink error")
+                if typ == RTM_NEWADDR:
+                    a = _address(payload)
+                    if a:
+                        addresses.append(a)
+
+
+def _routed_address():
+    # the address of the default route (sends nothing, fails without route)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.connect(("8.8.8.8", 80))
+        return s.getsockname()[0]
+
+
+def local_addresses():
+    """
+    the local IP addresses (strings), incl. loopback
+    """
+    try:
+        return _netlink_addresses()
+    except (AttributeError, OSError) as e:
+        # no netlink (not linux)
+        debug("local addresses without netlink: %s", e)
+    addresses = ['127.0.0.1']
+    try:
+        addresses.append(_routed_address())
+    except OSError:
+        pass
+    return addresses
+
+
+def primary_address(addresses=None):
+    """
+    the first local IPv4 address, which is not loopback (or loopback)
+    """
+    for a in addresses if addresses is not None else local_addresses():
+        ip = ipaddress.ip_address(a)
+        if ip.version == 4 and not ip.is_loopback:
+            return a
+    return '127.0.0.1'
+
+
+def network(value):
+    """
+    the network (ipaddress.ip_network) of a <host network="...">:
+    CIDR ('192.168.10.0/24') or the leading bytes of an IPv4 address
+    ('192.168.10'), None if invalid
+    """
+    value = (value or "").strip().rstrip('.')
+    parts = value.split('.')
+    if '/' not in value and ':' not in value and len(parts) < 4 and \
+       all(p.isdigit() for p in parts):
+        value = ".".join(parts + ['0'] * (4 - len(parts))) + \
+            "/{}".format(8 * len(parts))
+    try:
+        return ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        return None
+
+
+def select_host(hosts, addresses):
+    """
+    the host to connect to: the first one with a network matching a
+    local address, otherwise the (last) one without network
+
+    hosts: list of (network or None, host)
+    """
+    ips = []
+    for a in addresses:
+        try:
+            ips.append(ipaddress.ip_address(a.split('%')[0]))
+        except ValueError:
+            pass
+    host = None
+    for net, h in hosts:
+        if net is None:
+            host = h
+            continue
+        n = network(net)
+        if n is not None and any(ip in n for ip in ips if ip.version == n.version):
+            return h
+    return host
+
+
+class netmonitor(Thread):
+    '''
+    calls callback() once, when the local addresses changed (after
+    SETTLE_DELAY seconds without further change)
+    '''
+    def __init__(self, callback):
+        Thread.__init__(self, name="netmonitor")
+        self.daemon = True
+        self.callback = callback
+        self._closed = False
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  socket.NETLINK_ROUTE)
+        self.sock.bind((0, RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+        self.sock.settimeout(SETTLE_DELAY)
+
+    def stop(self):
+        """
+        stop monitoring (ends the thread)
+        """
+        self._closed = True
+
+    def run(self):
+        changed = None
+        try:
+            while not self._closed:
+                try:
+                    data = self.sock.recv(65536)
+                except socket.timeout:
+                    data = None
+                except OSError as e:
+                    debug("netmonitor stopped: %s", e)
+                    break
+                if data and any(typ in (RTM_NEWADDR, RTM_DELADDR)
+                                for typ, _ in _parse(data)):
+                    changed = monotonic()
+                elif changed and monotonic() - changed >= SETTLE_DELAY:
+                    changed = None
+                    if not self._closed:
+                        self.callback()
+        finally:
+            self.sock.close()
+
+
+def start_monitor(callback):
+    """
+    a started netmonitor, None if not supported (not linux)
+    """
+    try:
+        m = netmonitor(callback)
+    except (AttributeError, OSError) as e:
+        debug("no network monitor: %s", e)
+        return None
+    m.start()
+    return m
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reachability probe for the OBS websocket port, reconnect backoff and
+reconnect-time metrics
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import errno
+import random
+import select
+import socket
+
+from bisect import bisect_left
+from time import monotonic, sleep
+
+
+''' constants '''
+# timeout in seconds for one TCP connect probe
+PROBE_TIMEOUT = 0.5
+# first delay in seconds between two probes, doubled on every attempt
+PROBE_BACKOFF_BASE = 0.1
+# maximal delay in seconds between two probes
+PROBE_BACKOFF_MAX = 2
+# maximal time in seconds to wait for the port, before given up
+PROBE_MAX_WAIT = 10
+# upper bounds in seconds of the histogram buckets (see reconnectstats)
+RECONNECT_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 300)
+
+
+def backoff(base=PROBE_BACKOFF_BASE, cap=PROBE_BACKOFF_MAX):
+    """
+    generator of delays (seconds) for retries: exponential backoff
+    with jitter, to avoid several clients hitting OBS in the same moment
+    """
+    attempt = 0
+    while True:
+        delay = min(cap, base * 2 ** attempt)
+        yield delay / 2 + random.uniform(0, delay / 2)
+        attempt += 1
+
+
+def probe(host, port, timeout=PROBE_TIMEOUT):
+    """
+    non-blocking TCP connect to host:port, True if the port accepts
+    within the timeout
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    except socket.gaierror:
+        return False
+    for family, typ, proto, _name, addr in infos:
+        s = socket.socket(family, typ, proto)
+        try:
+            s.setblocking(False)
+            err = s.connect_ex(addr)
+            if err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                _r, w, _x = select.select([], [s], [], timeout)
+                err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) \
+                    if w else errno.ETIMEDOUT
+            if err == 0:
+                return True
+        except OSError:
+            pass
+        finally:
+            s.close()
+    return False
+
+
+async def aioprobe(host, port, timeout=PROBE_TIMEOUT):
+    """
+    same as probe(), but as coroutine
+    """
+    import asyncio
+    try:
+        _reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+def wait_for_port(host, port, timeout=PROBE_TIMEOUT,
+                  max_wait=PROBE_MAX_WAIT, stats=None, wait=None):
+    """
+    probe host:port with backoff until it accepts (True) or
+    max_wait seconds are over (False)
+
+    wait: function(seconds) used to wait between two probes,
+          (e.g. threading.Event().wait) gives up if it returns True
+    """
+    deadline = monotonic() + max_wait
+    for delay in backoff():
+        if stats:
+            stats.attempt()
+        if probe(host, port, timeout):
+            return True
+        if monotonic() + delay > deadline:
+            return False
+        if (wait or sleep)(delay):
+            return False
+
+
+class reconnectstats(object):
+    '''
+    reconnect-time metrics:
+    - attempts: number of probes/connect attempts
+    - reconnects: number of successful (re-)connects
+    - last/max/total: duration in seconds from the begin of the outage
+      (last heartbeat of OBS) until connected again
+    - buckets: histogram of the durations (buckets[i]: up to bounds[i],
+      the last one above)
+    '''
+    def __init__(self, bounds=RECONNECT_BUCKETS):
+        self.attempts = 0
+        self.reconnects = 0
+        self.last = None
+        self.max = None
+        self.total = 0.0
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self._since = None
+
+    def begin(self, since=None):
+        """
+        the connection is lost (has no effect if already lost), since:
+        time (monotonic) of the last sign of life, if known
+        """
+        if self._since is None:
+            self._since = monotonic() if since is None else since
+
+    def attempt(self):
+        """
+        one more try to reach OBS
+        """
+        self.attempts += 1
+
+    def done(self):
+        """
+        connected again, returns the duration of the outage
+        """
+        if self._since is None:
+            return None
+        self.last = monotonic() - self._since
+        self._since = None
+        self.reconnects += 1
+        self.total += self.last
+        self.buckets[bisect_left(self.bounds, self.last)] += 1
+        self.max = self.last if self.max is None else max(self.max, self.last)
+        return self.last
+
+    def as_dict(self):
+        """
+        the metrics as dictionary
+        """
+        return {
+            'attempts': self.attempts,
+            'reconnects': self.reconnects,
+            'last': self.last,
+            'max': self.max,
+            'avg': self.total / self.reconnects if self.reconnects else None,
+            }
+
+    def __repr__(self):
+        return "<reconnectstats {}>".format(self.as_dict())
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Several OBS requests in one round trip (ExecuteBatch, obs-websocket 4.9+)
+
+    scenes, preview = requests.GetSceneList(), requests.GetPreviewScene()
+    if not ws.call(batch(scenes, preview)).status:
+        ...  # older OBS: call them one after the other
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# third party
+from obswebsocket.base_classes import Baserequests
+
+
+class batch(Baserequests):
+    '''
+    request executing the given requests (classes from
+    obswebsocket.requests), each of them is populated with its answer
+    '''
+    def __init__(self, *requests):
+        Baserequests.__init__(self)
+        self.name = 'ExecuteBatch'
+        self.requests = requests
+        self.dataout['abortOnFail'] = False
+
+    def data(self):
+        payload = Baserequests.data(self)
+        payload['requests'] = []
+        for i, r in enumerate(self.requests):
+            request = r.data()
+            request['message-id'] = str(i)
+            payload['requests'].append(request)
+        return payload
+
+    def input(self, data):
+        Baserequests.input(self, data)
+        results = self.datain.get('results') or ()
+        if self.status and len(results) != len(self.requests):
+            self.status = False
+        if not self.status:
+            return
+        for r, result in zip(self.requests, results):
+            r.input(result)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+obs-websocket v5 protocol (OBS 28 and newer)
+
+Translation between the v5 messages and the v4 event/request classes of
+obswebsocket, so the tally logic works unchanged with both protocols (see
+aiowsclient.aiows5):
+- events: only the ones translated (EVENTS) are subscribed, and only if
+  registered (event subscription mask of the Identify message)
+- requests: the v4 requests used by the tally, incl. the scene items of
+  the scenes (GetSceneItemList), sent as RequestBatch
+- there is no Heartbeat event in v5, the connection is monitored by
+  websocket pings
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import base64
+import hashlib
+# third party
+from obswebsocket import events
+
+
+''' constants '''
+SUBPROTOCOL = "obswebsocket.json"
+RPC_VERSION = 1
+# opcodes
+OP_HELLO = 0
+OP_IDENTIFY = 1
+OP_IDENTIFIED = 2
+OP_REIDENTIFY = 3
+OP_EVENT = 5
+OP_REQUEST = 6
+OP_REQUEST_RESPONSE = 7
+OP_REQUEST_BATCH = 8
+OP_REQUEST_BATCH_RESPONSE = 9
+# event subscriptions (bits of the mask)
+SUB_CONFIG = 1 << 1
+SUB_SCENES = 1 << 2
+SUB_INPUTS = 1 << 3
+SUB_SCENE_ITEMS = 1 << 7
+# v5 event => (v4 event class name, subscription, v5 key => v4 key)
+EVENTS = {
+    'CurrentProgramSceneChanged': ('SwitchScenes', SUB_SCENES,
+                                   {'sceneName': 'scene-name'}),
+    'CurrentPreviewSceneChanged': ('PreviewSceneChanged', SUB_SCENES,
+                                   {'sceneName': 'scene-name'}),
+    'SceneItemEnableStateChanged': ('SceneItemVisibilityChanged', SUB_SCENE_ITEMS,
+                                    {'sceneName': 'scene-name',
+                                     'sceneItemId': 'item-id',
+                                     'sceneItemEnabled': 'item-visible'}),
+    'SceneItemCreated': ('SceneItemAdded', SUB_SCENE_ITEMS,
+                         {'sceneName': 'scene-name', 'sourceName': 'item-name',
+                          'sceneItemId': 'item-id'}),
+    'SceneItemRemoved': ('SceneItemRemoved', SUB_SCENE_ITEMS,
+                         {'sceneName': 'scene-name', 'sourceName': 'item-name',
+                          'sceneItemId': 'item-id'}),
+    'InputNameChanged': ('SourceRenamed', SUB_INPUTS,
+                         {'oldInputName': 'previousName',
+                          'inputName': 'newName'}),
+    'SceneNameChanged': ('SourceRenamed', SUB_SCENES,
+                         {'oldSceneName': 'previousName',
+                          'sceneName': 'newName'}),
+    'SceneCreated': ('ScenesChanged', SUB_SCENES, {}),
+    'SceneRemoved': ('ScenesChanged', SUB_SCENES, {}),
+    'CurrentSceneCollectionChanged': ('SceneCollectionChanged', SUB_CONFIG, {}),
+    }
+# v4 request => v5 request (None: answered without asking OBS)
+REQUESTS = {
+    'GetSceneList': 'GetSceneList',
+    'GetCurrentScene': 'GetCurrentProgramScene',
+    'GetPreviewScene': 'GetCurrentPreviewScene',
+    'SetHeartbeat': None,
+    }
+
+
+def authentication(password, salt, challenge):
+    """
+    the authentication string (the same for v4 and v5)
+    """
+    secret = base64.b64encode(hashlib.sha256(
+        (password + salt).encode('utf-8')).digest())
+    return base64.b64encode(hashlib.sha256(
+        secret + challenge.encode('utf-8')).digest()).decode('utf-8')
+
+
+def subscriptions(registered):
+    """
+    the event subscription mask for the registered v4 event classes
+    (None: all events, is ignored, e.g. to count them)
+    """
+    names = set(e.__name__ for e in registered if e is not None)
+    mask = 0
+    for name, bit, _keys in EVENTS.values():
+        if name in names:
+            mask |= bit
+    return mask
+
+
+def event(data):
+    """
+    the v4 event object of a v5 event (d of the message), None if it is
+    not translated
+    """
+    entry = EVENTS.get(data.get('eventType'))
+    if entry is None:
+        return None
+    name, _bit, keys = entry
+    obj = getattr(events, name)()
+    values = data.get('eventData') or {}
+    for key, key4 in keys.items():
+        obj.datain[key4] = values.get(key)
+    return obj
+
+
+def request(data, request_id):
+    """
+    one v5 request (in a Request or RequestBatch message)
+    """
+    r = {'requestType': data[0], 'requestId': request_id}
+    if data[1]:
+        r['requestData'] = data[1]
+    return r
+
+
+def ok(response):
+    """
+    True if a v5 request was successful
+    """
+    return bool((response.get('requestStatus') or {}).get('result'))
+
+
+def error(response):
+    """
+    the v4 answer of a failed v5 request
+    """
+    status = response.get('requestStatus') or {}
+    return {'message-id': None, 'status': 'error',
+            'error': status.get('comment') or "error {}".format(status.get('code'))}
+
+
+def scene_item(item, children=None):
+    """
+    the v4 scene item (see _scenegraph) of a v5 scene item, children: the
+    v4 items of a group
+    """
+    i = {'name': item.get('sourceName'),
+         'id': item.get('sceneItemId'),
+         'render': bool(item.get('sceneItemEnabled', True)),
+         'type': 'group' if item.get('isGroup') else
+                 'scene' if item.get('sourceType') == 'OBS_SOURCE_TYPE_SCENE' else
+                 item.get('inputKind')}
+    if item.get('isGroup'):
+        i['groupChildren'] = children or []
+    return i
+
+
+def answer(name, response, items):
+    """
+    the v4 answer of the v4 request 'name' from the v5 response and the
+    v4 scene items (scene name => items)
+    """
+    if not ok(response):
+        return error(response)
+    data = response.get('responseData') or {}
+    if name == 'GetSceneList':
+        return {'message-id': None, 'status': 'ok',
+                'current-scene': data.get('currentProgramSceneName'),
+                # (v5: the last scene first)
+                'scenes': [{'name': s['sceneName'],
+                            'sources': items.get(s['sceneName'], [])}
+                           for s in reversed(data.get('scenes') or ())]}
+    scene = data.get('currentProgramSceneName') or \
+        data.get('currentPreviewSceneName')
+    return {'message-id': None, 'status': 'ok', 'name': scene,
+            'sources': items.get(scene, [])}
+
+
+def scene_names(name, response):
+    """
+    the scenes of which the items are needed for the v4 answer
+    """
+    if not ok(response):
+        return []
+    data = response.get('responseData') or {}
+    if name == 'GetSceneList':
+        return [s['sceneName'] for s in data.get('scenes') or ()]
+    scene = data.get('currentProgramSceneName') or \
+        data.get('currentPreviewSceneName')
+    return [scene] if scene else []
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Output backends
+
+The LEDs are outputs of a backend. A backend writes a batch of changes
+at once (apply), e.g. all GPIO lines with one call or all shift registers
+with one SPI transfer. The outputs have the same on()/off()/toggle()
+interface as gpiozero.LED.
+
+Backends (selected per output by the attribute backend="..." of the
+<gpio_*> tag, the name of a backend type or of a <backend> definition):
+- gpiozero: one gpiozero.LED per GPIO (default)
+- gpiod: GPIO lines of a gpiochip, all changes set by one call (libgpiod
+         python bindings v1 or v2), option: chip
+- mock: in memory, records the changes (tests, benchmark)
+- shiftreg: 74HC595 shift registers (daisy chained) on the SPI bus, the
+            latch connected to CE, output n is bit n of the chain (QA of
+            the first register is 0), options: bus, device, chips, speed
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+from threading import Condition
+from time import perf_counter
+# own
+from _debugtools import debug
+
+
+''' constants '''
+DEFAULT_BACKEND = "gpiozero"
+CONSUMER = "obstally"
+
+
+class output(object):
+    '''
+    one output (LED) of a backend
+    '''
+    __slots__ = ('backend', 'nr', 'active_high', 'value')
+
+    def __init__(self, backend, nr, active_high=True):
+        self.backend = backend
+        self.nr = nr
+        self.active_high = active_high
+        self.value = False
+
+    @property
+    def is_lit(self):
+        return self.value
+
+    @property
+    def level(self):
+        """
+        the physical level (inverted if not active_high)
+        """
+        return self.value == self.active_high
+
+    def on(self):
+        self.backend.apply({self: True})
+
+    def off(self):
+        self.backend.apply({self: False})
+
+    def toggle(self):
+        self.backend.apply({self: not self.value})
+
+    def close(self):
+        self.backend.release(self)
+
+    def __repr__(self):
+        return "<output {} {}{}>".format(
+            self.backend.name, "" if self.active_high else "-", self.nr)
+
+
+class backend(object):
+    '''
+    base class of the backends, to be overloaded:
+    _add(output), _write(changes), _release(output)
+    '''
+    # outputs of backends with the same number space conflict,
+    # None: own number space
+    space = 'gpio'
+
+    def __init__(self, name, options=None):
+        self.name = name
+        self.options = options or {}
+        # number => output
+        self.outputs = {}
+
+    def add(self, nr, active_high=True):
+        """
+        a new output (switched off)
+        """
+        if nr in self.outputs:
+            raise ValueError("output {} of '{}' already in use".format(nr, self.name))
+        o = output(self, nr, active_high)
+        self._add(o)
+        self.outputs[nr] = o
+        self.apply({o: False})
+        return o
+
+    def apply(self, changes):
+        """
+        write a batch of changes (output => on), in the given order
+        """
+        for o, on in changes.items():
+            o.value = on
+        self._write(changes)
+
+    def release(self, o):
+        """
+        release an output
+        """
+        if self.outputs.get(o.nr) is o:
+            del self.outputs[o.nr]
+            self._release(o)
+
+    def _add(self, o):
+        pass
+
+    def _write(self, changes):
+        pass
+
+    def _release(self, o):
+        pass
+
+
+class gpiozerobackend(backend):
+    '''
+    one gpiozero.LED per output
+    '''
+    def __init__(self, name, options=None):
+        super(gpiozerobackend, self).__init__(name, options)
+        from gpiozero import LED
+        self._led = LED
+        self._leds = {}
+
+    def _add(self, o):
+        self._leds[o.nr] = self._led(pin=o.nr, active_high=o.active_high)
+
+    def _write(self, changes):
+        for o, on in changes.items():
+            if on:
+                self._leds[o.nr].on()
+            else:
+                self._leds[o.nr].off()
+
+    def _release(self, o):
+        self._leds.pop(o.nr).close()
+
+
+class gpiodbackend(backend):
+    '''
+    GPIO lines of a gpiochip (libgpiod), all lines are requested together
+    and all changes of a batch are set by one call
+    '''
+    def __init__(self, name, options=None):
+        super(gpiodbackend, self).__init__(name, options)
+        try:
+            import gpiod
+        except ImportError:
+            raise ImportError("backend '{}' needs the python module 'gpiod'".format(name))
+        self._gpiod = gpiod
+        self._chip = self.options.get('chip') or "/dev/gpiochip0"
+        # the actual request of the lines (and its offsets, v1 only)
+        self._request = None
+        self._offsets = None
+        self._dirty = False
+
+    def _add(self, o):
+        self._dirty = True
+
+    def _release(self, o):
+        self._request_lines()
+
+    def _write(self, changes):
+        if self._dirty:
+            # (re-)request all lines, with their actual levels
+            self._request_lines()
+            return
+        if self._request is None:
+            return
+        if self._offsets is None:
+            value = self._gpiod.line.Value
+            self._request.set_values(dict(
+                (o.nr, value.ACTIVE if o.level else value.INACTIVE)
+                for o in changes))
+        else:
+            self._request.set_values(
+                [int(self.outputs[nr].level) for nr in self._offsets])
+
+    def _request_lines(self):
+        gpiod = self._gpiod
+        if self._request is not None:
+            self._request.release()
+            self._request = None
+        self._dirty = False
+        if not self.outputs:
+            return
+        offsets = sorted(self.outputs)
+        levels = [int(self.outputs[nr].level) for nr in offsets]
+        if hasattr(gpiod, 'request_lines'):
+            # libgpiod v2
+            value = gpiod.line.Value
+            self._offsets = None
+            self._request = gpiod.request_lines(
+                self._chip, consumer=CONSUMER,
+                config={tuple(offsets): gpiod.LineSettings(
+                    direction=gpiod.line.Direction.OUTPUT)},
+                output_values=dict(
+                    (nr, value.ACTIVE if level else value.INACTIVE)
+                    for nr, level in zip(offsets, levels)))
+        else:
+            # libgpiod v1
+            self._offsets = offsets
+            self._request = gpiod.Chip(self._chip).get_lines(offsets)
+            self._request.request(consumer=CONSUMER,
+                                  type=gpiod.LINE_REQ_DIR_OUT,
+                                  default_vals=levels)
+
+
+class mockbackend(backend):
+    '''
+    outputs in memory: the physical levels and all changes with their
+    time (perf_counter) are recorded
+    '''
+    space = None
+
+    def __init__(self, name, options=None):
+        super(mockbackend, self).__init__(name, options)
+        # number => physical level
+        self.levels = {}
+        # number => list of (time, on)
+        self.changes = {}
+        # number of batches written
+        self.writes = 0
+        # notified on every batch
+        self.changed = Condition()
+
+    def _add(self, o):
+        self.levels[o.nr] = o.level
+        self.changes.setdefault(o.nr, [])
+
+    def _write(self, changes):
+        now = perf_counter()
+        with self.changed:
+            for o, on in changes.items():
+                if self.levels[o.nr] != o.level:
+                    self.levels[o.nr] = o.level
+                    self.changes[o.nr].append((now, on))
+            self.writes += 1
+            self.changed.notify_all()
+
+
+class shiftregbackend(backend):
+    '''
+    74HC595 shift registers on the SPI bus, all outputs are written by
+    one SPI transfer
+    '''
+    space = None
+
+    def __init__(self, name, options=None):
+        super(shiftregbackend, self).__init__(name, options)
+        try:
+            import spidev
+        except ImportError:
+            raise ImportError("backend '{}' needs the python module 'spidev'".format(name))
+        self.chips = int(self.options.get('chips') or 1)
+        self._levels = bytearray(self.chips)
+        self._spi = spidev.SpiDev()
+        self._spi.open(int(self.options.get('bus') or 0),
+                       int(self.options.get('device') or 0))
+        self._spi.max_speed_hz = int(self.options.get('speed') or 1000000)
+        self._flush()
+
+    def _add(self, o):
+        if not 0 <= o.nr < self.chips * 8:
+            raise ValueError("output {} of '{}' not in 0..{}".format(
+                o.nr, self.name, self.chips * 8 - 1))
+
+    def _write(self, changes):
+        for o in changes:
+            if o.level:
+                self._levels[o.nr // 8] |= 1 << (o.nr % 8)
+            else:
+                self._levels[o.nr // 8] &= ~(1 << (o.nr % 8)) & 0xff
+        self._flush()
+
+    def _flush(self):
+        # the first byte ends in the last register of the chain
+        self._spi.writebytes(list(reversed(self._levels)))
+
+
+# backend type => class
+BACKENDS = {
+    'gpiozero': gpiozerobackend,
+    'gpiod': gpiodbackend,
+    'mock': mockbackend,
+    'shiftreg': shiftregbackend,
+    }
+
+# the backends in use (shared by all tallies of the process): name => backend
+_backends = {}
+
+
+def backend_type(name, definitions=None):
+    """
+    the type of a backend: name of a backend type or of a definition
+    (dictionary name => {'type': ..., options...}), None if unknown
+    """
+    name = name or DEFAULT_BACKEND
+    if definitions and name in definitions:
+        name = definitions[name].get('type')
+    return name if name in BACKENDS else None
+
+
+def space(name, definitions=None):
+    """
+    the number space of a backend (outputs of backends in the same number
+    space conflict)
+    """
+    typ = backend_type(name, definitions)
+    return BACKENDS[typ].space or (name or DEFAULT_BACKEND)
+
+
+def get_backend(name, definitions=None):
+    """
+    the backend with the given name (created with the options of its
+    definition on first use)
+    """
+    name = name or DEFAULT_BACKEND
+    if name not in _backends:
+        typ = backend_type(name, definitions)
+        if typ is None:
+            raise ValueError("unknown backend '{}'".format(name))
+        options = (definitions or {}).get(name, {})
+        debug("output backend '%s' (%s)", name, typ)
+        _backends[name] = BACKENDS[typ](name, options)
+    return _backends[name]
+
+
+def apply(changes):
+    """
+    write changes (output => on) of any backends, one batch per backend
+    (in the given order within each backend)
+    """
+    batches = {}
+    for o, on in changes:
+        batches.setdefault(o.backend, {})[o] = on
+    for b, batch in batches.items():
+        b.apply(batch)
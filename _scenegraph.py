@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scene graph cache
+
+Holds the scenes of OBS with their scene items (as received by
+GetSceneList), kept up to date by the scene item events. The sources
+visible in a scene are resolved in memory, recursively through nested
+scenes and groups.
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+
+class scenegraph(object):
+    '''
+    the scene graph:
+    scenes: dictionary scene-name => list of scene items, each item is a
+            dictionary like OBS sends it ('name', 'id', 'type', 'render'
+            and 'groupChildren' for groups)
+    '''
+    def __init__(self):
+        self.scenes = {}
+        # cache: scene-name => (visible names, names of nested scenes/groups)
+        self._resolved = {}
+
+    def __contains__(self, scene):
+        return scene in self.scenes
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def load(self, scenes):
+        """
+        (re-)load the whole graph from a list of scenes
+        ({'name': ..., 'sources': [...]}, like GetSceneList sends it)
+        """
+        self.scenes = {}
+        for scene in scenes or ():
+            self.scenes[scene['name']] = list(scene.get('sources') or ())
+        self._resolved = {}
+
+    def set_scene(self, scene, sources):
+        """
+        set the scene items of one scene
+        """
+        self.scenes[scene] = list(sources or ())
+        self._resolved = {}
+
+    def clear(self):
+        """
+        forget everything
+        """
+        self.scenes = {}
+        self._resolved = {}
+
+    '''
+    INCREMENTAL UPDATES
+    '''
+    def _item_lists(self, scene):
+        """
+        internal helper: the list of scene items of a scene, or of each
+        group of that name (the items of groups are reported with the
+        group name as scene name)
+        """
+        if scene in self.scenes:
+            return [self.scenes[scene]]
+        lists = []
+        for items in self.scenes.values():
+            for i in self._walk(items):
+                if i.get('name') == scene and 'groupChildren' in i:
+                    lists.append(i['groupChildren'])
+        return lists
+
+    def _find_items(self, scene, item, item_id=None):
+        """
+        internal helper: all scene items matching item-name/-id in a
+        scene, or in a group of that name
+        """
+        result = []
+        for items in self._item_lists(scene):
+            for i in self._walk(items):
+                if (item_id is not None and i.get('id') == item_id) or \
+                   (item_id is None and i.get('name') == item):
+                    result.append(i)
+        if not result and item_id is not None:
+            return self._find_items(scene, item)
+        return result
+
+    def _walk(self, items):
+        """
+        internal helper: iterate over items incl. group children
+        """
+        for i in items:
+            yield i
+            if i.get('groupChildren'):
+                for c in self._walk(i['groupChildren']):
+                    yield c
+
+    def set_visible(self, scene, item, visible, item_id=None):
+        """
+        the visibility of a scene item changed,
+        returns True if the graph changed
+        """
+        changed = False
+        for i in self._find_items(scene, item, item_id):
+            if i.get('render') != visible:
+                i['render'] = visible
+                changed = True
+        if changed:
+            self._resolved = {}
+        return changed
+
+    def add_item(self, scene, item, item_id=None):
+        """
+        a scene item was added to a scene or group (new items are visible)
+        """
+        lists = self._item_lists(scene)
+        for items in lists:
+            items.append({'name': item, 'id': item_id, 'render': True})
+        if lists:
+            self._resolved = {}
+        return bool(lists)
+
+    def remove_item(self, scene, item, item_id=None):
+        """
+        a scene item was removed from a scene or group
+        """
+        found = set(id(i) for i in self._find_items(scene, item, item_id))
+        if not found:
+            return False
+        for items in self._item_lists(scene):
+            # only one item (by identity: items without id can be equal)
+            for n, i in enumerate(items):
+                if id(i) in found:
+                    del items[n]
+                    break
+        self._resolved = {}
+        return True
+
+    def rename(self, old, new):
+        """
+        a source (or scene) was renamed
+        """
+        if old in self.scenes:
+            self.scenes[new] = self.scenes.pop(old)
+        for items in self.scenes.values():
+            for i in self._walk(items):
+                if i.get('name') == old:
+                    i['name'] = new
+        self._resolved = {}
+
+    '''
+    RESOLUTION
+    '''
+    def _resolve(self, scene):
+        """
+        internal helper: visible names and nested scenes/groups of a
+        scene (cached)
+        """
+        if scene in self._resolved:
+            return self._resolved[scene]
+        visible = set()
+        nested = set()
+        path = set([scene])
+        # iterative depth-first walk, scenes nested more than once are
+        # resolved again, but a scene can not contain itself (cycle)
+        stack = [(iter(self.scenes.get(scene, ())), scene)]
+        while stack:
+            items, parent = stack[-1]
+            i = next(items, None)
+            if i is None:
+                stack.pop()
+                path.discard(parent)
+                continue
+            if not i.get('render', True):
+                continue
+            name = i.get('name')
+            visible.add(name)
+            if i.get('groupChildren'):
+                nested.add(name)
+                stack.append((iter(i['groupChildren']), None))
+            elif name in self.scenes and name not in path:
+                nested.add(name)
+                path.add(name)
+                stack.append((iter(self.scenes[name]), name))
+        self._resolved[scene] = (frozenset(visible), frozenset(nested))
+        return self._resolved[scene]
+
+    def visible(self, scene):
+        """
+        names of all visible sources of a scene (incl. nested scenes
+        and groups)
+        """
+        return self._resolve(scene)[0]
+
+    def depends_on(self, scene, other):
+        """
+        True if changes of the scene/group 'other' can change what is
+        visible in 'scene'
+        """
+        return scene == other or other in self._resolve(scene)[1]
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scheduler for periodic and delayed tasks
+
+One long-lived thread executes all tasks (heartbeat watchdog, LED blink,
+...) at their deadline (monotonic clock). It sleeps until the next
+deadline, without polling. Same interface for an asyncio event loop.
+The tasks must not block: work waiting for OBS is done by a scheduler of
+its own (the worker of wsclient).
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import heapq
+import itertools
+
+from threading import Condition, Thread
+from time import monotonic
+# own
+from _debugtools import debug
+
+
+class task(object):
+    '''
+    a scheduled task (returned by scheduler.after/every, to cancel it)
+    '''
+    __slots__ = ('func', 'args', 'interval', 'deadline', 'cancelled', 'handle')
+
+    def __init__(self, func, args, interval, deadline):
+        self.func = func
+        self.args = args
+        self.interval = interval
+        self.deadline = deadline
+        self.cancelled = False
+        self.handle = None
+
+    def __repr__(self):
+        return "<task {} every {}>".format(
+            getattr(self.func, '__name__', self.func), self.interval)
+
+
+class scheduler(Thread):
+    '''
+    executes tasks within one thread, at their deadline
+    '''
+    def __init__(self, name="scheduler"):
+        Thread.__init__(self, name=name)
+        self.daemon = True
+        self._cond = Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._stopped = False
+
+    def after(self, delay, func, *args):
+        """
+        execute func(*args) once, in delay seconds
+        """
+        return self._add(task(func, args, None, monotonic() + delay))
+
+    def every(self, interval, func, *args):
+        """
+        execute func(*args) every interval seconds (first in interval seconds)
+        """
+        return self._add(task(func, args, interval, monotonic() + interval))
+
+    def _add(self, t):
+        with self._cond:
+            heapq.heappush(self._queue, (t.deadline, next(self._seq), t))
+            self._cond.notify()
+        return t
+
+    def cancel(self, t):
+        """
+        cancel a task (has no effect if already executed or cancelled)
+        """
+        if t:
+            t.cancelled = True
+
+    def cancel_all(self):
+        """
+        cancel all tasks
+        """
+        with self._cond:
+            for _d, _s, t in self._queue:
+                t.cancelled = True
+            self._queue = []
+            self._cond.notify()
+
+    def stop(self):
+        """
+        cancel all tasks and end the thread
+        """
+        with self._cond:
+            self._stopped = True
+        self.cancel_all()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    if self._queue and self._queue[0][2].cancelled:
+                        heapq.heappop(self._queue)
+                        continue
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+                    wait = self._queue[0][0] - monotonic()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    _d, _s, t = heapq.heappop(self._queue)
+                    if t.interval:
+                        # next deadline based on the last one (no drift),
+                        # but do not catch up if too late
+                        t.deadline = max(t.deadline + t.interval, monotonic())
+                        heapq.heappush(self._queue, (t.deadline, next(self._seq), t))
+                    break
+            try:
+                t.func(*t.args)
+            except Exception as e:
+                debug(">>>> EXCEPTION in %s: %s", t, e)
+
+
+class aioscheduler(object):
+    '''
+    same interface as scheduler, executing the tasks within an asyncio
+    event loop (coroutines are executed as task)
+    '''
+    def __init__(self, loop):
+        self.loop = loop
+        self._tasks = set()
+
+    def after(self, delay, func, *args):
+        """
+        execute func(*args) once, in delay seconds
+        """
+        t = task(func, args, None, self.loop.time() + delay)
+        return self._add(t)
+
+    def every(self, interval, func, *args):
+        """
+        execute func(*args) every interval seconds (first in interval seconds)
+        """
+        t = task(func, args, interval, self.loop.time() + interval)
+        return self._add(t)
+
+    def _add(self, t):
+        t.handle = self.loop.call_at(t.deadline, self._run, t)
+        self._tasks.add(t)
+        return t
+
+    def _run(self, t):
+        if t.cancelled:
+            return
+        if t.interval:
+            t.deadline = max(t.deadline + t.interval, self.loop.time())
+            t.handle = self.loop.call_at(t.deadline, self._run, t)
+        else:
+            self._tasks.discard(t)
+        try:
+            result = t.func(*t.args)
+            if hasattr(result, '__await__'):
+                self.loop.create_task(result)
+        except Exception as e:
+            debug(">>>> EXCEPTION in %s: %s", t, e)
+
+    def cancel(self, t):
+        """
+        cancel a task (has no effect if already executed or cancelled)
+        """
+        if t:
+            t.cancelled = True
+            if t.handle:
+                t.handle.cancel()
+            self._tasks.discard(t)
+
+    def cancel_all(self):
+        """
+        cancel all tasks
+        """
+        for t in list(self._tasks):
+            self.cancel(t)
+
+    def stop(self):
+        """
+        cancel all tasks
+        """
+        self.cancel_all()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+systemd service notifications (sd_notify protocol, without libsystemd)
+
+With Type=notify the service is started as soon as the tally sends
+READY=1 (the LEDs show the connection state, OBS does not need to be
+reachable). With WatchdogSec= the tally sends WATCHDOG=1 from its
+scheduler: if it hangs, systemd restarts it.
+
+    [Service]
+    Type=notify
+    WatchdogSec=10
+    ExecStart=/usr/bin/python3 /home/pi/obstally/tally.py
+
+Outside of systemd (no NOTIFY_SOCKET) nothing is sent.
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import os
+import socket
+# own
+from _debugtools import debug
+
+
+def notify(*states):
+    """
+    send the states (e.g. 'READY=1', 'STATUS=...') to systemd, False if
+    not started by systemd (or not sent)
+    """
+    path = os.environ.get('NOTIFY_SOCKET')
+    if not path:
+        return False
+    if path.startswith('@'):
+        # abstract namespace
+        path = '\0' + path[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            # never block the caller (the scheduler), if systemd is busy
+            s.setblocking(False)
+            s.connect(path)
+            s.send("\n".join(states).encode('utf-8'))
+    except (AttributeError, OSError) as e:
+        debug("sd_notify %s failed: %s", states, e)
+        return False
+    return True
+
+
+def watchdog_interval():
+    """
+    seconds within systemd expects WATCHDOG=1 (WatchdogSec=), None if the
+    watchdog is not enabled for this process
+    """
+    try:
+        usec = int(os.environ.get('WATCHDOG_USEC') or 0)
+        pid = int(os.environ.get('WATCHDOG_PID') or os.getpid())
+    except ValueError:
+        return None
+    if usec <= 0 or pid != os.getpid():
+        return None
+    return usec / 1000000.0
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Startup timing
+
+The durations of the startup phases, logged when the tally is ready and
+served as metric (obstally_startup_seconds), to keep the time from boot
+to the first LED state low:
+    python      interpreter start and imports (until the tally is created)
+    init        scheduler, signals, network monitor
+    config      reading the XML-file
+    outputs     initialising the GPIOs (incl. loading gpiozero)
+    leds        showing the connection state ("connecting")
+    websocket   loading the OBS client
+    connected   waiting for OBS until connected (after ready)
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import os
+
+from time import perf_counter
+
+
+def process_age():
+    """
+    seconds since the start of the process, None if unknown (not linux)
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # field 22: start time in clock ticks since boot
+            start = int(f.read().rsplit(')', 1)[1].split()[19])
+        return max(uptime() - start / os.sysconf('SC_CLK_TCK'), 0.0)
+    except (OSError, TypeError, ValueError, IndexError):
+        return None
+
+
+def uptime():
+    """
+    seconds since boot, None if unknown (not linux)
+    """
+    try:
+        with open('/proc/uptime') as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class startuptimer(object):
+    '''
+    durations of the startup phases: list of (name, seconds), each phase
+    ends with mark()
+    '''
+    def __init__(self):
+        self._last = perf_counter()
+        age = process_age()
+        self.phases = [] if age is None else [('python', age)]
+        # the tally is up (see summary)
+        self.ready = False
+        self._connected = False
+
+    def mark(self, name):
+        """
+        end of the phase 'name'
+        """
+        now = perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def connected(self):
+        """
+        end of the phase 'connected' (first connection to OBS), False if
+        connected before
+        """
+        if self._connected:
+            return False
+        self._connected = True
+        self.mark('connected')
+        return True
+
+    def total(self):
+        """
+        seconds from the start of the process until the last phase
+        """
+        return sum(s for _name, s in self.phases)
+
+    def summary(self):
+        """
+        the phases as text
+        """
+        boot = uptime()
+        return "{} (total {:.3f}s{})".format(
+            ", ".join("{} {:.3f}s".format(n, s) for n, s in self.phases),
+            self.total(),
+            ", {:.1f}s after boot".format(boot) if boot is not None else "")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistent tally state
+
+The last known state (scenes in program/preview and the scene graph) is
+saved to a small JSON file on change, to show it immediately after the
+next start (e.g. after a power blip), until OBS confirms the actual state.
+The file is replaced atomically, a power loss while writing leaves the
+previous state. It is written by a thread of its own: the caller (the
+scheduler, in aiotally the event loop) does not wait for the disk.
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import json
+import logging
+import os
+
+from threading import Condition, Thread, current_thread
+from time import time
+# own
+from _debugtools import debug, sampled
+
+
+''' constants '''
+# seconds until a saved state is too old to be shown
+CACHE_MAX_AGE = 15 * 60
+# seconds a change is delayed before saving (changes within are saved once)
+CACHE_DELAY = 1
+# seconds the saved state is shown without connection to OBS, before all
+# LEDs are switched on (as usual when not connected)
+STALE_TIMEOUT = 60
+# seconds to wait for the last state to be written, when closed
+WRITE_TIMEOUT = 5
+
+
+def _dumps(state):
+    return json.dumps(state, separators=(',', ':'), sort_keys=True)
+
+
+class statecache(object):
+    '''
+    the state file: load() the saved state, save(state) a changed state
+    (state: dictionary, serializable by JSON), close() when done
+    '''
+    def __init__(self, path, max_age=CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        # the content of the file (to save only changes)
+        self._saved = None
+        # the state to be written by the writer thread: (time, content)
+        self._pending = None
+        self._cond = Condition()
+        self._writer = None
+
+    def load(self):
+        """
+        the saved state and its age in seconds,
+        (None, None) if there is none (or too old)
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            age = time() - data['time']
+            state = data['state']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            debug("no state cache %s: %s", self.path, e)
+            return None, None
+        if not 0 <= age <= self.max_age:
+            debug("state cache %s too old (%ds)", self.path, age)
+            return None, None
+        self._saved = _dumps(state)
+        return state, age
+
+    def save(self, state):
+        """
+        save the state if changed, returns True if it will be written
+        (raises RuntimeError if state is changed while serializing)
+        """
+        content = _dumps(state)
+        with self._cond:
+            if content == self._saved:
+                return False
+            self._saved = content
+            self._pending = (time(), content)
+            if self._writer is None:
+                self._writer = Thread(target=self._run, name="statecache")
+                self._writer.daemon = True
+                self._writer.start()
+            self._cond.notify_all()
+        return True
+
+    def close(self):
+        """
+        write the pending state (waits max. WRITE_TIMEOUT seconds) and
+        stop the writer thread
+        """
+        with self._cond:
+            writer, self._writer = self._writer, None
+            self._cond.notify_all()
+        if writer:
+            writer.join(WRITE_TIMEOUT)
+
+    def _run(self):
+        # the writer thread: only the last state is written
+        me = current_thread()
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._pending or self._writer is not me)
+                if not self._pending:
+                    return
+                stamp, content = self._pending
+                self._pending = None
+            if not self._write(stamp, content):
+                with self._cond:
+                    if self._saved == content:
+                        # again with the next save
+                        self._saved = None
+
+    def _write(self, stamp, content):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, 'w') as f:
+                f.write('{{"time":{},"state":{}}}'.format(stamp, content))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._sync_dir()
+        except OSError as e:
+            sampled("state cache %s not saved: %s", self.path, e,
+                    level=logging.WARNING, interval=60)
+            return False
+        return True
+
+    def _sync_dir(self):
+        # the rename itself must also reach the disk
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+OBS Tallylights via OBS-Websockets and GPIOzero, asyncio variant.
+
+Same tally logic as tally.py, but using the asyncio based OBS client.
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+# third party
+from obswebsocket import requests
+# own
+from aiowsclient import aiowsclient
+from tally import tally
+from _debugtools import debug
+from _obsbatch import batch
+
+
+class aiotally(aiowsclient, tally):
+    '''
+    tally logic (see tally) on top of the asyncio client (see aiowsclient)
+    '''
+    async def get_actual_status(self):
+        """
+        request actual scene/source status from OBS (in one round trip,
+        if supported) an update LEDs
+        """
+        debug("... get_actual_status()")
+        scenes, preview = self.status_requests()
+        if self._batch:
+            self._batch = (await self.ws.call(batch(scenes, preview))).status
+        if not self._batch:
+            # OBS < 4.9: one request after the other
+            await self.ws.call(scenes)
+            await self.ws.call(preview)
+        self.set_actual_status(scenes, preview)
+
+    async def refresh_scene_graph(self):
+        """
+        reload the scene graph from OBS
+        """
+        debug("... refresh_scene_graph()")
+        scenes = await self.ws.call(requests.GetSceneList())
+        self.capture_status(scenes)
+        self.graph.load(scenes.getScenes())
+        self._update_scene()
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    test_obj = aiotally()
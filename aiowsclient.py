@@ -0,0 +1,750 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Base Class, asyncio variant
+
+Same hooks as wsclient, but the websocket connection, the heartbeat
+watchdog and the reconnect backoff are all handled within one asyncio
+event loop (no receive thread, no Timer threads, no ping processes).
+OBS 28 and newer (obs-websocket v5) is supported by <protocol>5</protocol>.
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import asyncio
+import base64
+import hashlib
+import json
+import signal
+
+from threading import RLock
+from time import monotonic
+# third party
+import websockets
+from obswebsocket import events, exceptions, requests
+from obswebsocket.base_classes import Baserequests
+# own
+import _obsv5 as v5
+from wsclient import wsclient, CON_CHECK_DELAY
+from _debugtools import debug
+from _obsbatch import batch
+from _netprobe import aioprobe, backoff, reconnectstats
+from _scheduler import aioscheduler
+from _sdnotify import notify as sd_notify
+from _startup import startuptimer
+
+
+''' constants '''
+# timeout in seconds for a websocket (re-)connect incl. authentication
+CON_TIMEOUT = 5
+# timeout in seconds to wait for the answer of a request
+CALL_TIMEOUT = 10
+# liveness by websocket pings (instead of the Heartbeat event of OBS):
+# seconds between two pings, unanswered pings until the connection is lost
+PING_INTERVAL = 0.2
+PING_MISSES = 3
+
+
+class aiows(object):
+    '''
+    minimal obs-websocket (v4) client on top of one asyncio websocket.
+
+    It offers the same register()/call() interface as obswebsocket.obsws
+    and uses the same event/request classes, except that call() is a
+    coroutine. Registered callbacks are executed within the event loop, in
+    the order the events are received. If a callback returns a coroutine,
+    it is scheduled as a task (so it can call() without blocking the
+    receiving of its own answer).
+
+    With ping_interval, the peer is pinged: on_alive() is called for every
+    answer, after ping_misses unanswered pings the connection is closed.
+    '''
+    def __init__(self, host='localhost', port=4444, password=''):
+        self.host = host
+        self.port = port
+        self.password = password or ''
+        # actual connection status
+        self.connected = False
+        # callback to be executed when the connection is lost
+        self.on_close = None
+        # liveness by websocket pings (None: no pings)
+        self.ping_interval = None
+        self.ping_misses = PING_MISSES
+        self.on_alive = None
+        # internal
+        self.id = 1
+        self.ws = None
+        self.answers = {}
+        self.functions = []
+        self._recv_task = None
+        self._ping_task = None
+
+    async def connect(self):
+        """
+        connect to the websocket server and authenticate
+        """
+        options = {'max_size': None}
+        if self.ping_interval:
+            # (instead of the keepalive pings of websockets)
+            options['ping_interval'] = None
+        self.ws = await self._open(options)
+        self._recv_task = asyncio.get_running_loop().create_task(
+            self._recv_loop())
+        try:
+            await self._auth()
+        except BaseException:
+            await self.disconnect()
+            raise
+        self.connected = True
+        if self.ping_interval:
+            self._ping_task = asyncio.get_running_loop().create_task(
+                self._ping_loop())
+
+    async def _open(self, options):
+        return await websockets.connect(
+            "ws://{}:{}".format(self.host, self.port), **options)
+
+    async def reconnect(self):
+        """
+        restart the connection to the websocket server
+        """
+        await self.disconnect()
+        await self.connect()
+
+    async def disconnect(self):
+        """
+        disconnect from the websocket server
+        """
+        self.connected = False
+        if self._ping_task:
+            self._ping_task.cancel()
+            self._ping_task = None
+        if self._recv_task:
+            self._recv_task.cancel()
+            self._recv_task = None
+        if self.ws:
+            try:
+                await self.ws.close()
+            except Exception:
+                pass
+            self.ws = None
+        for fut in self.answers.values():
+            if not fut.done():
+                fut.set_exception(
+                    exceptions.ConnectionFailure("connection closed"))
+        self.answers.clear()
+
+    async def _auth(self):
+        result = await self.send({"request-type": "GetAuthRequired"})
+        if result['status'] != 'ok':
+            raise exceptions.ConnectionFailure(result['error'])
+        if result.get('authRequired'):
+            secret = base64.b64encode(
+                hashlib.sha256(
+                    (self.password + result['salt']).encode('utf-8')
+                ).digest()
+            )
+            auth = base64.b64encode(
+                hashlib.sha256(
+                    secret + result['challenge'].encode('utf-8')
+                ).digest()
+            ).decode('utf-8')
+            result = await self.send({
+                "request-type": "Authenticate",
+                "auth": auth})
+            if result['status'] != 'ok':
+                raise exceptions.ConnectionFailure(result['error'])
+
+    async def call(self, obj):
+        """
+        send a request (class from obswebsocket.requests) to OBS and
+        return it populated with the answer
+        """
+        if not isinstance(obj, Baserequests):
+            raise exceptions.ObjectError(
+                "Call parameter is not a request object")
+        r = await self.send(obj.data())
+        obj.input(r)
+        return obj
+
+    async def send(self, data):
+        """
+        send a raw json request to OBS and return the answer (dict)
+        """
+        if not self.ws:
+            raise exceptions.ConnectionFailure("not connected")
+        message_id = str(self.id)
+        self.id += 1
+        data["message-id"] = message_id
+        fut = asyncio.get_running_loop().create_future()
+        self.answers[message_id] = fut
+        try:
+            await self.ws.send(json.dumps(data))
+            return await asyncio.wait_for(fut, CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise exceptions.MessageTimeout(
+                "No answer for message {}".format(message_id))
+        finally:
+            self.answers.pop(message_id, None)
+
+    def register(self, func, event=None):
+        """
+        register a callback for an event (class from obswebsocket.events),
+        None means all events
+        """
+        self.functions.append((func, event))
+
+    def unregister(self, func, event=None):
+        """
+        unregister a callback
+        """
+        self.functions = [(f, e) for f, e in self.functions
+                          if not (f == func and (event is None or e == event))]
+
+    def trigger(self, obj):
+        """
+        execute all callbacks registered for the given event object
+        """
+        for func, event in self.functions:
+            if event is None or isinstance(obj, event):
+                try:
+                    result = func(obj)
+                except Exception as e:
+                    debug(">>>> EXCEPTION in %s: %s", obj.name, e)
+                    continue
+                if asyncio.iscoroutine(result):
+                    asyncio.get_running_loop().create_task(result)
+
+    async def _ping_loop(self):
+        loop = asyncio.get_running_loop()
+        misses = 0
+        while self.ws:
+            sent = loop.time()
+            try:
+                pong = await self.ws.ping()
+                await asyncio.wait_for(pong, self.ping_interval)
+            except asyncio.TimeoutError:
+                misses += 1
+                if misses >= self.ping_misses:
+                    debug("... . no answer to %s pings, connection lost",
+                          misses)
+                    # (no closing handshake with a dead peer)
+                    self.ws.transport.abort()
+                    return
+                continue
+            except websockets.exceptions.ConnectionClosed:
+                return
+            misses = 0
+            if self.on_alive:
+                self.on_alive()
+            await asyncio.sleep(max(0, self.ping_interval - (loop.time() - sent)))
+
+    async def _recv_loop(self):
+        try:
+            async for message in self.ws:
+                try:
+                    result = json.loads(message)
+                except ValueError:
+                    debug("invalid message: %s", message)
+                    continue
+                if 'update-type' in result:
+                    try:
+                        obj = getattr(events, result['update-type'])()
+                    except AttributeError:
+                        continue
+                    obj.input(result)
+                    self.trigger(obj)
+                elif 'message-id' in result:
+                    fut = self.answers.get(result['message-id'])
+                    if fut and not fut.done():
+                        fut.set_result(result)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            was_connected = self.connected
+            self.connected = False
+            self._recv_task = None
+            if was_connected and self.on_close:
+                self.on_close()
+
+
+class aiows5(aiows):
+    '''
+    obs-websocket v5 client with the interface of aiows: the v4 event and
+    request classes are translated (see _obsv5). OBS sends only the events
+    registered (subscription mask, also updated when registering while
+    connected). There is no Heartbeat event, the liveness is checked by
+    pings (see aiows).
+    '''
+    def __init__(self, host='localhost', port=4455, password=''):
+        aiows.__init__(self, host, port, password)
+        self.ping_interval = PING_INTERVAL
+
+    async def _open(self, options):
+        return await websockets.connect(
+            "ws://{}:{}".format(self.host, self.port),
+            subprotocols=[v5.SUBPROTOCOL], **options)
+
+    async def _auth(self):
+        hello = await self._wait('hello')
+        d = {'rpcVersion': v5.RPC_VERSION,
+             'eventSubscriptions': self.subscriptions()}
+        auth = hello.get('authentication')
+        if auth:
+            d['authentication'] = v5.authentication(
+                self.password, auth['salt'], auth['challenge'])
+        identified = self._future('identified')
+        await self.ws.send(json.dumps({'op': v5.OP_IDENTIFY, 'd': d}))
+        await self._wait('identified', identified)
+
+    def _future(self, key):
+        fut = self.answers.get(key)
+        if fut is None:
+            fut = asyncio.get_running_loop().create_future()
+            self.answers[key] = fut
+        return fut
+
+    async def _wait(self, key, fut=None):
+        fut = fut or self._future(key)
+        try:
+            return await asyncio.wait_for(fut, CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise exceptions.MessageTimeout("No {} message".format(key))
+        finally:
+            self.answers.pop(key, None)
+
+    def subscriptions(self):
+        """
+        the event subscription mask of the registered events
+        """
+        return v5.subscriptions(e for _f, e in self.functions)
+
+    def register(self, func, event=None):
+        aiows.register(self, func, event)
+        if self.connected and event is not None:
+            asyncio.get_running_loop().create_task(self.ws.send(json.dumps({
+                'op': v5.OP_REIDENTIFY,
+                'd': {'eventSubscriptions': self.subscriptions()}})))
+
+    async def call(self, obj):
+        """
+        send a v4 request (or a batch of them, see _obsbatch) to OBS and
+        return it populated with the answer
+        """
+        if not isinstance(obj, Baserequests):
+            raise exceptions.ObjectError(
+                "Call parameter is not a request object")
+        if isinstance(obj, batch):
+            obj.input({'message-id': None, 'status': 'ok',
+                       'results': await self.translate(obj.requests)})
+        else:
+            obj.input((await self.translate([obj]))[0])
+        return obj
+
+    async def translate(self, requests):
+        """
+        the v4 answers of v4 requests: the v5 requests and then the items
+        of the scenes answered, each step in one RequestBatch
+        """
+        answers = [None] * len(requests)
+        todo = []
+        for i, r in enumerate(requests):
+            if r.name not in v5.REQUESTS:
+                answers[i] = {'message-id': None, 'status': 'error',
+                              'error': "not supported by obs-websocket v5"}
+            elif v5.REQUESTS[r.name] is None:
+                answers[i] = {'message-id': None, 'status': 'ok'}
+            else:
+                todo.append(i)
+        if not todo:
+            return answers
+        responses = await self.send_batch(
+            [(v5.REQUESTS[requests[i].name], None) for i in todo])
+        scenes = []
+        for i, response in zip(todo, responses):
+            for name in v5.scene_names(requests[i].name, response):
+                if name not in scenes:
+                    scenes.append(name)
+        items = await self.scene_items(scenes)
+        for i, response in zip(todo, responses):
+            answers[i] = v5.answer(requests[i].name, response, items)
+        return answers
+
+    async def scene_items(self, scenes):
+        """
+        the v4 scene items of the scenes (incl. the items of the groups):
+        scene name => items
+        """
+        if not scenes:
+            return {}
+        responses = await self.send_batch(
+            [('GetSceneItemList', {'sceneName': s}) for s in scenes])
+        lists = dict((s, (r.get('responseData') or {}).get('sceneItems') or [])
+                     for s, r in zip(scenes, responses) if v5.ok(r))
+        groups = []
+        for items in lists.values():
+            for i in items:
+                if i.get('isGroup') and i.get('sourceName') not in groups:
+                    groups.append(i['sourceName'])
+        children = {}
+        if groups:
+            responses = await self.send_batch(
+                [('GetGroupSceneItemList', {'sceneName': g}) for g in groups])
+            children = dict(
+                (g, [v5.scene_item(i) for i in
+                     (r.get('responseData') or {}).get('sceneItems') or ()])
+                for g, r in zip(groups, responses) if v5.ok(r))
+        return dict((s, [v5.scene_item(i, children.get(i.get('sourceName')))
+                         for i in items])
+                    for s, items in lists.items())
+
+    async def send_batch(self, requests):
+        """
+        send v5 requests [(type, data), ...] in one message (Request or
+        RequestBatch), returns the responses in the same order
+        """
+        if len(requests) == 1:
+            return [await self.send_op(v5.OP_REQUEST, v5.request(requests[0], None))]
+        d = {'haltOnFailure': False,
+             'requests': [v5.request(r, str(i)) for i, r in enumerate(requests)]}
+        results = (await self.send_op(v5.OP_REQUEST_BATCH, d)).get('results') or []
+        by_id = dict((r.get('requestId'), r) for r in results)
+        return [by_id.get(str(i), {}) for i in range(len(requests))]
+
+    async def send_op(self, op, d):
+        """
+        send a v5 message and return the response (d of the message)
+        """
+        if not self.ws:
+            raise exceptions.ConnectionFailure("not connected")
+        request_id = str(self.id)
+        self.id += 1
+        d['requestId'] = request_id
+        fut = self._future(request_id)
+        await self.ws.send(json.dumps({'op': op, 'd': d}))
+        return await self._wait(request_id, fut)
+
+    async def _recv_loop(self):
+        try:
+            async for message in self.ws:
+                try:
+                    msg = json.loads(message)
+                    op, d = msg['op'], msg['d']
+                except (ValueError, KeyError, TypeError):
+                    debug("invalid message: %s", message)
+                    continue
+                if op == v5.OP_EVENT:
+                    obj = v5.event(d)
+                    if obj is not None:
+                        self.trigger(obj)
+                    continue
+                if op == v5.OP_HELLO:
+                    key = 'hello'
+                elif op == v5.OP_IDENTIFIED:
+                    key = 'identified'
+                elif op in (v5.OP_REQUEST_RESPONSE,
+                            v5.OP_REQUEST_BATCH_RESPONSE):
+                    key = d.get('requestId')
+                else:
+                    continue
+                fut = self.answers.get(key)
+                if fut and not fut.done():
+                    fut.set_result(d)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            was_connected = self.connected
+            self.connected = False
+            self._recv_task = None
+            for fut in self.answers.values():
+                if not fut.done():
+                    fut.set_exception(
+                        exceptions.ConnectionFailure("connection closed"))
+            if was_connected and self.on_close:
+                self.on_close()
+
+
+def register_signals(loop, client):
+    """
+    handle SIGHUP, SIGINT and SIGTERM within the event loop by the
+    on_SIGxxx functions of client
+    """
+    for signum, handler in ((signal.SIGHUP, client.on_SIGHUP),
+                            (signal.SIGINT, client.on_SIGINT),
+                            (signal.SIGTERM, client.on_SIGTERM)):
+        try:
+            loop.add_signal_handler(signum, handler, signum, None)
+        except (RuntimeError, ValueError):
+            # not in the main thread (e.g. testing)
+            pass
+
+
+class aiowsclient(wsclient):
+    '''
+    this class does the same as wsclient (and can be used as base class
+    the same way), but runs within an asyncio event loop:
+    - one websocket connection (aiows), events are processed in the loop
+    - one task to monitor the connection (heartbeat watchdog) and to
+      reconnect with an increasing delay
+    - system-signals are handled by the loop
+
+    All hooks keep their names. get_actual_status() and on_reconnect()
+    may be coroutines, as requests to OBS need to be awaited.
+    '''
+    # the event loop
+    loop = None
+    # the task monitoring the connection
+    _check_task = None
+    # set when the connection is lost, to wake up the connection check
+    _lost_event = None
+    # handle the system-signals (False if handled by the caller)
+    signals = True
+    # obs-websocket protocol versions supported (<protocol>)
+    protocols = (4, 5)
+
+    def __init__(self, autorun=True, instance=0, signals=True):
+        """
+        initialise the enviroment
+        (if autorun is False, main() needs to be awaited by the caller)
+
+        instance: number of the <obswebsocket> block in the XML-file
+        signals: register the system-signal handlers
+        """
+        self.startup = startuptimer()
+        debug("aiowsclient.__init__()")
+        self.instance = instance
+        self.signals = signals
+        self._lock = RLock()
+        self.reconnect_stats = reconnectstats()
+        self.event_counts = {}
+        if autorun:
+            self.run()
+
+    def run(self):
+        """
+        run the event loop until stopped
+        """
+        debug("... aiowsclient.run()")
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            pass
+
+    async def main(self):
+        """
+        load the config, connect to OBS and process everything until
+        stopped by a signal or the 'stop' flag
+        """
+        self.loop = asyncio.get_running_loop()
+        self.scheduler = aioscheduler(self.loop)
+        self._stop_event = asyncio.Event()
+        self._lost_event = asyncio.Event()
+        # register the signals to be caught
+        if self.signals:
+            register_signals(self.loop, self)
+        # read xml + init leds based on config and OBS websocket initialisation
+        # re-select the host when the network changes
+        self.netmonitor_start()
+        if not self.reload():
+            self.netmonitor_stop()
+            return
+        self.startup_done()
+        try:
+            await self._stop_event.wait()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """
+        disconnect from OBS and switch off all LEDs
+        """
+        if self.systemd:
+            sd_notify('STOPPING=1')
+        self.watchdog_stop()
+        self.netmonitor_stop()
+        self.scheduler.stop()
+        if self.ws:
+            await self.ws.disconnect()
+        self.shutdown_leds()
+
+    def shutdown(self):
+        """
+        close/stop the programm
+        """
+        self.stop = True
+
+    '''
+    OBS CONNECTION
+    '''
+    def connection_start(self):
+        """
+        initialisation of the OBS websocket
+        (the connection itself is established by the connection check)
+        """
+        debug("aiowsclient.connection_start(%s:%s)",
+              self.obs['host'],
+              self.obs['port'])
+        if self.ws:
+            self.loop.create_task(self.ws.disconnect())
+        self.ws = self.create_ws()
+        self.ws.on_close = self.on_connection_lost
+        self.register_obs_events()
+        self.last_heartbeat = None
+        self.connected = False
+        self.on_disconnect()
+        self.startup_mark('leds')
+
+    def create_ws(self):
+        """
+        the websocket object (to be overloaded to connect to something
+        else than OBS)
+        """
+        if self.obs['protocol'] == 5:
+            ws = aiows5(self.obs['host'], self.obs['port'], self.obs['pass'])
+        else:
+            ws = aiows(self.obs['host'], self.obs['port'], self.obs['pass'])
+        if self.liveness() == 'ping':
+            ws.ping_interval = float(self.obs.get('ping_interval') or PING_INTERVAL)
+            ws.ping_misses = int(self.obs.get('ping_misses') or PING_MISSES)
+            ws.on_alive = self.on_heartbeat
+        return ws
+
+    def liveness(self):
+        """
+        how the connection is monitored, by <liveness> in the XML-file:
+        'ping' (websocket pings, by default) or 'heartbeat' (Heartbeat
+        events of OBS, only obs-websocket 4)
+        """
+        if self.obs['protocol'] != 5 and \
+           (self.obs.get('liveness') or '').lower() == 'heartbeat':
+            return 'heartbeat'
+        return 'ping'
+
+    def watchdog_start(self):
+        """
+        start to monitor the connection (connection check task)
+        """
+        self._check_task = self.loop.create_task(self.connection_check())
+
+    def watchdog_stop(self):
+        """
+        stop to monitor the connection
+        """
+        if self._check_task:
+            self._check_task.cancel()
+            self._check_task = None
+
+    async def connection_check(self):
+        """
+        watchdog: check the connection status based on last 'heartbeat'
+        and (re-)connect if necessary, with increasing delay (and jitter)
+        between two unsuccessful attempts
+        """
+        delays = backoff()
+        while not self.stop:
+            diff = monotonic() - self.last_heartbeat if self.last_heartbeat else None
+            if not self.ws.connected or diff is None or \
+               diff > (CON_CHECK_DELAY + CON_CHECK_DELAY + 1):
+                debug("... . diff = %s, connection = %s",
+                      diff, self.ws.connected)
+                if not await self.connection_try():
+                    await asyncio.sleep(next(delays))
+                    continue
+                delays = backoff()
+            self._lost_event.clear()
+            try:
+                await asyncio.wait_for(self._lost_event.wait(), CON_CHECK_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+    async def connection_try(self):
+        """
+        try to (re-)establish the websocket connection to OBS
+        """
+        if self.connected:
+            self.connected = False
+            self.on_disconnect()
+        # (the outage began with the last heartbeat, not when noticed)
+        self.reconnect_stats.begin(self.last_heartbeat)
+        self.reconnect_stats.attempt()
+        # check if the websocket port is reachable
+        if not await aioprobe(self.obs['host'], self.obs['port'],
+                              self.probe_timeout()):
+            return False
+        try:
+            debug("... . reconnect()")
+            await asyncio.wait_for(self.ws.reconnect(), CON_TIMEOUT)
+            await self.on_reconnect()
+        except (OSError, asyncio.TimeoutError,
+                websockets.exceptions.WebSocketException,
+                exceptions.ConnectionFailure,
+                exceptions.MessageTimeout) as e:
+            debug(">>>> connection failed: %s", e)
+        except Exception as e:
+            # e.g. an incomplete answer of OBS (the watchdog must go on)
+            debug(">>>> EXCEPTION: %s", e)
+        else:
+            debug("... . reconnected after %.3fs (%s)",
+                  self.reconnect_stats.done(), self.reconnect_stats)
+            self.startup_connected()
+            return True
+        # (maybe connected, without the actual status): again on next try
+        await self.ws.disconnect()
+        return False
+
+    def defer(self, func, *args):
+        """
+        execute func(*args) later within the event loop
+        (coroutines are executed as task), can be called from any thread
+        """
+        def _run():
+            result = func(*args)
+            if asyncio.iscoroutine(result):
+                self.loop.create_task(result)
+        self.loop.call_soon_threadsafe(_run)
+
+    def reconnect_now(self):
+        """
+        (re-)connect to the actual host at once (restarts the connection
+        check)
+        """
+        if not self.ws or self.stop:
+            return
+        self.ws.host = self.obs['host']
+        self.last_heartbeat = None
+        self.watchdog_stop()
+        self.watchdog_start()
+
+    def on_connection_lost(self):
+        """
+        the websocket was closed, wake up the connection check
+        """
+        debug("... aiowsclient.on_connection_lost()")
+        self._lost_event.set()
+
+    '''
+    EVENTS to be extended/overwritten on inheritance
+    '''
+    async def on_reconnect(self):
+        """
+        perform actions when connection is established
+
+        Can be extended by inherited classes:
+           await super(XXX, self).on_reconnect()
+        """
+        self.on_heartbeat(reason="force")
+        result = self.get_actual_status()
+        if asyncio.iscoroutine(result):
+            await result
+        if self.liveness() == 'heartbeat':
+            # advice OBS to send us a heartbeat (to monitor the connection)
+            await self.ws.call(requests.SetHeartbeat(True))
+        # update LED to show actual status
+        self.connected_led(blink=False)
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    test_obj = aiowsclient()
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the tally against a fake OBS (see _fakeobs, running in its
+own process) and gpiozero mock pins (or the mock output backend, see
+_outputs):
+- event-to-GPIO latency (p50/p99), from sending the event to the pin change
+- events per second and CPU time per event under rapid scene cuts
+- reconnect recovery time after OBS was restarted (at every scale)
+- mixed burst: a cut and a visibility change of the preview scene within
+  one coalesce window, the preview LED must follow the visibility
+- cold start: the startup phases of the tally in a new process, until
+  ready and until connected to OBS
+- scaling runs with 10/100/1000 configured scenes and sources
+
+    python benchmark.py [--async [--protocol 5]] [--backend mock] [--events N]
+                        [--interval MS] [--scales 10,100]
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+from time import perf_counter, process_time, sleep
+from xml.sax.saxutils import escape
+# third party
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory, MockPin
+# own
+from _debugtools import set_stream
+from _latency import percentile
+from _outputs import get_backend
+
+
+''' constants '''
+BENCH_PORT = 4466
+# GPIOs used: program LED of 'Scene 0' and 'Cam 0' (measured) and 'Scene 1'/'Cam 1'
+GPIO_SCENE = (2, 3)
+GPIO_CAM = (4, 5)
+# preview LED of 'Cam 0' and 'Cam 1' (mixed burst)
+GPIO_CAM_PREVIEW = (6, 7)
+GPIO_CONNECTED = 19
+# maximal time in seconds to wait for the pins after sending the events
+WAIT_TIMEOUT = 10
+# coalesce window in seconds of the mixed burst
+BURST_WINDOW = 0.05
+# cold start of the tally (own process, argument: XML-file), prints the
+# startup phases as JSON once connected to OBS
+STARTUP_CHILD = '''
+import asyncio, json, sys, threading, time
+from {module} import {cls}
+t = type('benchtally', ({cls},), {{'xml_file': sys.argv[1]}})(autorun=False{args})
+if {use_async}:
+    thread = threading.Thread(target=asyncio.run, args=(t.main(),))
+    thread.start()
+deadline = time.monotonic() + {timeout}
+while t.startup is None or 'connected' not in dict(t.startup.phases):
+    if time.monotonic() > deadline:
+        break
+    time.sleep(.001)
+print(json.dumps(t.startup.phases))
+if {use_async}:
+    t.loop.call_soon_threadsafe(t.shutdown)
+    thread.join()
+else:
+    try:
+        t.shutdown()
+    except KeyboardInterrupt:
+        pass
+'''
+
+
+class benchpin(MockPin):
+    '''
+    mock pin remembering the time (perf_counter) of every state change
+    '''
+    changed = threading.Condition()
+
+    def __init__(self, factory, info):
+        super(benchpin, self).__init__(factory, info)
+        self.changes = []
+
+    def _change_state(self, value):
+        if not super(benchpin, self)._change_state(value):
+            return False
+        with benchpin.changed:
+            self.changes.append((perf_counter(), value))
+            benchpin.changed.notify_all()
+        return True
+
+
+'''
+FAKE OBS (own process)
+'''
+def make_scenes(n):
+    """
+    OBS scenes: 'Scene i' showing 'Cam i' and two multiview scenes with
+    all n cams, only 'Cam 0' resp. 'Cam 1' visible
+    """
+    scenes = {}
+    for i in range(n):
+        scenes['Scene {}'.format(i)] = [
+            {'name': 'Cam {}'.format(i), 'render': True, 'type': 'ffmpeg_source'}]
+    for x, cam in (('A', 0), ('B', 1)):
+        scenes['Multi ' + x] = [
+            {'name': 'Cam {}'.format(i), 'render': i == cam, 'type': 'ffmpeg_source'}
+            for i in range(n)]
+    return scenes
+
+
+def _server(conn, n, port):
+    """
+    run the fake OBS, controlled by commands received by the pipe:
+    ('cuts', names, interval) switch scenes, answer the send timestamps
+    ('restart', downtime) stop and restart the server
+    ('burst', [(action, args), ...]) actions of the fake OBS without delay
+    ('quit',)
+    """
+    from _fakeobs import fakeobs
+
+    async def main():
+        obs = await fakeobs(make_scenes(n), port=port, studio_mode=False).start()
+        loop = asyncio.get_running_loop()
+        conn.send('ready')
+        while True:
+            cmd = await loop.run_in_executor(None, conn.recv)
+            if cmd[0] == 'cuts':
+                sent = []
+                for name in cmd[1]:
+                    sent.append(perf_counter())
+                    await obs.switch(name)
+                    if cmd[2]:
+                        await asyncio.sleep(cmd[2])
+                conn.send(sent)
+            elif cmd[0] == 'restart':
+                await obs.stop()
+                await asyncio.sleep(cmd[1])
+                await obs.start()
+                conn.send(perf_counter())
+            elif cmd[0] == 'burst':
+                for action, args in cmd[1]:
+                    await getattr(obs, action)(*args)
+                conn.send(perf_counter())
+            else:
+                break
+        await obs.stop()
+
+    asyncio.run(main())
+
+
+'''
+TALLY
+'''
+def make_xml(n, port, backend, protocol=4):
+    """
+    XML configuration with n scenes and n sources (only the first ones
+    are connected to a GPIO, the mock board has a limited number of pins),
+    every event is applied on its own (no coalescing of the cuts)
+    """
+    lines = ['<data>', '<obswebsocket>',
+             '<host>localhost</host><port>{}</port><pass/>'.format(port),
+             '<protocol>{}</protocol>'.format(protocol),
+             '<state_cache>none</state_cache>',
+             '<coalesce_window>0</coalesce_window>',
+             '<gpio_connected backend="{}">{}</gpio_connected>'.format(
+                 backend, GPIO_CONNECTED),
+             '</obswebsocket>']
+    for tag, name, gpios in (('scene', 'Scene', GPIO_SCENE),
+                             ('source', 'Cam', GPIO_CAM)):
+        for i in range(n):
+            gpio = '<gpio_program backend="{}">{}</gpio_program>'.format(
+                backend, gpios[i]) if i < len(gpios) else ''
+            if tag == 'source' and i < len(GPIO_CAM_PREVIEW):
+                gpio += '<gpio_preview backend="{}">{}</gpio_preview>'.format(
+                    backend, GPIO_CAM_PREVIEW[i])
+            lines.append('<{0}><name>{1}</name>{2}</{0}>'.format(
+                tag, escape('{} {}'.format(name, i)), gpio))
+    lines.append('</data>')
+    f = tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False)
+    f.write("\n".join(lines))
+    f.close()
+    return f.name
+
+
+def start_tally(use_async, xml_file):
+    """
+    start the tally (connects to the fake OBS)
+    """
+    if use_async:
+        from aiotally import aiotally
+        t = type('benchtally', (aiotally,), {'xml_file': xml_file})(autorun=False)
+        thread = threading.Thread(target=asyncio.run, args=(t.main(),))
+        thread.daemon = True
+        thread.start()
+        t.bench_thread = thread
+    else:
+        from tally import tally
+        t = type('benchtally', (tally,), {'xml_file': xml_file})(autorun=False)
+    while not t.connected:
+        sleep(.01)
+    return t
+
+
+def stop_tally(t):
+    """
+    stop the tally
+    """
+    if hasattr(t, 'bench_thread'):
+        t.loop.call_soon_threadsafe(t.shutdown)
+        t.bench_thread.join()
+    else:
+        try:
+            t.shutdown()
+        except KeyboardInterrupt:
+            pass
+
+
+'''
+MEASUREMENTS
+'''
+class watched(object):
+    '''
+    the changes (time, value) of a GPIO and the condition notified on
+    every change, of a mock pin or of the mock output backend
+    '''
+    def __init__(self, backend, nr):
+        if backend == 'mock':
+            b = get_backend('mock')
+            self.changes, self.changed = b.changes[nr], b.changed
+        else:
+            self.changes = Device.pin_factory.pin(nr).changes
+            self.changed = benchpin.changed
+
+
+def cuts(conn, pin, names, interval):
+    """
+    let OBS switch through the scenes, returns the send timestamps and
+    the changes of the pin caused by them
+    """
+    first = len(pin.changes)
+    conn.send(('cuts', names, interval))
+    sent = conn.recv()
+    # each cut toggles the pin
+    with pin.changed:
+        pin.changed.wait_for(
+            lambda: len(pin.changes) - first >= len(names), WAIT_TIMEOUT)
+    return sent, pin.changes[first:]
+
+
+def latencies(sent, changes):
+    """
+    event-to-pin latency: time from sending the event until the next
+    pin change
+    """
+    result = []
+    i = 0
+    for t in sent:
+        while i < len(changes) and changes[i][0] < t:
+            i += 1
+        if i == len(changes):
+            break
+        result.append(changes[i][0] - t)
+        i += 1
+    return result
+
+
+def bench(conn, t, pin, names, events, interval):
+    """
+    latency run (events with interval) and throughput run (burst)
+    """
+    result = {}
+    # bring the pin in a known state
+    cuts(conn, pin, names[1:2], 0)
+    # latency
+    seq = [names[i % 2] for i in range(events)]
+    sent, changes = cuts(conn, pin, seq, interval)
+    lat = latencies(sent, changes)
+    result['p50'] = percentile(lat, 50)
+    result['p99'] = percentile(lat, 99)
+    result['lost'] = len(sent) - len(lat)
+    # throughput
+    seq = [names[(i + 1) % 2] for i in range(events)]
+    cpu = process_time()
+    sent, changes = cuts(conn, pin, seq, 0)
+    cpu = process_time() - cpu
+    if changes:
+        result['events/s'] = len(sent) / (changes[-1][0] - sent[0])
+    result['cpu/event'] = cpu / len(sent)
+    return result
+
+
+def recovery(conn, t, downtime=1.0):
+    """
+    time from OBS beeing reachable again until the tally reconnected
+    """
+    reconnects = t.reconnect_stats.reconnects
+    conn.send(('restart', downtime))
+    restarted = conn.recv()
+    deadline = perf_counter() + WAIT_TIMEOUT * 2
+    while t.reconnect_stats.reconnects == reconnects and perf_counter() < deadline:
+        sleep(.001)
+    if t.reconnect_stats.reconnects == reconnects:
+        return None, None
+    return perf_counter() - restarted, t.reconnect_stats.last
+
+
+def burst(conn, t, backend):
+    """
+    a cut and a visibility change of the preview scene within one coalesce
+    window: True if the preview LED of the source made visible is on
+    """
+    pin = watched(backend, GPIO_CAM_PREVIEW[1])
+    t.obs['coalesce_window'] = BURST_WINDOW
+    try:
+        # preview 'Multi A' shows only 'Cam 0'
+        conn.send(('burst', [('switch', ('Scene 0',)),
+                             ('set_preview', ('Multi A',))]))
+        conn.recv()
+        sleep(BURST_WINDOW * 4)
+        first = len(pin.changes)
+        conn.send(('burst', [('switch', ('Scene 2',)),
+                             ('set_visible', ('Multi A', 'Cam 1', True))]))
+        conn.recv()
+        with pin.changed:
+            ok = pin.changed.wait_for(
+                lambda: len(pin.changes) > first and pin.changes[-1][1],
+                BURST_WINDOW * 20)
+        conn.send(('burst', [('set_visible', ('Multi A', 'Cam 1', False))]))
+        conn.recv()
+        sleep(BURST_WINDOW * 4)
+    finally:
+        t.obs['coalesce_window'] = 0
+    return bool(ok)
+
+
+def startup(use_async, xml_file):
+    """
+    cold start of the tally in a new process (gpiozero mock pins): the
+    startup phases [(name, seconds), ...], None if failed
+    """
+    code = STARTUP_CHILD.format(
+        module='aiotally' if use_async else 'tally',
+        cls='aiotally' if use_async else 'tally',
+        args=', signals=False' if use_async else '',
+        use_async=use_async, timeout=WAIT_TIMEOUT)
+    env = dict(os.environ, GPIOZERO_PIN_FACTORY='mock',
+               OBSTALLY_LOG_LEVEL='ERROR')
+    env.pop('NOTIFY_SOCKET', None)
+    try:
+        out = subprocess.run([sys.executable, '-c', code, xml_file], env=env,
+                             stdout=subprocess.PIPE, timeout=WAIT_TIMEOUT * 2,
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             universal_newlines=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+    except (IndexError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+
+def _ms(value):
+    return "{:8.3f}".format(value * 1000) if value is not None else "       -"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="benchmark aiotally instead of tally")
+    parser.add_argument('--protocol', type=int, choices=(4, 5), default=4,
+                        help="obs-websocket protocol (5 only with --async)")
+    parser.add_argument('--backend', choices=('gpiozero', 'mock'),
+                        default='gpiozero',
+                        help="output backend of the LEDs (gpiozero mock pins "
+                             "or the mock backend)")
+    parser.add_argument('--events', type=int, default=200,
+                        help="number of scene cuts per run")
+    parser.add_argument('--interval', type=float, default=5,
+                        help="milliseconds between two cuts in the latency run")
+    parser.add_argument('--scales', default="10,100,1000",
+                        help="numbers of configured scenes/sources")
+    parser.add_argument('--no-recovery', dest='recovery', action='store_false',
+                        help="skip the reconnect recovery measurement")
+    parser.add_argument('--no-startup', dest='startup', action='store_false',
+                        help="skip the cold start measurement")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    failed = False
+    print("{:>6} {:<14} {:>8} {:>8} {:>5} {:>10} {:>10}".format(
+        "n", "run", "p50 ms", "p99 ms", "lost", "events/s", "cpu/ev ms"))
+    for n in [int(x) for x in args.scales.split(',')]:
+        conn, child = ctx.Pipe()
+        server = ctx.Process(target=_server, args=(child, n, BENCH_PORT))
+        server.start()
+        conn.recv()
+        xml_file = make_xml(n, BENCH_PORT, args.backend, args.protocol)
+        phases = startup(args.use_async, xml_file) if args.startup else None
+        Device.pin_factory = MockFactory(pin_class=benchpin)
+        # the log messages of the tally are written, but not shown
+        devnull = open(os.devnull, 'w')
+        stdout = set_stream(devnull)
+        try:
+            t = start_tally(args.use_async, xml_file)
+            results = [
+                ('scene cuts', bench(conn, t,
+                                     watched(args.backend, GPIO_SCENE[0]),
+                                     ['Scene 0', 'Scene 1'],
+                                     args.events, args.interval / 1000.0)),
+                ('source cuts', bench(conn, t,
+                                      watched(args.backend, GPIO_CAM[0]),
+                                      ['Multi A', 'Multi B'],
+                                      args.events, args.interval / 1000.0)),
+                ]
+            mixed = burst(conn, t, args.backend)
+            if args.recovery:
+                rec = recovery(conn, t)
+            stop_tally(t)
+        finally:
+            set_stream(stdout)
+            devnull.close()
+            conn.send(('quit',))
+            server.join()
+            os.unlink(xml_file)
+            Device.pin_factory.close()
+        for run, r in results:
+            print("{:>6} {:<14} {} {} {:>5} {:>10.0f} {:>10}".format(
+                n, run, _ms(r['p50']), _ms(r['p99']), r['lost'],
+                r.get('events/s', 0), _ms(r['cpu/event']).strip()))
+        print("{:>6} {:<14} in-process {}".format(n, "handler", t.latency))
+        print("{:>6} {:<14} {}".format(
+            n, "mixed burst", "ok" if mixed else "FAILED (preview LED not on)"))
+        failed = failed or not mixed
+        if args.startup:
+            ready = [s for name, s in (phases or ()) if name != 'connected']
+            print("{:>6} {:<14} ready {} ms, connected {} ms ({})".format(
+                n, "startup", _ms(sum(ready)).strip() if ready else "-",
+                _ms(sum(s for _n, s in phases)).strip() if phases else "-",
+                ", ".join("{} {}".format(name, _ms(s).strip())
+                          for name, s in phases or ())))
+        if args.recovery:
+            print("{:>6} {:<14} {} ms after OBS restart (outage {} ms)".format(
+                n, "recovery", _ms(rec[0]).strip(), _ms(rec[1]).strip()))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    sys.exit(main())
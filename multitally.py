@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+OBS Tallylights for several OBS at the same time (e.g. main stream and
+backup or overflow room), asyncio variant.
+
+One aiotally per <obswebsocket> block of the XML-file, all within one
+event loop: each OBS has its own connection, heartbeat watchdog, scenes,
+sources and LEDs. A slow or unreachable OBS does not delay the others,
+all waits for OBS are asynchronous (with timeouts).
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import asyncio
+# own
+from aiotally import aiotally
+from aiowsclient import register_signals
+from _config import configerror, load as load_config
+from _contants import XML_FILE
+from _debugtools import debug, error, info
+from _sdnotify import notify as sd_notify, watchdog_interval
+
+
+class multitally(object):
+    '''
+    runs one aiotally per OBS (<obswebsocket> block in the XML-file)
+    '''
+    # the XML configuration file
+    xml_file = XML_FILE
+    # the tallies, one per OBS
+    tallies = None
+    # the event loop
+    loop = None
+    # set to stop all tallies
+    _stop_event = None
+
+    def __init__(self, autorun=True):
+        """
+        initialise the enviroment
+        (if autorun is False, main() needs to be awaited by the caller)
+        """
+        debug("multitally.__init__()")
+        self.tallies = []
+        if autorun:
+            self.run()
+
+    def count(self):
+        """
+        number of OBS (<obswebsocket> blocks) in the XML-file
+        """
+        try:
+            return len(load_config(self.xml_file).obs)
+        except configerror as e:
+            error("%s", e)
+            return 0
+
+    def run(self):
+        """
+        run the event loop until stopped
+        """
+        debug("... multitally.run()")
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            pass
+
+    async def main(self):
+        """
+        start one tally per OBS and process everything until stopped by
+        a signal
+        """
+        self.loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        register_signals(self.loop, self)
+        count = self.count()
+        if not count:
+            error("could not find 'obswebsocket' in XMLfile '%s'",
+                  self.xml_file)
+            return
+        for i in range(count):
+            t = aiotally(autorun=False, instance=i, signals=False)
+            t.xml_file = self.xml_file
+            # systemd is notified once for all tallies (see notify)
+            t.systemd = False
+            self.tallies.append(t)
+        tasks = [self.loop.create_task(t.main()) for t in self.tallies]
+        # (runs after the tallies started, the tasks run in order)
+        tasks.append(self.loop.create_task(self.notify()))
+        try:
+            await self._stop_event.wait()
+        finally:
+            sd_notify('STOPPING=1')
+            for t in self.tallies:
+                if t._stop_event:
+                    t.shutdown()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def notify(self):
+        """
+        tell systemd all tallies are up (see _sdnotify), then feed its
+        watchdog until stopped
+        """
+        sd_notify('READY=1', "STATUS={} OBS".format(len(self.tallies)))
+        interval = watchdog_interval()
+        while interval and not self._stop_event.is_set():
+            sd_notify('WATCHDOG=1')
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), interval / 2)
+            except asyncio.TimeoutError:
+                pass
+
+    def reload(self):
+        """
+        reload the XML config of all running tallies (a changed number
+        of OBS needs a restart)
+        """
+        if self.count() != len(self.tallies):
+            error("number of 'obswebsocket' changed, restart needed")
+        for t in self.tallies:
+            if t.ws:
+                t.reload()
+
+    """
+    EVENTS
+    """
+    def on_SIGHUP(self, signum, frame):
+        """
+        received SIGHUP (1), reload the config
+        """
+        info('Signal handler called with signal %s', signum)
+        self.reload()
+
+    def on_SIGINT(self, signum, frame):
+        """
+        received SIGINT (2), stop all tallies
+        """
+        info('Signal handler called with signal %s', signum)
+        self._stop_event.set()
+
+    def on_SIGTERM(self, signum, frame):
+        """
+        received SIGTERM (15), stop all tallies
+        """
+        info('Signal handler called with signal %s', signum)
+        self._stop_event.set()
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    test_obj = multitally()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+OBS Tallylights without own connection to OBS.
+
+Lightweight tally receiving the tally state from the fan-out server of
+another obstally (see <fanout_port>), e.g. for several camera operator
+stations: only one obstally is connected to OBS. <host> and <port> of the
+XML-file are the ones of the fan-out server. Scenes, sources and LEDs are
+configured the same way as for tally.py.
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# own
+from aiotally import aiotally
+from _debugtools import debug
+from _fanout import aiofanout, match_bits
+
+
+class remotetally(aiotally):
+    '''
+    tally logic (see tally) driven by the fan-out server instead of OBS
+    '''
+    # the received tally state: name => bits (see _fanout)
+    names = None
+    # the fan-out server is connected to OBS
+    obs_connected = False
+
+    def create_ws(self):
+        """
+        connection to the fan-out server
+        """
+        self.names = {}
+        self.obs_connected = False
+        return aiofanout(self.obs['host'], self.obs['port'], self.on_fanout)
+
+    def cache_path(self):
+        """
+        no state cache, the tally state is received on connect
+        """
+        return None
+
+    def register_obs_events(self):
+        """
+        nothing to register, all messages are passed to on_fanout
+        """
+        debug("remotetally.register_obs_events()")
+
+    async def on_reconnect(self):
+        """
+        perform actions when connection is established
+        (the tally state is received as first message)
+        """
+        self.on_heartbeat(reason="force")
+
+    def resync(self):
+        """
+        set the LEDs conforming the known tally state
+        """
+        self.connected_led(blink=not (self.connected and self.obs_connected))
+        if self.connected and self.obs_connected:
+            self._apply_names()
+        else:
+            self._all_leds_on()
+
+    def on_fanout(self, msg):
+        """
+        message from the fan-out server received
+        """
+        self.on_heartbeat()
+        if 'snapshot' in msg:
+            self.names = msg['snapshot']
+        elif 'delta' in msg:
+            for name, bits in msg['delta'].items():
+                if bits:
+                    self.names[name] = bits
+                else:
+                    self.names.pop(name, None)
+        elif msg.get('obs', False) == self.obs_connected:
+            # heartbeat
+            return
+        self.obs_connected = msg.get('obs', False)
+        self.resync()
+        self._publish()
+
+    def _publish(self):
+        """
+        publish the received tally state again (fan-out server of a
+        remote tally, e.g. to cascade)
+        """
+        if self.fanout:
+            self.fanout.publish(dict(self.names),
+                                self.connected and self.obs_connected)
+        if self.multicast:
+            self.multicast_send()
+
+    def _apply_names(self):
+        """
+        internal helper: switch the LEDs conforming the tally state
+        """
+        for typ in ('program', 'preview'):
+            self.state.matched[typ] = match_bits(
+                self.names, typ, self.scene_index, self.source_index)
+        self._apply(self.state.update())
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    test_obj = remotetally()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replay of captured OBS events (see _capture, <capture_file>) into the
+tally, without OBS and with all LEDs on the mock output backend (see
+_outputs): for load and regression tests of the tally logic.
+
+The events are fed at the speed of the recording, accelerated or as fast
+as possible (--speed 0). Reported are the LED timeline (the changes of
+the scene/source LEDs, at the time of the last event fed before them),
+the throughput and the in-process latency.
+
+    python replay.py capture.jsonl [--xml obstally.xml] [--instance N]
+                     [--speed 1] [--coalesce S] [--quiet]
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# standard
+import argparse
+import asyncio
+import os
+import sys
+
+from bisect import bisect_right
+from time import perf_counter
+# own
+from aiotally import aiotally
+from aiowsclient import aiows
+from _capture import event, read
+from _contants import XML_FILE
+from _debugtools import set_stream
+from _outputs import DEFAULT_BACKEND, get_backend
+
+
+''' constants '''
+# seconds to wait after the last event for the LEDs to settle
+SETTLE_TIME = 0.1
+# events requesting the scene list from OBS: its answer is captured as
+# ScenesChanged (with the scenes) and replayed instead
+REFRESHED = ('ScenesChanged', 'SceneCollectionChanged')
+
+
+class replaytally(aiotally):
+    '''
+    tally fed by a recording instead of OBS, all LEDs on mock outputs,
+    nothing is sent over the network
+    '''
+    # not a service (see _sdnotify)
+    systemd = False
+    # the recording: list of (time, event dictionary)
+    recording = []
+    # speed factor (0: as fast as possible)
+    speed = 1.0
+    # overrides <coalesce_window> (None: as configured)
+    coalesce = None
+    # the events fed: perf_counter and recording time
+    fed_at = None
+    fed_time = None
+    # the LED timeline (see timeline), taken before the LEDs are switched off
+    result = None
+    elapsed = None
+
+    def read_xml_config(self):
+        """
+        the configuration of the tally, with the coalesce window override
+        """
+        if not super(replaytally, self).read_xml_config():
+            return False
+        if self.coalesce is not None:
+            self.obs['coalesce_window'] = self.coalesce
+        return True
+
+    def create_output(self, nr, backend=None):
+        """
+        a mock output instead of the configured backend
+        """
+        nr = int(nr)
+        name = backend or DEFAULT_BACKEND
+        return get_backend(name, {name: {'type': 'mock'}}).add(
+            abs(nr), active_high=nr > 0)
+
+    def create_ws(self):
+        """
+        a websocket object never connected (only to register the events)
+        """
+        return aiows()
+
+    def cache_path(self):
+        return None
+
+    def netmonitor_start(self):
+        pass
+
+    def metrics_start(self):
+        pass
+
+    def capture_start(self):
+        pass
+
+    def fanout_start(self):
+        pass
+
+    def multicast_start(self):
+        pass
+
+    def watchdog_start(self):
+        """
+        replay instead of monitoring the connection
+        """
+        self._check_task = self.loop.create_task(self.play())
+
+    async def play(self):
+        """
+        feed the recording into the tally, then stop
+        """
+        self.fed_at, self.fed_time = [], []
+        self.on_heartbeat(reason="replay")
+        self.connected_led(blink=False)
+        start = perf_counter()
+        first = self.recording[0][0] if self.recording else 0
+        for t, data in self.recording:
+            if data.get('update-type') in REFRESHED and 'scenes' not in data:
+                continue
+            obj = event(data)
+            if obj is None:
+                continue
+            if self.speed:
+                delay = start + (t - first) / self.speed - perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.fed_at.append(perf_counter())
+            self.fed_time.append(t - first)
+            self.ws.trigger(obj)
+            # let the scheduled flushes run
+            await asyncio.sleep(0)
+        await asyncio.sleep(self.coalesce_window() + SETTLE_TIME)
+        self.elapsed = perf_counter() - start
+        self.result = self.timeline()
+        self.shutdown()
+
+    def timeline(self):
+        """
+        the changes of the scene/source LEDs, sorted:
+        list of (recording time or None, time, objtyp, name, typ, on)
+        """
+        changes = []
+        for objtyp in ('scenes', 'sources'):
+            for name, i in getattr(self, objtyp).items():
+                for typ, led in i.led.items():
+                    for when, on in led.backend.changes.get(led.nr, ()):
+                        n = bisect_right(self.fed_at, when)
+                        changes.append((self.fed_time[n - 1] if n else None,
+                                        when, objtyp, name, typ, on))
+        changes.sort(key=lambda c: c[1])
+        return changes
+
+
+def report(t, quiet=False):
+    """
+    print the LED timeline and the summary
+    """
+    if not quiet:
+        print("{:>10} {:<7} {:<30} {:<8} {}".format(
+            "time s", "object", "name", "LED", "state"))
+        for rec, _when, objtyp, name, typ, on in t.result:
+            print("{:>10} {:<7} {:<30} {:<8} {}".format(
+                "start" if rec is None else "{:.3f}".format(rec),
+                objtyp[:-1], name, typ, "on" if on else "off"))
+    fed = len(t.fed_at)
+    duration = (t.fed_at[-1] - t.fed_at[0]) if fed > 1 else 0
+    print("events: {} in {:.3f}s ({:.0f} events/s), LED changes: {}".format(
+        fed, duration, fed / duration if duration else 0, len(t.result)))
+    print("latency: {}".format(t.latency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('recording', help="file captured by <capture_file>")
+    parser.add_argument('--xml', default=XML_FILE,
+                        help="XML configuration of the tally")
+    parser.add_argument('--instance', type=int, default=0,
+                        help="number of the <obswebsocket> block (0: first)")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="speed factor (0: as fast as possible)")
+    parser.add_argument('--coalesce', type=float, default=None,
+                        help="coalesce window in seconds (default: as configured)")
+    parser.add_argument('--quiet', action='store_true',
+                        help="only the summary, without the LED timeline")
+    parser.add_argument('--verbose', action='store_true',
+                        help="show the log messages of the tally")
+    args = parser.parse_args()
+
+    try:
+        recording = list(read(args.recording))
+    except OSError as e:
+        print("could not read '{}': {}".format(args.recording, e), file=sys.stderr)
+        return 1
+    t = type('replay', (replaytally,), {
+        'xml_file': args.xml, 'recording': recording,
+        'speed': max(args.speed, 0), 'coalesce': args.coalesce})(
+            autorun=False, instance=args.instance, signals=False)
+    devnull = None
+    if not args.verbose:
+        # the log messages of the tally are written, but not shown
+        devnull = open(os.devnull, 'w')
+        stdout = set_stream(devnull)
+    try:
+        asyncio.run(t.main())
+    finally:
+        if devnull:
+            set_stream(stdout)
+            devnull.close()
+    if t.result is None:
+        print("replay failed (see --verbose)", file=sys.stderr)
+        return 1
+    report(t, args.quiet)
+    return 0
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    sys.exit(main())
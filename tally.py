@@ -10,25 +10,83 @@ __copyright__   = "Copyright 2020"
 __license__     = "GPL"
 
 # standard
-# third party
-from gpiozero import LED
-from obswebsocket import events, requests
+import os
+
+from collections import deque
+from functools import partial
+from time import perf_counter
 # own
 from wsclient import wsclient
-from _contants import ONLY_ONE_LED_PER_CAM_ON, MAX_ONE_LED_ON
-from _debugtools import debug
+from _debugtools import debug, info, warning
+from _fanout import fanoutserver, tally_bits
+from _latency import latencystats
+from _outputs import apply, output
+from _statecache import CACHE_DELAY, STALE_TIMEOUT, statecache
+from _multicast import KEEPALIVE, MULTICAST_PORT, RESEND, multicastsender
+from _ledstate import ledstate
+from _scenegraph import scenegraph
+
+
+''' constants '''
+# seconds to collect the events of OBS (e.g. a burst of rapid cuts), before
+# the resulting state is applied to the LEDs at once
+COALESCE_WINDOW = 0.005
 
 
 class tally(wsclient):
     ''' configuration attributes '''
-    # known OBS scenes (name, gpios, ...)
+    # known OBS scenes: name => item (gpios, ..., see _config.item)
     scenes = {}
-    # known OBS sources (name, gpios, ...)
+    # known OBS sources: name => item (gpios, ..., see _config.item)
     sources = {}
 
+    # index: LED type => exact OBS scene name => set of LED keys
+    # (a LED key is a tuple (objtyp, name, typ), e.g. ('scenes', 'HDMI 1', 'program'))
+    scene_index = {}
+    # index: LED type => exact OBS source name => set of LED keys
+    source_index = {}
+    # tally channel (for multicast) of a CAM: (objtyp, name) => channel
+    channels = {}
+
     ''' runtime changebled/status attributes '''
-    # last activated LED for a the spefic type
-    act_gpio = { 'program': None, 'preview': None }
+    # the LED state (see _ledstate.ledstate)
+    state = None
+    # the scenes of OBS with their items (see _scenegraph.scenegraph)
+    graph = None
+    # actual scene name in program/preview
+    current = { 'program': None, 'preview': None }
+    # time from receiving an event until the LEDs are set
+    # (see _latency.latencystats)
+    latency = None
+    # number of scenes switched to program/preview without any matching
+    # LED ("on, but unknown")
+    unknown_scenes = 0
+    # publishes the tally state to remote tallies, if <fanout_port> is
+    # configured (see _fanout.fanoutserver)
+    fanout = None
+    # the names published (the configured scenes/sources) and the last
+    # published state (names => bits, connected)
+    _fanout_ids = None
+    _published = None
+    # sends the LED state by UDP multicast, if <multicast_group> is
+    # configured (see _multicast.multicastsender)
+    multicast = None
+    _keepalive = None
+    # saves the tally state to be shown on the next start, unless
+    # <state_cache> is 'none' (see _statecache.statecache)
+    cache = None
+    _cache_save = None
+    _stale_timeout = None
+    # OBS supports batch requests (see _obsbatch)
+    _batch = True
+    # received events, not yet applied (see queue_event):
+    # (handler, message, receive time)
+    _events = None
+    _flush = None
+    # while flushing the events: LED type => last scene switched to,
+    # scenes changed (None: all)
+    _switched = None
+    _changed = None
 
     def read_xml_config(self):
         """
@@ -38,15 +96,39 @@ class tally(wsclient):
         if not super(tally, self).read_xml_config():
             return False
         debug("tally.read_xml_config()")
-        self.scenes = self._readSubTags(self.rootxml, 'scene')
-        self.sources = self._readSubTags(self.rootxml, 'source')
+        self.scenes = self._readObsTags('scene')
+        self.sources = self._readObsTags('source')
 
         if self.scenes == False or self.sources == False:
             return False
         if not self.scenes and not self.sources:
-            print("WARNING: no scenes/sources configured!")
+            warning("no scenes/sources configured!")
+        self.scene_index = self._build_index('scenes', self.scenes)
+        self.source_index = self._build_index('sources', self.sources)
+        self.channels = {}
+        for objtyp in ('scenes', 'sources'):
+            o = getattr(self, objtyp)
+            for s in o:
+                if o[s].channel:
+                    self.channels[(objtyp, s)] = o[s].channel
         return True
 
+    def _build_index(self, objtyp, objects):
+        """
+        internal helper to build the index
+        LED type => exact OBS name => set of LED keys
+        """
+        index = { 'program': {}, 'preview': {} }
+        for s in objects:
+            typs = set(objects[s].gpio)
+            if objects[s].channel:
+                # a tally channel (multicast) has program and preview
+                typs.update(('program', 'preview'))
+            for typ in typs:
+                index.setdefault(typ, {}).setdefault(s, set()).add(
+                    (objtyp, s, typ))
+        return index
+
     def initialise_leds(self):
         """
         initialise LED objects and gpios
@@ -55,26 +137,386 @@ class tally(wsclient):
         debug("tally.initialise_leds()")
         for o in (self.scenes, self.sources):
             for s in o:
-                for typ in o[s]['gpio']:
-                    pin = abs(o[s]['gpio'][typ])
-                    active_high = o[s]['gpio'][typ] > 0
-                    o[s]['led'][typ] = LED(
-                        pin=pin,
-                        active_high=active_high)
-                    o[s]['led'][typ].off()
+                for typ in o[s].gpio:
+                    if o[s].led.get(typ):
+                        continue
+                    o[s].led[typ] = self.create_output(o[s].gpio[typ],
+                                                       o[s].backend[typ])
+        self.state = ledstate()
+        self.current = { 'program': None, 'preview': None }
+        if self.latency is None:
+            self.latency = latencystats()
+        if self._events is None:
+            self._events = deque()
+        self.fanout_start()
+        self.multicast_start()
+        self.cache_start()
+
+    def cache_path(self):
+        """
+        the file of the state cache: <state_cache>, by default next to the
+        XML-file (None: no state cache)
+        """
+        path = self.obs.get('state_cache')
+        if path and path.lower() == 'none':
+            return None
+        if not path:
+            path = os.path.splitext(self.xml_file)[0] + ".state"
+            if self.instance:
+                path += ".{}".format(self.instance)
+        return path
+
+    def cache_start(self):
+        """
+        open the state cache, on the first start the saved state is shown
+        until OBS is connected (the connection LED blinks faster)
+        """
+        path = self.cache_path()
+        if self.cache and self.cache.path == path:
+            return
+        if self.cache:
+            self.cache.close()
+        self.cache = statecache(path) if path else None
+        if self.cache and self.last_heartbeat is None:
+            self.cache_restore()
+
+    def cache_restore(self):
+        """
+        show the saved state (for max. STALE_TIMEOUT seconds)
+        """
+        state, age = self.cache.load()
+        if not state:
+            return
+        info("showing the state saved %ds ago, until OBS is connected", age)
+        self.graph = scenegraph()
+        self.graph.load(state.get('scenes'))
+        self.current = { 'program': state.get('program'),
+                         'preview': state.get('preview') }
+        self.stale = True
+        self._stale_timeout = self.scheduler.after(STALE_TIMEOUT,
+                                                   self.on_stale_timeout)
+        self.connected_led(blink=True)
+        self._update_scene()
+
+    def cache_schedule(self):
+        """
+        save the tally state CACHE_DELAY seconds later (only states
+        confirmed by OBS, changes meanwhile are saved together)
+        """
+        if self.cache and self.connected and not self.stale and \
+           not self._cache_save:
+            self._cache_save = self.scheduler.after(CACHE_DELAY,
+                                                    self.cache_save)
+
+    def cache_save(self):
+        """
+        save the tally state (if changed)
+        """
+        self._cache_save = None
+        if not self.cache:
+            return
+        try:
+            self.cache.save({
+                'program': self.current['program'],
+                'preview': self.current['preview'],
+                'scenes': [{'name': n, 'sources': items}
+                           for n, items in self.graph.scenes.items()],
+                })
+        except RuntimeError:
+            # changed meanwhile by an event, try again
+            self.cache_schedule()
+
+    def cache_stop(self):
+        """
+        save a pending change and stop showing the saved state
+        """
+        if self._cache_save:
+            self.scheduler.cancel(self._cache_save)
+            self.cache_save()
+        if self.cache:
+            # (the pending state is written)
+            self.cache.close()
+        self._stale_end()
+
+    def _stale_end(self):
+        """
+        internal helper: the LEDs do not show the saved state anymore
+        """
+        self.stale = False
+        self.scheduler.cancel(self._stale_timeout)
+        self._stale_timeout = None
+
+    def on_stale_timeout(self):
+        """
+        OBS not connected within STALE_TIMEOUT seconds: all LEDs on, as
+        usual when not connected
+        """
+        self._stale_timeout = None
+        if self.stale:
+            info("OBS not connected, the saved state is not shown anymore")
+            self.stale = False
+            if not self.connected:
+                self.on_disconnect()
+
+    def fanout_start(self):
+        """
+        start the fan-out server (or restart it, if the port changed)
+        """
+        port = int(self.obs.get('fanout_port') or 0)
+        if self.fanout and self.fanout.port != port:
+            self.fanout_stop()
+        # (the configuration may have changed: publish again)
+        self._fanout_ids = frozenset(self.scenes) | frozenset(self.sources)
+        self._published = None
+        if port and not self.fanout:
+            self.fanout = fanoutserver(port)
+            if not self.fanout.start():
+                self.fanout = None
+
+    def fanout_stop(self):
+        """
+        stop the fan-out server
+        """
+        if self.fanout:
+            self.fanout.stop()
+            self.fanout = None
+
+    def multicast_start(self):
+        """
+        start sending the LED state by multicast (restart if the group
+        or port changed)
+        """
+        group = self.obs.get('multicast_group')
+        port = int(self.obs.get('multicast_port') or MULTICAST_PORT)
+        if self.multicast and \
+           (self.multicast.group, self.multicast.port) != (group, port):
+            self.multicast_stop()
+        if group and not self.multicast:
+            self.multicast = multicastsender(
+                group, port, int(self.obs.get('multicast_ttl') or 1))
+            self._keepalive = self.scheduler.every(KEEPALIVE,
+                                                   self.multicast.resend)
+
+    def multicast_stop(self):
+        """
+        stop sending the LED state by multicast
+        """
+        if self.multicast:
+            self.scheduler.cancel(self._keepalive)
+            self._keepalive = None
+            self.multicast.close()
+            self.multicast = None
+
+    def multicast_send(self):
+        """
+        send the LED state by multicast, if changed
+        (repeated after RESEND seconds, in case of loss)
+        """
+        program = preview = 0
+        for objtyp, name, typ in self.state.on:
+            channel = self.channels.get((objtyp, name))
+            if channel and typ == 'program':
+                program |= 1 << (channel - 1)
+            elif channel:
+                preview |= 1 << (channel - 1)
+        if self.multicast.update(program, preview, self.connected):
+            for delay in RESEND:
+                self.scheduler.after(delay, self.multicast.resend)
+
+    def _publish(self):
+        """
+        publish the tally state to the remote tallies
+        """
+        if self.fanout:
+            state = (tally_bits(self.current, self._visible, self._fanout_ids),
+                     self.connected)
+            # (only changes)
+            if state != self._published:
+                self._published = state
+                self.fanout.publish(*state)
+        if self.multicast:
+            self.multicast_send()
+        self.cache_schedule()
+
+    def _visible(self, name):
+        """
+        internal helper: visible sources of a scene (if known)
+        """
+        return self.graph.visible(name) if name in self.graph else frozenset()
+
+    def collect_metrics(self):
+        """
+        the metric families (see _metrics), incl. the latency and the
+        state of each LED
+        """
+        from _metrics import histogram
+        families = super(tally, self).collect_metrics()
+        labels = {'obs': str(self.instance)}
+        latency = self.latency
+        if latency is not None:
+            families.append(histogram(
+                'obstally_event_latency_seconds',
+                "time from receiving an event until the LEDs are set",
+                labels, latency.bounds, list(latency.buckets), latency.total))
+        families.append(
+            ('obstally_unknown_scenes_total', 'counter',
+             "scenes on program/preview without any matching LED",
+             [('', labels, self.unknown_scenes)]))
+        on = frozenset(self.state.on) if self.state else frozenset()
+        samples = []
+        for index in (self.scene_index, self.source_index):
+            for typ, names in list(index.items()):
+                for keys in list(names.values()):
+                    for key in keys:
+                        samples.append(('', dict(labels, object=key[0][:-1],
+                                                 name=key[1], type=key[2]),
+                                        key in on))
+        families.append(('obstally_led', 'gauge',
+                         "state of a LED (1: on)", samples))
+        return families
+
+    def config_snapshot(self):
+        """
+        the actual configuration (to be restored or compared on reload)
+        """
+        old = super(tally, self).config_snapshot()
+        old.update({
+            'scenes': self.scenes,
+            'sources': self.sources,
+            'scene_index': self.scene_index,
+            'source_index': self.source_index,
+            })
+        return old
+
+    def config_restore(self, old):
+        """
+        restore a configuration saved by config_snapshot
+        """
+        super(tally, self).config_restore(old)
+        self.scenes = old['scenes']
+        self.sources = old['sources']
+        self.scene_index = old['scene_index']
+        self.source_index = old['source_index']
+
+    def reconfigure_leds(self, old):
+        """
+        after a reload: keep the LED objects of unchanged GPIOs, release
+        the changed ones and initialise the new ones
+        """
+        debug("tally.reconfigure_leds()")
+        on = self.state.on
+        current = self.current
+        kept = set()
+        for objtyp in ('scenes', 'sources'):
+            new_o, old_o = getattr(self, objtyp), old[objtyp]
+            for s in new_o:
+                for typ in new_o[s].gpio:
+                    o = old_o.get(s)
+                    if o and o.led.get(typ) and o.same_output(new_o[s], typ):
+                        new_o[s].led[typ] = o.led[typ]
+                        kept.add((objtyp, s, typ))
+            for s in old_o:
+                for typ in old_o[s].led:
+                    led = old_o[s].led[typ]
+                    if led and (objtyp, s, typ) not in kept:
+                        led.off()
+                        led.close()
+        # initialises the new LEDs (incl. a new LED state)
+        super(tally, self).reconfigure_leds(old)
+        self.state.on = on & kept
+        self.current = current
+
+    def resync(self):
+        """
+        set the LEDs conforming the known OBS status (scene graph and
+        scenes in program/preview), without requesting OBS
+        """
+        super(tally, self).resync()
+        if self.connected:
+            self._update_scene()
+        else:
+            self._all_leds_on()
 
     def get_actual_status(self):
         """
-        request actual scene/source status from OBS
-        an update LEDs
+        request actual scene/source status from OBS (in one round trip,
+        if supported) an update LEDs
         """
         debug("... get_actual_status()")
-        # enable LED if source is actualy on preview
-        scene = self.ws.call(requests.GetPreviewScene())
-        self.on_preview(scene, scene.getName())
-        # enable LED if scene is actualy on program
-        scene = self.ws.call(requests.GetCurrentScene())
-        self.on_switch(scene, scene.getName())
+        from _obsbatch import batch
+        scenes, preview = self.status_requests()
+        if self._batch:
+            self._batch = self.ws.call(batch(scenes, preview)).status
+        if not self._batch:
+            # OBS < 4.9: one request after the other
+            self.ws.call(scenes)
+            self.ws.call(preview)
+        self.set_actual_status(scenes, preview)
+
+    def status_requests(self):
+        """
+        the requests for the actual status: scene list and preview scene
+        """
+        from obswebsocket import requests
+        return requests.GetSceneList(), requests.GetPreviewScene()
+
+    def set_actual_status(self, scenes, preview):
+        """
+        update the scene graph and the LEDs conforming the answers of the
+        status requests (replaces a saved state)
+        """
+        self.capture_status(scenes, preview)
+        with self._lock:
+            # the scene graph (incl. the scene actualy on program)
+            self.graph.load(scenes.getScenes())
+            self._stale_end()
+            # enable LED if source is actualy on preview (only in studio mode)
+            if preview.status:
+                self.on_preview(preview, preview.getName())
+            else:
+                self.current['preview'] = None
+                self.state.matched['preview'] = set()
+            # enable LED if scene is actualy on program
+            if scenes.getCurrentScene():
+                self.on_switch(scenes, scenes.getCurrentScene())
+            else:
+                # (no scene in the answer)
+                self.current['program'] = None
+                self.state.matched['program'] = set()
+                self._apply(self.state.update())
+                self._publish()
+
+    def capture_status(self, scenes, preview=None):
+        """
+        capture the answers of the status requests as events (see
+        capture_start), so a replay restores the scene graph and the
+        scenes on program/preview
+        """
+        if not self.capture:
+            return
+        self.capture.write_data({'update-type': 'ScenesChanged',
+                                 'scenes': scenes.getScenes()})
+        if preview is None:
+            return
+        if preview.status:
+            self.capture.write_data({'update-type': 'PreviewSceneChanged',
+                                     'scene-name': preview.getName(),
+                                     'sources': preview.getSources()})
+        self.capture.write_data({'update-type': 'SwitchScenes',
+                                 'scene-name': scenes.getCurrentScene(),
+                                 'sources': []})
+
+    def refresh_scene_graph(self):
+        """
+        reload the scene graph from OBS
+        """
+        debug("... refresh_scene_graph()")
+        from obswebsocket import requests
+        scenes = self.ws.call(requests.GetSceneList())
+        self.capture_status(scenes)
+        with self._lock:
+            self.graph.load(scenes.getScenes())
+            self._update_scene()
 
     def register_obs_events(self):
         """
@@ -82,84 +524,213 @@ class tally(wsclient):
         """
         super(tally, self).register_obs_events()
         debug("tally.register_obs_events()")
-        self.ws.register(self.on_switch, events.SwitchScenes)
-        self.ws.register(self.on_preview, events.PreviewSceneChanged)
+        from obswebsocket import events
+        if self.graph is None:
+            # (kept on a new connection, reloaded by get_actual_status)
+            self.graph = scenegraph()
+        for func, event in (
+                (self.on_switch, events.SwitchScenes),
+                (self.on_preview, events.PreviewSceneChanged),
+                # keep the scene graph up to date
+                (self.on_scene_item_visibility, events.SceneItemVisibilityChanged),
+                (self.on_scene_item_added, events.SceneItemAdded),
+                (self.on_scene_item_removed, events.SceneItemRemoved),
+                (self.on_source_renamed, events.SourceRenamed),
+                (self.on_scenes_changed, events.ScenesChanged),
+                (self.on_scenes_changed, events.SceneCollectionChanged)):
+            self.ws.register(partial(self.queue_event, func), event)
+
+    def coalesce_window(self):
+        """
+        seconds to collect events before applying them,
+        configurable by <coalesce_window> in the XML-file (0: each event
+        is applied on receipt)
+        """
+        window = self.obs.get('coalesce_window')
+        return float(COALESCE_WINDOW if window is None else window)
+
+    def queue_event(self, func, message):
+        """
+        an event of OBS received: queue it to be handled by func within
+        the coalesce window (see flush_events), the receiving thread does
+        not wait for the LEDs
+        """
+        window = self.coalesce_window()
+        if not window:
+            func(message)
+            return
+        self._events.append((func, message, perf_counter()))
+        if self._flush is None:
+            self._flush = self.scheduler.after(window, self.flush_events)
+
+    def flush_events(self):
+        """
+        handle the queued events in the order received and apply only the
+        resulting state: the last scene switched to per LED type (program
+        and preview) and the LEDs of the changed scenes, in one batch
+        """
+        self._flush = None
+        starts = []
+        with self._lock:
+            self._switched, self._changed = {}, set()
+            try:
+                while self._events:
+                    func, message, start = self._events.popleft()
+                    starts.append(start)
+                    try:
+                        func(message)
+                    except Exception as e:
+                        debug(">>>> EXCEPTION in %s: %s", message.name, e)
+                switched, changed = self._switched, self._changed
+            finally:
+                self._switched = self._changed = None
+            for typ, name in switched.items():
+                self._select(typ, name)
+            # (also with a switch: the other LED type may depend on the
+            # changed scenes)
+            rematched = self._rematch(changed, exclude=switched)
+            if switched or rematched:
+                self._apply(self.state.update())
+                now = perf_counter()
+                for start in starts:
+                    self.latency.add(now - start)
+                self._publish()
+
+    def drop_events(self):
+        """
+        forget the queued events (e.g. of a lost connection)
+        """
+        if self._flush is not None:
+            self.scheduler.cancel(self._flush)
+            self._flush = None
+        if self._events:
+            self._events.clear()
 
 
     '''
     LED SWITCHING
     '''
-    def _all_leds_on(self, typ):
+    def _led(self, key):
         """
-        switch all LEDs off
+        the LED object of a LED key (objtyp, name, typ)
         """
-        for o in (self.scenes, self.sources):
-            for s in o:
-                for typ in o[s]['gpio']:
-                    o[s]['led'][typ].on()
+        objtyp, name, typ = key
+        return getattr(self, objtyp)[name].led.get(typ)
+
+    def _apply(self, changes):
+        """
+        write the changes (LED key => on) to the LEDs in one batch per
+        output backend, switching off before switching on
+        """
+        leds = []
+        for key, on in sorted(changes.items(), key=lambda c: c[1]):
+            led = self._led(key)
+            if led is not None:
+                # (None: only a tally channel (multicast), no GPIO)
+                leds.append((led, on))
+        apply(leds)
+
+    def _all_leds_on(self):
+        """
+        switch all LEDs on
+        """
+        keys = set()
+        for index in (self.scene_index, self.source_index):
+            for typ in index:
+                for k in index[typ].values():
+                    keys |= k
+        self._apply(self.state.force(keys))
+
+    def _match(self, typ, name):
+        """
+        LED keys matching the scene with the given name, for the given
+        LED type: the configured scene or the visible configured sources
+        of the scene (incl. nested scenes and groups)
+        """
+        new = self.scene_index[typ].get(name)
+        if new is not None:
+            return set(new)
+        new = set()
+        index = self.source_index[typ]
+        if index and name in self.graph:
+            for s in self.graph.visible(name).intersection(index):
+                new |= index[s]
+        return new
 
     def _switch_led(self, typ, message, name = None):
         """
         enable/disable LEDs conforming the recived message-type
+        (within flush_events: only memorize the scene)
         """
-        debug("... switch_led({})".format(typ))
+        start = perf_counter()
+        debug("... switch_led(%s)", typ)
         if not name:
-            name = message.getSceneName().encode('utf-8')
-
-        def _switch_gpio(objtyp, objects, typ, selection):
-            """
-            subfunction to handle all configured GPIOs
-            conforming the featuare settings
-            """
-            on = False
-            self.act_gpio[typ] = None
-            for s in objects:
-                if s in selection:
-                    self.act_gpio[typ] = (objtyp,s)
-                    print ("GPIO {:02d}: {} '{}' {}".format(
-                        objects[s]['gpio'][typ],
-                        "scene  " if objtyp == 'scenes' else "source ",
-                        s,
-                        "on" if typ == "program" else typ))
-                    objects[s]['led'][typ].on()
-                    on = True
-                else:
-                    objects[s]['led'][typ].off()
-            if not self.act_gpio['preview']:
-                return on
-            # HINT: The enabled LEDs can be one from scenes or sources, so both mut be checkes
-            prev_obj = self.scenes if self.act_gpio['preview'][0] == 'scenes' else self.sources
-            if ONLY_ONE_LED_PER_CAM_ON:
-                # FEATURE: Avoid showing both LEDs for one CAM
-                # Each CAM can be only in program  or in preview. Showing both is
-                # confusing for the person in front of the cam
-                if self.act_gpio['program'] and self.act_gpio['preview']:
-                    if self.act_gpio['program'] == self.act_gpio['preview']:
-                        prev_obj[self.act_gpio['preview'][1]]['led']['preview'].off()
-                    else:
-                        prev_obj[self.act_gpio['preview'][1]]['led']['preview'].on()
-                # In case "program" is unknown, that (re-)enable "preview" LED
-                if not self.act_gpio['program'] and self.act_gpio['preview']:
-                    prev_obj[self.act_gpio['preview'][1]]['led']['preview'].on()
-            if MAX_ONE_LED_ON:
-                # FEATURE: maximal one LED can be ON at time
-                # in case program+preview are ON, disable preview
-                if self.act_gpio['program'] and self.act_gpio['preview']:
-                    prev_obj[self.act_gpio['preview'][1]]['led']['preview'].off()
-            return on
-
-        # check scenes
-        on = _switch_gpio('scenes', self.scenes, typ, name)
-        # check sources
-        if not on and self.sources:
-            new_sources = []
-            for s in message.getSources():
-                # consider only the visible ones...
-                if s['render'] == True:
-                    new_sources.append(s['name'])
-            on = _switch_gpio('sources', self.sources, typ, new_sources)
-        if not on:
-            print ("       : '{}' on, but unknown".format(name))
+            name = message.getSceneName()
+        with self._lock:
+            if name not in self.graph and self.source_index[typ]:
+                self.graph.set_scene(name, message.getSources())
+            if self._switched is not None:
+                self._switched.pop(typ, None)
+                self._switched[typ] = name
+                return
+            self._select(typ, name)
+            # switch only the LEDs which changed (feature rules applied)
+            self._apply(self.state.update())
+            self.latency.add(perf_counter() - start)
+            self._publish()
+
+    def _select(self, typ, name):
+        """
+        internal helper: the scene in program/preview and the LED keys
+        matching it (the LEDs are not switched)
+        """
+        self.current[typ] = name
+        new = self._match(typ, name)
+        for key in new:
+            gpio = getattr(self, key[0])[key[1]].gpio.get(typ)
+            info("%s %02d: %s '%s' %s",
+                 "CH  " if gpio is None else "GPIO",
+                 self.channels[key[:2]] if gpio is None else gpio,
+                 "scene  " if key[0] == 'scenes' else "source ",
+                 key[1],
+                 "on" if typ == "program" else typ)
+        if not new:
+            info("       : '%s' on, but unknown", name)
+            self.unknown_scenes += 1
+        self.state.matched[typ] = new
+
+    def _update_scene(self, scene = None):
+        """
+        the items of a scene/group changed (None: all scenes changed),
+        update only the LEDs of program/preview affected by the change
+        (within flush_events: only memorize the scene)
+        """
+        start = perf_counter()
+        with self._lock:
+            if self._changed is not None:
+                self._changed.add(scene)
+                return
+            if self._rematch((scene,)):
+                self._apply(self.state.update())
+                self.latency.add(perf_counter() - start)
+                self._publish()
+
+    def _rematch(self, scenes, exclude=()):
+        """
+        internal helper: match the scenes in program/preview again, if
+        they depend on one of the changed scenes (None: all), except the
+        LED types in exclude, True if any was matched
+        """
+        changed = False
+        for typ in self.current:
+            name = self.current[typ]
+            if name is None or typ in exclude:
+                continue
+            if any(scene is None or self.graph.depends_on(name, scene)
+                   for scene in scenes):
+                self.state.matched[typ] = self._match(typ, name)
+                changed = True
+        return changed
 
     def shutdown_leds(self):
         """
@@ -171,11 +742,19 @@ class tally(wsclient):
         debug("tally.shutdown_leds()")
         for o in (self.scenes, self.sources):
             for s in o:
-                for typ in o[s]['gpio']:
-                    if o[s]['led'][typ] and isinstance(o[s]['led'][typ], LED):
-                        o[s]['led'][typ].off()
-                        self.gpios.remove(int(str(o[s]['led'][typ].pin)[4:]))
-                        o[s]['led'][typ] = None
+                for typ in o[s].gpio:
+                    led = o[s].led.get(typ)
+                    if led and isinstance(led, output):
+                        led.off()
+                        led.close()
+                        self.gpios.discard((led.backend.name, led.nr))
+                        o[s].led[typ] = None
+        if self.state:
+            self.state.reset()
+        self.drop_events()
+        self.cache_stop()
+        self.fanout_stop()
+        self.multicast_stop()
         super(tally, self).shutdown_leds()
 
     def on_disconnect(self):
@@ -183,9 +762,66 @@ class tally(wsclient):
         perform actions when connection is lost
         """
         super(tally, self).on_disconnect()
-        # all LEDs ON
-        self._all_leds_on('program')
-        self._all_leds_on('preview')
+        with self._lock:
+            self.drop_events()
+            if self.stale:
+                # the saved state (see cache_restore)
+                self._update_scene()
+            else:
+                # all LEDs ON
+                self._all_leds_on()
+            self._publish()
+
+    def on_scene_item_visibility(self, message):
+        """
+        the visibility of a scene item changed
+        """
+        scene = message.getSceneName()
+        if self.graph.set_visible(scene, message.getItemName(),
+                                  message.getItemVisible(),
+                                  message.getItemId()):
+            self._update_scene(scene)
+
+    def on_scene_item_added(self, message):
+        """
+        a scene item was added to a scene
+        """
+        scene = message.getSceneName()
+        if self.graph.add_item(scene, message.getItemName(),
+                               message.getItemId()):
+            self._update_scene(scene)
+
+    def on_scene_item_removed(self, message):
+        """
+        a scene item was removed from a scene
+        """
+        scene = message.getSceneName()
+        if self.graph.remove_item(scene, message.getItemName(),
+                                  message.getItemId()):
+            self._update_scene(scene)
+
+    def on_source_renamed(self, message):
+        """
+        a source or scene was renamed
+        """
+        old, new = message.getPreviousName(), message.getNewName()
+        self.graph.rename(old, new)
+        for current in (self.current, self._switched or {}):
+            for typ in current:
+                if current[typ] == old:
+                    current[typ] = new
+        self._update_scene()
+
+    def on_scenes_changed(self, message):
+        """
+        scenes were added/removed or the scene collection changed,
+        reload the whole scene graph
+        """
+        if message.datain.get('scenes') is not None:
+            self.graph.load(message.datain['scenes'])
+            self._update_scene()
+        else:
+            self.defer(self.refresh_scene_graph)
 
     def on_switch(self, message, name = None):
         #debug("on_preview()")
@@ -195,21 +831,6 @@ class tally(wsclient):
         #debug("on_preview()")
         self._switch_led('preview', message, name)
 
-    '''
-    MAIN
-    '''
-    def run(self):
-        """
-        rund endless
-        """
-        # FIXME: ok for the beginning...
-        debug("... tally.run()")
-        try:
-            while True:
-                pass
-        except KeyboardInterrupt:
-            pass
-
 
 if __name__ == "__main__":
     # execute only if run as a script
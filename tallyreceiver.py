@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tally receiver: LEDs driven by the tally state sent by UDP multicast
+(see _multicast and <multicast_group> of the tally).
+
+Configured by the XML-file, GPIOs can be inverted the same way as for
+scenes/sources:
+    <data>
+        <multicast>
+            <group>239.255.84.76</group>
+            <port>4470</port>
+            <gpio_connected>19</gpio_connected>
+        </multicast>
+        <channel>
+            <name>1</name>  <!-- channel number -->
+            <gpio_program>3</gpio_program>
+            <gpio_preview inverted="true">2</gpio_preview>
+        </channel>
+    </data>
+"""
+__author__      = "Claudio Thomas"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+
+# own
+from wsclient import wsclient
+from _config import configerror, load as load_config
+from _debugtools import debug, error, info
+from _ledstate import diff_state
+from _outputs import apply, output
+from _multicast import MULTICAST_GROUP, MULTICAST_PORT, multicastreceiver
+
+
+class tallyreceiver(wsclient):
+    '''
+    same as wsclient (XML configuration, signals, connection LED, reload),
+    but receiving the tally state by multicast instead of a connection to
+    OBS (the LED state is changed by the receiver thread and the reload,
+    under the lock)
+    '''
+    # the channels: name (channel number) => item (see _config.item)
+    channels = {}
+    # LED keys (channel, typ) actually on
+    on = set()
+    # last received state: (program, preview, obs)
+    received = None
+
+    def read_xml_config(self):
+        """
+        read the configuration from the XML-file and save the values
+        to the dictionaries
+        """
+        debug("tallyreceiver.read_xml_config()")
+        try:
+            self.config = load_config(self.xml_file)
+        except configerror as e:
+            error("%s", e)
+            return False
+        self.backends = self.config.backends
+        self.section = self.config.multicast
+        if self.section is not None:
+            self.obs.update(self.section.options)
+            for typ, nr in self.section.gpio.items():
+                self.obs['gpio_' + typ] = nr
+                self.obs['backend_' + typ] = self.section.backend[typ]
+                self.gpios.add((self.section.backend[typ], abs(nr)))
+        # 'host' and 'port' are the multicast group and port
+        self.obs['host'] = self.obs.get('group') or MULTICAST_GROUP
+        self.obs['port'] = int(self.obs.get('port') or MULTICAST_PORT)
+        self.channels = self.config.items('channel')
+        self._useGpios(self.channels)
+        return True
+
+    def config_snapshot(self):
+        """
+        the actual configuration (to be restored or compared on reload)
+        """
+        old = super(tallyreceiver, self).config_snapshot()
+        old['channels'] = self.channels
+        return old
+
+    def config_restore(self, old):
+        """
+        restore a configuration saved by config_snapshot
+        """
+        super(tallyreceiver, self).config_restore(old)
+        self.channels = old['channels']
+
+    def initialise_leds(self):
+        """
+        initialise LED objects and gpios
+        """
+        super(tallyreceiver, self).initialise_leds()
+        debug("tallyreceiver.initialise_leds()")
+        for c in self.channels.values():
+            for typ in c.gpio:
+                if c.led.get(typ):
+                    continue
+                c.led[typ] = self.create_output(c.gpio[typ], c.backend[typ])
+        self.on = set()
+
+    def reconfigure_leds(self, old):
+        """
+        after a reload: release all LEDs of the channels and initialise
+        the new ones
+        """
+        debug("tallyreceiver.reconfigure_leds()")
+        for c in old['channels'].values():
+            for led in c.led.values():
+                if led:
+                    led.off()
+                    led.close()
+        super(tallyreceiver, self).reconfigure_leds(old)
+
+    def resync(self):
+        """
+        set the LEDs conforming the last received state
+        """
+        with self._lock:
+            super(tallyreceiver, self).resync()
+            if self.connected and self.received:
+                self.on_packet(*self.received)
+            else:
+                self._all_leds_on()
+
+    def shutdown_leds(self):
+        """
+        switchoff LED objects and gpios
+        """
+        debug("tallyreceiver.shutdown_leds()")
+        with self._lock:
+            for c in self.channels.values():
+                for typ in c.gpio:
+                    led = c.led.get(typ)
+                    if isinstance(led, output):
+                        led.off()
+                        led.close()
+                        self.gpios.discard((led.backend.name, led.nr))
+                        c.led[typ] = None
+            self.on = set()
+        super(tallyreceiver, self).shutdown_leds()
+
+    def _apply(self, keys):
+        """
+        switch the LEDs (channel, typ) in keys on, all other off
+        """
+        changes = diff_state(self.on, keys)
+        self.on = keys
+        leds = []
+        for (name, typ), on in sorted(changes.items(), key=lambda c: c[1]):
+            led = self.channels[name].led.get(typ)
+            if led:
+                leds.append((led, on))
+        apply(leds)
+
+    def _all_leds_on(self):
+        """
+        switch all LEDs on
+        """
+        self._apply(set((name, typ) for name in self.channels
+                        for typ in self.channels[name].gpio))
+
+    '''
+    RECEIVING
+    '''
+    def connection_start(self):
+        """
+        start receiving (own thread)
+        """
+        info("receiving tally state on %s:%s", self.obs['host'], self.obs['port'])
+        if self.ws:
+            self.ws.disconnect()
+            # the old receiver ends within its socket timeout (max. 1s),
+            # before the port is bound again
+            self.ws.join()
+        self.received = None
+        self.connected = False
+        self.on_disconnect()
+        self.ws = multicastreceiver(self.obs['host'], self.obs['port'],
+                                    self.on_packet, self.on_timeout)
+        self.ws.start()
+
+    def reconnect_now(self):
+        """
+        receive again (joins the multicast group on the actual interfaces)
+        """
+        if not self.stop:
+            self.connection_start()
+
+    def watchdog_start(self):
+        """
+        nothing to do, the receiver detects missing packets
+        """
+
+    def watchdog_stop(self):
+        pass
+
+    def on_packet(self, program, preview, obs):
+        """
+        tally state received: bit masks of the channels in program/preview
+        """
+        with self._lock:
+            self.received = (program, preview, obs)
+            self.connected = True
+            self.on_heartbeat()
+            if not obs:
+                # sender is not connected to OBS
+                self.on_disconnect()
+                return
+            self.connected_led(blink=False)
+            keys = set()
+            for name, c in self.channels.items():
+                bit = 1 << (c.channel - 1)
+                if program & bit:
+                    keys.add((name, 'program'))
+                if preview & bit:
+                    keys.add((name, 'preview'))
+            self._apply(keys)
+
+    def on_timeout(self):
+        """
+        no packets received anymore
+        """
+        debug("... tallyreceiver.on_timeout()")
+        with self._lock:
+            self.connected = False
+            self.on_disconnect()
+
+    def on_disconnect(self):
+        """
+        perform actions when the sender is lost
+        """
+        with self._lock:
+            super(tallyreceiver, self).on_disconnect()
+            # all LEDs ON
+            self._all_leds_on()
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    test_obj = tallyreceiver()
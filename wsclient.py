@@ -9,22 +9,30 @@ __license__     = "GPL"
 
 # standard
 import signal
-import socket
-
-from os import system
-from time import time, sleep
-from threading import Timer
-from xml.etree import ElementTree
-# third party
-from gpiozero import LED
-from obswebsocket import obsws, events, requests
-# own
+
+from time import monotonic
+from threading import Event, RLock
+# own (obswebsocket and _metrics are imported when needed, to
+# show the connection state fast, see _startup)
+from _capture import capture
+from _config import configerror, load as load_config
 from _contants import XML_FILE
-from _debugtools import debug
+from _debugtools import debug, error, info, sampled, set_level
+from _netif import local_addresses, primary_address, select_host, start_monitor
+from _outputs import get_backend, output
+from _netprobe import PROBE_MAX_WAIT, PROBE_TIMEOUT, backoff, reconnectstats, wait_for_port
+from _scheduler import scheduler
+from _sdnotify import notify as sd_notify, watchdog_interval
+from _startup import startuptimer
 
 
 ''' constants '''
 CON_CHECK_DELAY = 2
+# on/off time in seconds of the blinking connection LED
+BLINK_DELAY = 1
+# on/off time in seconds of the connection LED, while the LEDs show a
+# state not yet confirmed by OBS (see stale)
+STALE_BLINK_DELAY = 0.25
 
 
 class wsclient(object):
@@ -37,67 +45,231 @@ class wsclient(object):
     - disconnects from LEDs an reset the LEDs when exiting
      '''
     # the obswebsocket (host, port, pass)
-    obs = {'host': None, 'port': None, 'pass': None, 'gpio_connected': None }
-    # the gpios in use
-    gpios = []
+    obs = {'host': None, 'port': None, 'pass': None, 'protocol': None,
+           'gpio_connected': None }
+    # the gpios in use: (backend name, number)
+    gpios = set()
+    # the output backends defined by <backend> (see _outputs):
+    # name => {'type': ..., options...}
+    backends = {}
+    # the XML configuration file
+    xml_file = XML_FILE
+    # number of the OBS (<obswebsocket> block in the XML-file) to connect to
+    instance = 0
+    # obs-websocket protocol versions supported (<protocol>)
+    protocols = (4,)
+    # notify systemd about the startup and feed its watchdog (see _sdnotify),
+    # False if the process runs several tallies (see multitally)
+    systemd = True
     
     ''' runtime changebled/status attributes '''
     # actual connection status
     connected = False
-    # timestamp in secons of last heartbeat (float)
+    # timestamp in secons of last heartbeat (float, monotonic clock)
     last_heartbeat = None
-    # the root-xml tree
-    rootxml = None
-    # internal flag to stop all processing if True
-    stop = False
+    # the LEDs show a saved state, not yet confirmed by OBS
+    # (the connection LED blinks faster)
+    stale = False
+    # the compiled XML-file (see _config.config)
+    config = None
+    # the <obswebsocket> section of this OBS (see _config.section)
+    section = None
     # the websocket object
     ws = None
+    # reconnect-time metrics (see _netprobe.reconnectstats)
+    reconnect_stats = None
+    # events received from OBS: event name => count
+    event_counts = None
+    # port of the metrics endpoint, if <metrics_port> is configured
+    # (see _metrics)
+    metrics_port = None
+    # durations of the startup phases (see _startup.startuptimer)
+    startup = None
+    # records the events of OBS, if <capture_file> is configured
+    # (see _capture, replay.py)
+    capture = None
+    # the scheduler for all periodic tasks (see _scheduler.scheduler)
+    scheduler = None
+    # monitors the local network interfaces (see _netif.netmonitor)
+    netmonitor = None
+    # the local IP addresses at the last host selection
+    _addresses = None
+    # wakes up the main loop (see run) when set
+    _stop_event = None
+    # scheduled tasks: connection check and blinking connection LED
+    _watchdog = None
+    _blink = None
+    _blink_delay = None
+    # delays between two reconnect attempts (see _netprobe.backoff)
+    _backoff = None
+    # scheduled task feeding the systemd watchdog
+    _sd_watchdog = None
+    # executes the work waiting for OBS (connect, requests), so the
+    # scheduler never blocks
+    worker = None
+    # incremented when the connection check is stopped/started
+    _watchdog_gen = 0
+    # serialises the changes of the LED state by the threads (receive
+    # thread, scheduler, worker) and the reload (signal handler)
+    _lock = None
 
     '''
     INITIALISATION and HELPER functions
     '''
-    def __init__(self):
+    def __init__(self, autorun=True, instance=0):
         """
         initialise the enviroment
+        (if autorun is False, run() needs to be called by the caller)
+
+        instance: number of the <obswebsocket> block in the XML-file
         """
+        self.startup = startuptimer()
         debug("wsclient.__init__()")
+        self.instance = instance
+        self._stop_event = Event()
+        self._lock = RLock()
+        self.reconnect_stats = reconnectstats()
+        self.event_counts = {}
+        self.scheduler = scheduler()
+        self.scheduler.start()
+        self.worker = scheduler("obs")
+        self.worker.start()
         ip = self.get_ip_address()
-        debug("IP = {}".format(ip))
+        debug("IP = %s", ip)
         # register the signals to be caught
         signal.signal(signal.SIGHUP, self.on_SIGHUP)
         signal.signal(signal.SIGINT, self.on_SIGINT)
         signal.signal(signal.SIGTERM, self.on_SIGTERM)
+        # re-select the host when the network changes
+        self.netmonitor_start()
         # read xml + init leds based on config and OBS websocket initialisation
+        # (incl. monitoring of the connection, connects in the background)
         if not self.reload():
+            self.netmonitor_stop()
             return
-        # prepare schedular to monitor connection
-        Timer(CON_CHECK_DELAY, self.connection_check, ()).start()
+        self.startup_done()
         # run endless
-        self.run()
+        if autorun:
+            self.run()
 
     def reload(self):
         """
         (Re-)load the XML config, initialise all and start connection
+
+        If already running, only the changes are applied
+        (see reload_changes)
         """
         debug("wsclient.reload()")
+        if self.ws:
+            return self.reload_changes()
+        self.startup_mark('init')
+        self.watchdog_stop()
         self.shutdown_leds()
         # read xml an init leds based on config
+        self.config_reset()
         if not self.read_xml_config():
             return False
+        self.startup_mark('config')
         # OBS websocket initialisation
         self.initialise_leds()
+        self.startup_mark('outputs')
         self.connection_start()
+        self.startup_mark('websocket')
+        # monitor the connection
+        self.watchdog_start()
+        return True
+
+    def reload_changes(self):
+        """
+        reload the XML config and apply only the changes:
+        - LEDs with unchanged GPIO are kept, only changed ones are
+          released/initialised
+        - the connection to OBS is kept, if host, port and pass are
+          unchanged, the LEDs are set conforming the known OBS status
+        - if the new config is invalid, the actual one is kept
+        """
+        debug("wsclient.reload_changes()")
+        # (the other threads see either the old or the new configuration)
+        with self._lock:
+            old = self.config_snapshot()
+            self.config_reset()
+            if not self.read_xml_config():
+                error("config not reloaded, keeping the actual one")
+                self.config_restore(old)
+                return False
+            self.reconfigure_leds(old)
+            reconnect = any(old['obs'].get(k) != self.obs.get(k)
+                            for k in ('host', 'port', 'pass', 'protocol',
+                                      'liveness', 'ping_interval',
+                                      'ping_misses'))
+            if not reconnect:
+                self.resync()
+        if reconnect:
+            # (without the lock: the receive thread is joined)
+            debug("... . connection settings changed")
+            self.watchdog_stop()
+            self.connection_start()
+            self.watchdog_start()
         return True
 
+    def config_reset(self):
+        """
+        new, empty configuration (of this instance, before reading the
+        XML-file)
+        """
+        self.obs = {'host': None, 'port': None, 'pass': None, 'protocol': None,
+                    'gpio_connected': None }
+        self.gpios = set()
+        self.backends = {}
+
+    def config_snapshot(self):
+        """
+        the actual configuration (to be restored or compared on reload)
+
+        Can be extended by inherited classes:
+           old = super(XXX, self).config_snapshot()
+        """
+        return {'obs': self.obs, 'gpios': self.gpios, 'config': self.config,
+                'section': self.section, 'backends': self.backends}
+
+    def config_restore(self, old):
+        """
+        restore a configuration saved by config_snapshot
+
+        Can be extended by inherited classes:
+           super(XXX, self).config_restore(old)
+        """
+        self.obs = old['obs']
+        self.gpios = old['gpios']
+        self.config = old['config']
+        self.section = old['section']
+        self.backends = old['backends']
+
+    @property
+    def stop(self):
+        """
+        internal flag to stop all processing if True
+        """
+        return self._stop_event.is_set()
+
+    @stop.setter
+    def stop(self, value):
+        if value:
+            self._stop_event.set()
+        else:
+            self._stop_event.clear()
+
     def run(self):
         """
-        rund endless
+        run endless, until stopped by a signal or the 'stop' flag
+
+        The main thread sleeps in the stop event, all the work is done by
+        the websocket receive thread and the scheduler. Signal handlers are
+        still executed while waiting (lock waits are interruptible).
         """
-        # FIXME: ok for the beginning...
         debug("... wsclient.run()")
         try:
-            while not self.stop:
-                pass
+            self._stop_event.wait()
         except KeyboardInterrupt:
             pass
 
@@ -106,112 +278,333 @@ class wsclient(object):
         close/stop the programm
         """
         self.stop = True
-        self.ws.disconnect()
+        if self.systemd:
+            sd_notify('STOPPING=1')
+        self.netmonitor_stop()
+        self.scheduler.stop()
+        if self.worker:
+            self.worker.stop()
+        try:
+            # (fails if never connected)
+            self.ws.disconnect()
+        except Exception:
+            pass
         self.shutdown_leds()
         raise KeyboardInterrupt()
 
-    def _readSubTags(self, root, tag):
-        """
-        internal helper function to read all tags of a xml-branch
-        """
-        result = {}
-        for s in root.findall(tag):
-            content = {'name': "", "gpio": {}, 'led': {} }
-            for child in s.findall('*'):
-                if "gpio" in child.tag:
-                    nr = int(child.text)
-                    if nr in self.gpios:
-                        print("ERROR: GPIO {} can only be used once!".format(nr))
-                        return False
-                    self.gpios.append(abs(nr))
-                    if 'inverted' in child.attrib:
-                        content["gpio"][child.tag[5:]] = abs(nr) * (-1)
-                    else:
-                        content["gpio"][child.tag[5:]] = nr
-                else:
-                    content[child.tag] = child.text
-            debug(content)                
-            if content['name']:
-                result[content['name']] = content
-            else:
-                print("ERROR: missing a <name> for {} in {}!".format(
-                    s.tag,
-                    XML_FILE))
-                return False
+    def create_output(self, nr, backend=None):
+        """
+        a new output (LED, switched off) of a backend (default: gpiozero),
+        inverted if nr is negative
+        """
+        nr = int(nr)
+        return get_backend(backend, self.backends).add(abs(nr), active_high=nr > 0)
+
+    def _readObsTags(self, tag):
+        """
+        internal helper function to read all tags of this OBS: the ones
+        within its <obswebsocket> block, the ones on top level belong to
+        the first OBS (copies of the compiled items, see _config.item)
+        """
+        result = self.config.items(tag, self.section, top=self.instance == 0)
+        self._useGpios(result)
         return result
 
+    def _useGpios(self, items):
+        """
+        internal helper function to memorize the gpios of the items
+        """
+        for i in items.values():
+            for typ, nr in i.gpio.items():
+                self.gpios.add((i.backend[typ], abs(nr)))
+
     '''
     OBS CONNECTION
     '''
+    def watchdog_start(self):
+        """
+        start to monitor the connection (if not connected, the first
+        connection attempt is made at once)
+        """
+        self._backoff = backoff()
+        self._watchdog_gen += 1
+        self._watchdog = self.scheduler.after(
+            CON_CHECK_DELAY if self.connected else 0, self.connection_check)
+
+    def watchdog_stop(self):
+        """
+        stop to monitor the connection
+        """
+        self.scheduler.cancel(self._watchdog)
+        self._watchdog = None
+        self._watchdog_gen += 1
+
     def connection_check(self):
         """
         check actuall connection status based on last 'heartbeat'
-        (this function is called asynchronusly every X seconds)
+        (this function is called by the scheduler every X seconds, with
+        increasing delay while OBS is not reachable)
         """
-        debug("... " + "wsclient.connection_check()")
-        diff = time() - self.last_heartbeat # time-diff in seconds
+        sampled("... wsclient.connection_check()")
+        if self.stop:
+            return
+        delay = CON_CHECK_DELAY
+        diff = monotonic() - (self.last_heartbeat or 0) # time-diff in seconds
         # if actually not connected, try to reconnect
         if diff > (CON_CHECK_DELAY + CON_CHECK_DELAY + 1):
-            debug("... . diff = {}, connection = {}/{}".format(
-                str(diff), self.ws.ws.connected, self.connected))
-            self.connection_try()
+            debug("... . diff = %s, connection = %s/%s",
+                  diff, getattr(self.ws.ws, 'connected', False),
+                  self.connected)
+            # (the worker schedules the next check)
+            self._watchdog = self.worker.after(0, self.connection_work,
+                                               self._watchdog_gen)
+            return
         # recheck connection in X seconds
         if not self.stop:
-            Timer(CON_CHECK_DELAY, self.connection_check, ()).start()
+            self._watchdog = self.scheduler.after(delay, self.connection_check)
+
+    def connection_work(self, gen):
+        """
+        try to (re-)connect within the worker (a slow or half-open OBS
+        blocks only the worker), then check again after CON_CHECK_DELAY,
+        or a delay increasing with each failed attempt
+        """
+        if self.connection_try(max_wait=0):
+            self._backoff = backoff()
+            delay = CON_CHECK_DELAY
+        else:
+            delay = next(self._backoff)
+        # (not if the connection check was stopped/restarted meanwhile)
+        if not self.stop and gen == self._watchdog_gen:
+            self._watchdog = self.scheduler.after(delay, self.connection_check)
 
     def connection_start(self):
         """
         initialisation ob OBS websocket
-        """
-        debug("wsclient.connection_start({}:{})".format(
-            self.obs['host'],
-            self.obs['port'],
-            ))
+        (the connection itself is established by the connection check,
+        in the background)
+        """
+        debug("wsclient.connection_start(%s:%s)",
+              self.obs['host'],
+              self.obs['port'])
+        # show "connecting" before loading the OBS client
+        self.connected = False
+        self.last_heartbeat = None
+        self.on_disconnect()
+        self.startup_mark('leds')
+        from obswebsocket import obsws
+        if self.ws:
+            try:
+                self.ws.disconnect()
+            except Exception:
+                pass
         self.ws = obsws(self.obs['host'], self.obs['port'], self.obs['pass'])
         self.register_obs_events()
-        # try to get a connection to OBS
-        while self.connection_try() != True:
-            pass
 
-    def connection_try(self):
+    def connection_try(self, max_wait=PROBE_MAX_WAIT):
         """
-        try to (re-)establish a socket connection to OBS
+        try to (re-)establish a socket connection to OBS,
+        waiting max. max_wait seconds for OBS to be reachable
         """
+        self.connected = False
         self.on_disconnect()
+        # (the outage began with the last heartbeat, not when noticed)
+        self.reconnect_stats.begin(self.last_heartbeat)
         try:
-            # check if host is reachable
-            cmd = "ping -c 1 -w 1 " + self.obs['host'] + " >/dev/null 2>&1 "
-            debug("... . (10s) " + cmd)
-            result = 1
-            # try 10s before given up...
-            for _i in range(0, 20):
-                result = system(cmd)
-                if result == 0:
-                    break
-                sleep(.5)
-            # if host reachable (online) reconnect
-            if result == 0:
-                debug("... . reconnect()")
-                # FIXME: reconnect takes tooooo long!
-                self.ws.reconnect()
-                # if sucessfull reconnected, initialise LEDs
-                if self.ws.ws.connected:
-                    self.on_reconnect()
-                    return True
-            else:
-                debug("... . ping not sucessfull, wait...")
+            # check if the websocket port is reachable,
+            # try max_wait seconds (with increasing delay) before given up...
+            debug("... . probe %s:%s", self.obs['host'], self.obs['port'])
+            if not wait_for_port(self.obs['host'], self.obs['port'],
+                                 timeout=self.probe_timeout(),
+                                 max_wait=max_wait,
+                                 stats=self.reconnect_stats,
+                                 wait=self._stop_event.wait):
+                debug("... . port not reachable, wait...")
                 return False
+            # if port reachable (online) reconnect
+            debug("... . reconnect()")
+            self.ws.reconnect()
+            # if sucessfull reconnected, initialise LEDs
+            if self.ws.ws.connected:
+                self.on_reconnect()
+                debug("... . reconnected after %.3fs (%s)",
+                      self.reconnect_stats.done(), self.reconnect_stats)
+                self.startup_connected()
+                return True
         except Exception as e:
-            debug(">>>> EXCEPTION: " + str(e))
+            debug(">>>> EXCEPTION: %s", e)
             pass
 
+    def defer(self, func, *args):
+        """
+        execute func(*args) later by the worker, outside the websocket
+        receive thread (e.g. to call OBS requests in reaction to an event)
+        """
+        self.worker.after(0, func, *args)
+
+    def probe_timeout(self):
+        """
+        timeout in seconds for the reachability probe,
+        configurable by <probe_timeout> in the XML-file
+        """
+        return float(self.obs.get('probe_timeout') or PROBE_TIMEOUT)
+
     def get_ip_address(self):
         """
-        find out what is my IP-address
+        find out what is my IP-address (of the local interfaces, no
+        default route needed)
         """
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        return s.getsockname()[0]
+        return primary_address()
+
+    def netmonitor_start(self):
+        """
+        start to monitor the local network interfaces
+        (see on_network_change)
+        """
+        if not self.netmonitor:
+            self.netmonitor = start_monitor(
+                lambda: self.defer(self.on_network_change))
+
+    def netmonitor_stop(self):
+        """
+        stop to monitor the local network interfaces
+        """
+        if self.netmonitor:
+            self.netmonitor.stop()
+            self.netmonitor = None
+
+    def startup_mark(self, phase):
+        """
+        end of a startup phase (see _startup), only on the first start
+        """
+        if self.startup and not self.startup.ready:
+            self.startup.mark(phase)
+
+    def startup_done(self):
+        """
+        the tally is up (the LEDs show the connection state): log the
+        startup phases, tell systemd and feed its watchdog
+        """
+        if not self.startup or self.startup.ready:
+            return
+        self.startup.ready = True
+        info("ready: %s", self.startup.summary())
+        if not self.systemd:
+            return
+        sd_notify('READY=1', "STATUS=connecting to OBS {}:{}".format(
+            self.obs['host'], self.obs['port']))
+        interval = watchdog_interval()
+        if interval and not self._sd_watchdog:
+            self._sd_watchdog = self.scheduler.every(
+                interval / 2, sd_notify, 'WATCHDOG=1')
+
+    def startup_connected(self):
+        """
+        connected to OBS: on the first connection, log how long it took
+        """
+        if self.startup and self.startup.ready and self.startup.connected():
+            info("connected to OBS %.3fs after the start",
+                 self.startup.total())
+            if self.systemd:
+                sd_notify("STATUS=connected to OBS {}:{}".format(
+                    self.obs['host'], self.obs['port']))
+
+    def metrics_start(self):
+        """
+        serve the metrics on <metrics_port> (or move them, if the port
+        changed)
+        """
+        port = int(self.obs.get('metrics_port') or 0) or None
+        if self.metrics_port != port:
+            self.metrics_stop()
+        if port and self.metrics_port is None:
+            from _metrics import start
+            if start(port, self.collect_metrics):
+                self.metrics_port = port
+
+    def metrics_stop(self):
+        """
+        do not serve the metrics anymore
+        """
+        if self.metrics_port:
+            from _metrics import stop
+            stop(self.metrics_port, self.collect_metrics)
+            self.metrics_port = None
+
+    def capture_start(self):
+        """
+        capture the events to <capture_file> (or to the new file, if the
+        path changed)
+        """
+        path = self.obs.get('capture_file') or None
+        if self.capture and self.capture.path != path:
+            self.capture_stop()
+        if path and not self.capture:
+            c = capture(path)
+            if c.open():
+                self.capture = c
+
+    def capture_stop(self):
+        """
+        do not capture the events anymore
+        """
+        if self.capture:
+            self.capture.close()
+            self.capture = None
+
+    def collect_metrics(self):
+        """
+        the metric families (see _metrics), called by the metrics server
+        thread when scraped
+
+        Can be extended by inherited classes:
+           families = super(XXX, self).collect_metrics()
+        """
+        from _metrics import histogram
+        labels = {'obs': str(self.instance)}
+        stats = self.reconnect_stats
+        heartbeat = self.last_heartbeat
+        return [
+            ('obstally_connected', 'gauge', "connected to OBS",
+             [('', labels, self.connected)]),
+            ('obstally_stale', 'gauge',
+             "the LEDs show a saved state, not yet confirmed by OBS",
+             [('', labels, self.stale)]),
+            ('obstally_heartbeat_age_seconds', 'gauge',
+             "seconds since the last heartbeat of OBS",
+             [('', labels, monotonic() - heartbeat
+               if heartbeat is not None else None)]),
+            ('obstally_reconnect_attempts_total', 'counter',
+             "attempts to reach OBS", [('', labels, stats.attempts)]),
+            ('obstally_reconnects_total', 'counter',
+             "successful (re-)connects", [('', labels, stats.reconnects)]),
+            histogram('obstally_reconnect_duration_seconds',
+                      "duration of an outage until connected again",
+                      labels, stats.bounds, list(stats.buckets), stats.total),
+            ('obstally_events_total', 'counter', "events received from OBS",
+             [('', dict(labels, type=name), count)
+              for name, count in list(self.event_counts.items())]),
+            ('obstally_startup_seconds', 'gauge',
+             "duration of the startup phases (see _startup)",
+             [('', dict(labels, phase=name), seconds)
+              for name, seconds in list(self.startup.phases)]
+             if self.startup else []),
+            ]
+
+    def reconnect_now(self):
+        """
+        (re-)connect to the actual host at once, without waiting for
+        the connection check
+        """
+        if not self.ws or self.stop:
+            return
+        self.ws.host = self.obs['host']
+        if self._watchdog is None:
+            # not monitored yet (see reload), connects to the new host
+            return
+        self.watchdog_stop()
+        self.last_heartbeat = None
+        self.connection_check()
 
     """
     EVENTS to be extended/overwritten on inheritance
@@ -221,7 +614,7 @@ class wsclient(object):
         signal-processing: 
         received SIGHUP (1), nowadays a request to reload the config
         """
-        print('Signal handler called with signal', signum)
+        info('Signal handler called with signal %s', signum)
         self.reload()
 
     def on_SIGINT(self, signum, frame):
@@ -229,7 +622,7 @@ class wsclient(object):
         received SIGINT (2), interrupt from keyboard (CTRL + C).
         shutdown the programm
         """
-        print('Signal handler called with signal', signum)
+        info('Signal handler called with signal %s', signum)
         self.shutdown()
 
     def on_SIGTERM(self, signum, frame):
@@ -237,10 +630,30 @@ class wsclient(object):
         signal-processing: 
         received SIGTERM (15), Termination signal
         """
-        print('Signal handler called with signal', signum)
+        info('Signal handler called with signal %s', signum)
         self.shutdown()
 
 
+    def on_network_change(self):
+        """
+        the local addresses changed (e.g. Wi-Fi <> Ethernet): select the
+        host again and reconnect at once, if the host changed, an address
+        was removed (the connection may be gone without notice) or not
+        connected
+        """
+        addresses = set(local_addresses())
+        removed = (self._addresses or set()) - addresses
+        self._addresses = addresses
+        host = select_host(self.section.hosts, addresses) \
+            if self.section is not None else None
+        changed = host is not None and host != self.obs['host']
+        info("network changed (%s), host %s", ", ".join(sorted(addresses)),
+             host or self.obs['host'])
+        if changed:
+            self.obs['host'] = host
+        if changed or removed or not self.connected:
+            self.reconnect_now()
+
     def on_disconnect(self):
         """
         perform actions when connection is lost
@@ -248,16 +661,25 @@ class wsclient(object):
         Can be extended by inherited classes:
            super(XXX, self).on_disconnect()
         """
-        if self.obs['gpio_connected']:
-            self.obs['gpio_connected'].blink()
+        self.connected_led(blink=True)
+
+    def on_event(self, message):
+        """
+        count the events received from OBS (see collect_metrics) and
+        capture them (see capture_start)
+        """
+        counts = self.event_counts
+        counts[message.name] = counts.get(message.name, 0) + 1
+        if self.capture:
+            self.capture.write(message)
 
     def on_heartbeat(self, message = None, reason=""):
         """
         memorize last hearbeat received from OBS
         """
-        debug("... " + "wsclient.on_heartbeat({})".format(reason))
+        sampled("... wsclient.on_heartbeat(%s)", reason)
         self.connected = True
-        self.last_heartbeat = time()
+        self.last_heartbeat = monotonic()
 
     def on_reconnect(self):
         """
@@ -271,10 +693,31 @@ class wsclient(object):
         # advice OBS to send us a heartbeat (to monitor the connection)
         # BUG: needs to be reenabled after reconnect
         # BUG: if connection loss is <120s than will receive multiple events
+        from obswebsocket import requests
         self.ws.call(requests.SetHeartbeat(True))
         # update LED to show actual status
-        if self.obs['gpio_connected']:
-            self.obs['gpio_connected'].on()
+        self.connected_led(blink=False)
+
+    def connected_led(self, blink):
+        """
+        connection LED: blinking (trying to connect) or on (connected)
+        """
+        led = self.obs['gpio_connected']
+        if not isinstance(led, output):
+            return
+        if blink:
+            delay = STALE_BLINK_DELAY if self.stale else BLINK_DELAY
+            if self._blink and self._blink_delay != delay:
+                self.scheduler.cancel(self._blink)
+                self._blink = None
+            if not self._blink:
+                led.on()
+                self._blink_delay = delay
+                self._blink = self.scheduler.every(delay, led.toggle)
+        else:
+            self.scheduler.cancel(self._blink)
+            self._blink = None
+            led.on()
 
 
     """
@@ -296,9 +739,44 @@ class wsclient(object):
            super(XXX, self).initialise_leds()
         """
         debug("wsclient.initialise_leds()")
-        if self.obs['gpio_connected']:
-            self.obs['gpio_connected'] = LED(self.obs['gpio_connected'])
-            self.obs['gpio_connected'].off()
+        self.metrics_start()
+        self.capture_start()
+        if self.obs['gpio_connected'] and \
+           not isinstance(self.obs['gpio_connected'], output):
+            self.obs['gpio_connected'] = self.create_output(
+                self.obs['gpio_connected'], self.obs.get('backend_connected'))
+
+    def reconfigure_leds(self, old):
+        """
+        after a reload: keep the LED objects of unchanged GPIOs, release
+        the changed ones and initialise the new ones
+
+        Can be extended by inherited classes:
+           super(XXX, self).reconfigure_leds(old)
+        """
+        debug("wsclient.reconfigure_leds()")
+        led = old['obs']['gpio_connected']
+        if isinstance(led, output):
+            nr = self.obs['gpio_connected']
+            if nr and abs(int(nr)) == led.nr and \
+               (int(nr) > 0) == led.active_high and \
+               self.obs.get('backend_connected') == led.backend.name:
+                self.obs['gpio_connected'] = led
+            else:
+                self.scheduler.cancel(self._blink)
+                self._blink = None
+                led.off()
+                led.close()
+        self.initialise_leds()
+
+    def resync(self):
+        """
+        set the LEDs conforming the known status (e.g. after a reload)
+
+        Can be extended by inherited classes:
+           super(XXX, self).resync()
+        """
+        self.connected_led(blink=not self.connected)
 
     def read_xml_config(self):
         """
@@ -311,41 +789,42 @@ class wsclient(object):
         """
         debug("wsclient.read_xml_config()")
         try:
-            xml = ElementTree.parse(XML_FILE)
-        except ElementTree.ParseError as e:
-            print ("ERROR: mal formed 'config' in XMLfile '{}'".format(
-                   XML_FILE))
-            print (e)
+            self.config = load_config(self.xml_file)
+        except configerror as e:
+            error("%s", e)
             return False
-        self.rootxml = xml.getroot()
+        self.backends = self.config.backends
         try:
-            ip = self.get_ip_address()
-            hostset = False
-            for child in self.rootxml.find('obswebsocket').findall('*'):
-                if "host" == child.tag:
-                    # host can only be set once!
-                    if hostset: continue
-                    if 'network' in child.attrib:
-                        net = child.attrib["network"]
-                        if ip[0:len(net)] == net:
-                            hostset = True
-                        else:
-                            continue
-                    debug(child.tag, child.text)
-                    self.obs[child.tag] = child.text
-                    continue
-                debug(child.tag, child.text)
-                self.obs[child.tag] = child.text
-                # memorize gpio to warn if already in use
-                if "gpio" in child.tag:
-                    self.gpios.append(int(child.text))
-            if not self.obs["host"]:
-                print ("ERROR: no 'host' defined to connect to in XMLfile'{}'".format(
-                    XML_FILE))
-                return False
-        except AttributeError:
-            print ("ERROR: could not find 'obswebsocket' in XMLfile '{}'".format(
-                XML_FILE))
+            self.section = self.config.obs[self.instance]
+        except IndexError:
+            error("could not find 'obswebsocket' no. %s in XMLfile '%s'",
+                  self.instance + 1, self.xml_file)
+            return False
+        self.obs.update(self.section.options)
+        # host can only be set once, the one of a matching network wins
+        self._addresses = set(local_addresses())
+        self.obs['host'] = select_host(self.section.hosts, self._addresses)
+        debug("obs %s", self.obs)
+        # the gpios of this OBS (e.g. gpio_connected)
+        for typ, nr in self.section.gpio.items():
+            backend = self.section.backend[typ]
+            self.obs['gpio_' + typ] = nr
+            self.obs['backend_' + typ] = backend
+            self.gpios.add((backend, abs(nr)))
+        # obs-websocket 4 (default port 4444) or 5 (OBS 28+, port 4455)
+        self.obs['protocol'] = self.obs['protocol'] or 4
+        if self.obs['protocol'] not in self.protocols:
+            error("obs-websocket protocol %s is not supported by %s "
+                  "(use aiotally.py or multitally.py)",
+                  self.obs['protocol'], type(self).__name__)
+            return False
+        if not self.obs["port"]:
+            self.obs["port"] = 4455 if self.obs['protocol'] == 5 else 4444
+        # log level (the environment variable has priority)
+        set_level(self.obs.get('log_level'))
+        if not self.obs["host"]:
+            error("no 'host' defined to connect to in XMLfile '%s'",
+                  self.xml_file)
             return False
         return True
 
@@ -357,6 +836,8 @@ class wsclient(object):
            super(XXX, self).register_obs_events()
         """
         debug("wsclient.register_obs_events()")
+        from obswebsocket import events
+        self.ws.register(self.on_event)
         self.ws.register(self.on_heartbeat, events.Heartbeat)        
 
     def shutdown_leds(self):
@@ -367,10 +848,17 @@ class wsclient(object):
            super(XXX, self).shutdown_leds()
         """
         debug("wsclient.shutdown_leds()")
+        self.metrics_stop()
+        self.capture_stop()
+        if self.scheduler:
+            self.scheduler.cancel(self._blink)
+            self._blink = None
         if self.obs['gpio_connected'] and \
-           isinstance(self.obs['gpio_connected'], LED):
-            self.obs['gpio_connected'].off()
-            self.gpios.remove(int(str(self.obs['gpio_connected'].pin)[4:]))
+           isinstance(self.obs['gpio_connected'], output):
+            led = self.obs['gpio_connected']
+            led.off()
+            led.close()
+            self.gpios.discard((led.backend.name, led.nr))
             self.obs['gpio_connected'] = None
     
 